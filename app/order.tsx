@@ -8,6 +8,7 @@ import {OrderStatus} from "../types";
 import {deriveOrderStatusFromItems, useOrderApi} from "../lib/api/order";
 import {useProductApi} from "../lib/api/product";
 import {IMAGE_URL_PREFIX} from "../constant";
+import {OrderSummaryDto} from "../interfaces/Order.interface";
 
 type Order = {
   id: string;
@@ -23,11 +24,65 @@ export default function Orders() {
   const {listOrders, getOrder} = useOrderApi();
   const {getProduct} = useProductApi();
 
-  const [sections, setSections] = useState<Section[]>([]);
+  const [orders, setOrders] = useState<Order[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [refreshing, setRefreshing] = useState(false);
   const [error, setError] = useState<string | null>(null);
 
+  const toOrders = useCallback(
+    async (summaries: OrderSummaryDto[]): Promise<Order[]> => {
+      const orders: Order[] = [];
+
+      for (const summary of summaries) {
+        const detail = await getOrder(summary.order_number);
+        const rawItems = detail?.items ?? [];
+        const status = deriveOrderStatusFromItems(rawItems);
+
+        let viewItems: { imageUrl?: string }[] = [];
+
+        if (rawItems.length > 0) {
+          const productIds = Array.from(
+            new Set(rawItems.map((it) => it.product_id))
+          );
+          const productResults = await Promise.all(
+            productIds.map(async (pid) => {
+              try {
+                const p = await getProduct(pid);
+                return {pid, product: p};
+              } catch {
+                return {pid, product: null as any};
+              }
+            })
+          );
+          const productMap = new Map<string, any>();
+          productResults.forEach(({pid, product}) => {
+            if (product) productMap.set(pid, product);
+          });
+
+          viewItems = rawItems.map((it) => {
+            const product = productMap.get(it.product_id);
+            let picture: string | undefined = product?.picture_url;
+            if (picture && !/^https?:\/\//i.test(picture)) {
+              picture = IMAGE_URL_PREFIX + picture.replace(/^\/+/, "");
+            }
+            return {imageUrl: picture};
+          });
+        }
+
+        orders.push({
+          id: summary.order_number,
+          createdAt: summary.created_at,
+          status,
+          items: viewItems,
+        });
+      }
+      return orders;
+    },
+    [getOrder, getProduct]
+  );
+
   const loadOrders = useCallback(
     async (isRefresh: boolean = false) => {
       setError(null);
@@ -37,64 +92,13 @@ export default function Orders() {
         setLoading(true);
       }
       try {
-        const summaries = await listOrders();
-        const orders: Order[] = [];
-
-        for (const summary of summaries) {
-          const detail = await getOrder(summary.order_number);
-          const rawItems = detail?.items ?? [];
-          const status = deriveOrderStatusFromItems(rawItems);
-
-          let viewItems: { imageUrl?: string }[] = [];
-
-          if (rawItems.length > 0) {
-            const productIds = Array.from(
-              new Set(rawItems.map((it) => it.product_id))
-            );
-            const productResults = await Promise.all(
-              productIds.map(async (pid) => {
-                try {
-                  const p = await getProduct(pid);
-                  return {pid, product: p};
-                } catch {
-                  return {pid, product: null as any};
-                }
-              })
-            );
-            const productMap = new Map<string, any>();
-            productResults.forEach(({pid, product}) => {
-              if (product) productMap.set(pid, product);
-            });
-
-            viewItems = rawItems.map((it) => {
-              const product = productMap.get(it.product_id);
-              let picture: string | undefined = product?.picture_url;
-              if (picture && !/^https?:\/\//i.test(picture)) {
-                picture = IMAGE_URL_PREFIX + picture.replace(/^\/+/, "");
-              }
-              return {imageUrl: picture};
-            });
-          }
-
-          orders.push({
-            id: summary.order_number,
-            createdAt: summary.created_at,
-            status,
-            items: viewItems,
-          });
-        }
-
-        const active = orders.filter((o) => o.status === "placed");
-        const past = orders.filter((o) => o.status !== "placed");
-
-        const nextSections: Section[] = [];
-        if (active.length > 0) nextSections.push({title: "Active orders", data: active});
-        if (past.length > 0) nextSections.push({title: "Past orders", data: past});
-
-        setSections(nextSections);
+        const page = await listOrders();
+        setOrders(await toOrders(page.results));
+        setNextCursor(page.next_cursor);
       } catch (e: any) {
         setError(e?.message || "Failed to load orders");
-        setSections([]);
+        setOrders([]);
+        setNextCursor(null);
       } finally {
         if (isRefresh) {
           setRefreshing(false);
@@ -103,9 +107,35 @@ export default function Orders() {
         }
       }
     },
-    [listOrders, getOrder, getProduct]
+    [listOrders, toOrders]
   );
 
+  // older orders are loaded a page at a time while scrolling
+  const loadMore = useCallback(async () => {
+    if (!nextCursor || loading || loadingMore || refreshing) return;
+    setLoadingMore(true);
+    try {
+      const page = await listOrders(nextCursor);
+      const more = await toOrders(page.results);
+      setOrders((prev) => [...prev, ...more]);
+      setNextCursor(page.next_cursor);
+    } catch (e: any) {
+      setError(e?.message || "Failed to load orders");
+    } finally {
+      setLoadingMore(false);
+    }
+  }, [nextCursor, loading, loadingMore, refreshing, listOrders, toOrders]);
+
+  const sections = useMemo(() => {
+    const active = orders.filter((o) => o.status === "placed");
+    const past = orders.filter((o) => o.status !== "placed");
+
+    const nextSections: Section[] = [];
+    if (active.length > 0) nextSections.push({title: "Active orders", data: active});
+    if (past.length > 0) nextSections.push({title: "Past orders", data: past});
+    return nextSections;
+  }, [orders]);
+
   useEffect(() => {
     loadOrders(false);
   }, [loadOrders]);
@@ -158,6 +188,9 @@ export default function Orders() {
         stickySectionHeadersEnabled={false}
         refreshing={refreshing}
         onRefresh={onRefresh}
+        onEndReached={loadMore}
+        onEndReachedThreshold={0.5}
+        ListFooterComponent={loadingMore ? <ActivityIndicator/> : null}
         ListEmptyComponent={
           <View style={styles.center}>
             {loading ? (
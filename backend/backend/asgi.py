@@ -13,11 +13,12 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
 
 import chat.urls
+from user.middleware import JWTAuthMiddleware
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 http_application = get_asgi_application()
-ws_application = URLRouter(chat.urls.websocket_urlpatterns)
+ws_application = JWTAuthMiddleware(URLRouter(chat.urls.websocket_urlpatterns))
 
 application = ProtocolTypeRouter({
     'http': http_application,
@@ -0,0 +1,105 @@
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from django.conf import settings
+from django.db import close_old_connections
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pillow is optional, without it images are served as uploaded
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = (160, 480, 960)
+# format name of pillow and file extension of every variant format
+VARIANT_FORMATS = {"webp": "webp", "jpeg": "jpg"}
+VARIANT_QUALITY = 80
+
+# resizing runs off the request thread, pillow releases the gil while encoding
+_executor = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="image-variants")
+
+
+def variant_path(path: str, width: int, fmt: str) -> str:
+    """
+    path of a variant next to its original, e.g. backend/imageStorage/abc_160w.webp
+    """
+    stem, _ = os.path.splitext(path)
+    return f"{stem}_{width}w.{VARIANT_FORMATS[fmt]}"
+
+
+def _save_atomically(image, path: str, fmt: str):
+    target = os.path.join(settings.BASE_DIR, path)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".variant-")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            image.save(file, format=fmt.upper(), quality=VARIANT_QUALITY)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, target)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def generate_variants(path: str) -> dict[str, dict[str, str]]:
+    """
+    write downscaled webp and jpeg copies of an image at VARIANT_WIDTHS, widths not smaller than
+    the original are skipped, the original is never upscaled
+    images are content addressed (see imageService.store_upload), so variants already written for
+    the same path are reused instead of encoded again
+    return the variant paths by width and format, e.g. {"160": {"webp": ..., "jpeg": ...}},
+    empty if pillow is not installed or the file is not a decodable image
+    """
+    if Image is None:
+        return {}
+    original = None
+    variants = {}
+    for width in VARIANT_WIDTHS:
+        paths = {fmt: variant_path(path, width, fmt) for fmt in VARIANT_FORMATS}
+        if all(os.path.exists(os.path.join(settings.BASE_DIR, p)) for p in paths.values()):
+            variants[str(width)] = paths
+            continue
+        if original is None:
+            try:
+                with Image.open(os.path.join(settings.BASE_DIR, path)) as image:
+                    original = ImageOps.exif_transpose(image).convert("RGB")
+            except (OSError, Image.DecompressionBombError):
+                logger.warning(f"cannot decode image {path}, no variants generated")
+                return {}
+        if width >= original.width:
+            continue
+        resized = original.resize((width, max(1, round(original.height * width / original.width))),
+                                  Image.Resampling.LANCZOS)
+        for fmt, variant in paths.items():
+            _save_atomically(resized, variant, fmt)
+        variants[str(width)] = paths
+    logger.info(f"generated {len(variants)} variant widths of {path}")
+    return variants
+
+
+def _run(path: str, on_done: Callable[[dict], None]):
+    # the worker threads outlive requests, like a request they drop connections past CONN_MAX_AGE or
+    # broken by the server, otherwise on_done writes through a connection mysql closed long ago
+    close_old_connections()
+    try:
+        variants = generate_variants(path)
+        if variants:
+            on_done(variants)
+    except Exception:
+        logger.exception(f"generate image variants of {path} error")
+    finally:
+        close_old_connections()
+
+
+def submit(path: str, on_done: Callable[[dict], None]):
+    """
+    generate the variants of a stored image in the background, on_done receives the variant
+    paths once they are written, it is not called if no variant was generated
+    """
+    if Image is None:
+        logger.debug("pillow not installed, image variants skipped")
+        return
+    _executor.submit(_run, path, on_done)
@@ -0,0 +1,230 @@
+import hashlib
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from backend import imagePipeline
+from backend.models import ImageBlob, ImageUpload
+
+logger = logging.getLogger(__name__)
+
+# images are stored below the backend directory, which nginx serves as is
+PRODUCT_IMAGE_DIR = "backend/imageStorage"
+CHAT_IMAGE_DIR = "chat_images"
+
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+# room for the other form fields and the multipart boundaries of an upload request
+MAX_FORM_OVERHEAD_BYTES = 64 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+def request_too_large(request, max_bytes: int | None = None) -> bool:
+    """
+    check the declared body size of an upload request before django reads and spools the body,
+    call it before touching request.data or request.FILES
+    """
+    try:
+        content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        return False
+    return content_length > (max_bytes or MAX_IMAGE_BYTES) + MAX_FORM_OVERHEAD_BYTES
+
+
+def _write_atomically(chunks, directory: str, filename: str, max_bytes: int, sha256: str | None = None) -> int:
+    """
+    stream chunks into a temp file next to directory/filename, fsync and rename it into place,
+    readers never see a partial image
+    if sha256 is given the content must be exactly max_bytes bytes with that sha256
+    return the number of bytes written
+    raise ValueError if more than max_bytes arrive or the content does not match
+    """
+    target_dir = os.path.join(settings.BASE_DIR, directory)
+    os.makedirs(target_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=target_dir, prefix=".upload-")
+    digest = hashlib.sha256()
+    try:
+        written = 0
+        with os.fdopen(fd, "wb") as file:
+            for chunk in chunks:
+                written += len(chunk)
+                # the declared size is not trusted
+                if written > max_bytes:
+                    raise ValueError(f"image larger than {max_bytes} bytes")
+                file.write(chunk)
+                digest.update(chunk)
+            if sha256 is not None and written != max_bytes:
+                raise ValueError(f"expected {max_bytes} bytes, received {written}")
+            if sha256 is not None and digest.hexdigest() != sha256:
+                raise ValueError("image content does not match its sha256")
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, os.path.join(target_dir, filename))
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    logger.info(f"stored {written} bytes image {directory}/{filename}")
+    return written
+
+
+def save_upload(uploaded: UploadedFile, directory: str, filename: str, max_bytes: int | None = None) -> str:
+    """
+    write an uploaded file to directory/filename, relative to the backend directory
+    1. reject files larger than max_bytes before reading them
+    2. stream the chunks into a temp file in the same directory, so memory use does not grow with the file
+    3. fsync and rename the temp file into place, readers never see a partial image
+    return the relative path of the stored file
+    raise ValueError if the file is too large
+    """
+    max_bytes = max_bytes or MAX_IMAGE_BYTES
+    if uploaded.size is not None and uploaded.size > max_bytes:
+        raise ValueError(f"image larger than {max_bytes} bytes")
+    _write_atomically(uploaded.chunks(CHUNK_SIZE), directory, filename, max_bytes)
+    return f"{directory}/{filename}"
+
+
+def save_stream(stream, path: str, size: int, sha256: str):
+    """
+    write exactly size bytes read from a file-like stream, such as a request body, to path
+    the file only replaces path if its content matches sha256
+    raise ValueError if the body is not size bytes or does not match sha256
+    """
+    directory, filename = os.path.split(path)
+    _write_atomically(iter(lambda: stream.read(CHUNK_SIZE), b""), directory, filename, size, sha256)
+
+
+def hash_upload(uploaded: UploadedFile, max_bytes: int | None = None) -> str:
+    """
+    sha256 of an upload, read chunk by chunk
+    raise ValueError if the file is too large
+    """
+    max_bytes = max_bytes or MAX_IMAGE_BYTES
+    if uploaded.size is not None and uploaded.size > max_bytes:
+        raise ValueError(f"image larger than {max_bytes} bytes")
+    digest = hashlib.sha256()
+    read = 0
+    for chunk in uploaded.chunks(CHUNK_SIZE):
+        read += len(chunk)
+        if read > max_bytes:
+            raise ValueError(f"image larger than {max_bytes} bytes")
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_file(path: str) -> str:
+    """
+    sha256 of a stored file, path is relative to the backend directory
+    """
+    digest = hashlib.sha256()
+    with open(os.path.join(settings.BASE_DIR, path), "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stored_path(directory: str, sha256: str) -> str | None:
+    """
+    path of the image stored with this content, none if it is not stored, no reference is taken
+    """
+    return ImageBlob.objects.filter(directory=directory, sha256=sha256).values_list("path", flat=True).first()
+
+
+def reference_existing(directory: str, sha256: str) -> str | None:
+    """
+    add a reference to an image already stored with this content
+    return its path, none if the content is not stored yet
+    """
+    updated = ImageBlob.objects.filter(directory=directory, sha256=sha256).update(ref_count=F("ref_count") + 1)
+    if not updated:
+        return None
+    logger.info(f"duplicate image {sha256} in {directory}, not written")
+    return ImageBlob.objects.values_list("path", flat=True).get(directory=directory, sha256=sha256)
+
+
+def register(directory: str, sha256: str, path: str, size: int) -> str:
+    """
+    record a newly written image with one reference
+    return the path of the stored image, which is the path of a concurrent upload of the same content if it won
+    """
+    try:
+        with transaction.atomic():
+            ImageBlob.objects.create(directory=directory, sha256=sha256, path=path, size=size, ref_count=1)
+    except IntegrityError:
+        # a concurrent upload of the same content won, the file it wrote has the same bytes
+        return reference_existing(directory, sha256)
+    return path
+
+
+def store_upload(uploaded: UploadedFile, directory: str, ext: str, max_bytes: int | None = None) -> tuple[str, bool]:
+    """
+    store an upload once per content in directory, named after the sha256 of its content
+    1. hash the upload while streaming it, nothing is written yet
+    2. if the same content is stored already, add a reference and return its path without writing
+    3. otherwise write it with save_upload and record it with one reference
+    return the relative path and whether the file was written
+    raise ValueError if the file is too large
+    """
+    sha256 = hash_upload(uploaded, max_bytes)
+    path = reference_existing(directory, sha256)
+    if path is not None:
+        return path, False
+
+    path = save_upload(uploaded, directory, f"{sha256}{ext.lower()}", max_bytes)
+    return register(directory, sha256, path, uploaded.size), True
+
+
+def claim_upload(user_id: int, path: str, purpose: str) -> bool:
+    """
+    hand the reference of an image this user uploaded directly to the object using it now, such as a
+    product saved with the path as its picture, each completed upload is claimed once
+    return false if the user has no unclaimed completed upload of path for this purpose
+    """
+    with transaction.atomic():
+        upload = (ImageUpload.objects.select_for_update()
+                  .filter(user_id=user_id, path=path, purpose=purpose, claimed=False).first())
+        if upload is None:
+            return False
+        upload.claimed = True
+        upload.save(update_fields=["claimed"])
+    return True
+
+
+def release(path: str):
+    """
+    drop a reference to a stored image, the image and its variants are deleted with the last reference
+    paths not in the store, such as pictures stored before deduplication, are left alone
+    """
+    with transaction.atomic():
+        blob = ImageBlob.objects.select_for_update().filter(path=path).first()
+        if blob is None:
+            return
+        if blob.ref_count > 1:
+            ImageBlob.objects.filter(pk=blob.pk).update(ref_count=F("ref_count") - 1)
+            return
+        blob.delete()
+        # unlinked while the row is still locked, an upload of the same content waits on it in
+        # reference_existing and writes its file after this commit, unlinking after the commit could
+        # remove the file that upload just registered
+        delete_file(path)
+    logger.info(f"image {path} has no reference left, deleted")
+
+
+def delete_file(path: str):
+    """
+    delete a stored image and its variants, missing files are ignored
+    """
+    paths = [path] + [imagePipeline.variant_path(path, width, fmt)
+                      for width in imagePipeline.VARIANT_WIDTHS for fmt in imagePipeline.VARIANT_FORMATS]
+    for relative_path in paths:
+        try:
+            os.remove(os.path.join(settings.BASE_DIR, relative_path))
+        except FileNotFoundError:
+            pass
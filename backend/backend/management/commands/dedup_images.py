@@ -0,0 +1,104 @@
+import os
+import re
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import F, Value
+from django.db.models.functions import Replace
+
+from backend import imageService
+from backend.globalvars import get_es_client, init_es_client
+from backend.models import ImageBlob
+from chat.models import ChatMessage
+from product import productSearchCache
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic"}
+# variants are derived from their original and regenerated, they are not deduplicated
+VARIANT_NAME = re.compile(r"_\d+w\.[a-z]+$")
+
+REWRITE_PICTURE_SCRIPT = "ctx._source.picture_url = params.path; ctx._source.picture_variants = [:]"
+
+
+class Command(BaseCommand):
+    help = "deduplicate the existing chat_images/ and backend/imageStorage/ trees into the content-addressed store"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="only report what would be merged")
+
+    def handle(self, *args, **options):
+        dry_run = options["dry_run"]
+        if not dry_run:
+            init_es_client()
+        saved = 0
+        for directory in (imageService.CHAT_IMAGE_DIR, imageService.PRODUCT_IMAGE_DIR):
+            saved += self.dedup_directory(directory, dry_run)
+        if not dry_run:
+            productSearchCache.invalidate()
+        verb = "would free" if dry_run else "freed"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {saved} bytes"))
+
+    def dedup_directory(self, directory: str, dry_run: bool) -> int:
+        """
+        merge files of a directory with the same content into one file named after their sha256
+        1. hash every original image in the directory
+        2. move the first file of every group to its content-addressed name, delete the others
+        3. point chat messages and products using a removed name at the kept file
+        4. record the kept file in the store with one reference per merged file
+        return the number of bytes freed
+        """
+        root = os.path.join(settings.BASE_DIR, directory)
+        if not os.path.isdir(root):
+            return 0
+        groups = defaultdict(list)
+        for name in sorted(os.listdir(root)):
+            ext = os.path.splitext(name)[1].lower()
+            if name.startswith(".") or ext not in IMAGE_EXTENSIONS or VARIANT_NAME.search(name):
+                continue
+            if os.path.isfile(os.path.join(root, name)):
+                groups[imageService.hash_file(f"{directory}/{name}")].append(name)
+
+        freed = 0
+        for sha256, names in groups.items():
+            known = ImageBlob.objects.filter(directory=directory, sha256=sha256).first()
+            target = known.path if known else f"{directory}/{sha256}{os.path.splitext(names[0])[1].lower()}"
+            moved = [f"{directory}/{name}" for name in names if f"{directory}/{name}" != target]
+            if not moved:
+                continue
+            size = os.path.getsize(os.path.join(settings.BASE_DIR, moved[0]))
+            freed += size * (len(names) - 1)
+            self.stdout.write(f"{', '.join(moved)} -> {target}")
+            if dry_run:
+                continue
+
+            target_exists = os.path.exists(os.path.join(settings.BASE_DIR, target))
+            for path in moved:
+                self.rewrite_references(path, target)
+                if not target_exists:
+                    os.replace(os.path.join(settings.BASE_DIR, path), os.path.join(settings.BASE_DIR, target))
+                    target_exists = True
+                imageService.delete_file(path)
+
+            if known:
+                ImageBlob.objects.filter(pk=known.pk).update(ref_count=F("ref_count") + len(moved))
+            else:
+                ImageBlob.objects.create(directory=directory, sha256=sha256, path=target, size=size,
+                                         ref_count=len(names))
+        return freed
+
+    def rewrite_references(self, old_path: str, new_path: str):
+        """
+        point the chat messages and products stored with old_path at new_path, the variants of the old
+        file are dropped and generated again on the next upload
+        """
+        updated = ChatMessage.objects.filter(image_url__endswith=f"/{old_path}").update(
+            image_url=Replace("image_url", Value(old_path), Value(new_path)), image_variants={})
+        es = get_es_client()
+        es_result = es.update_by_query(
+            index="product",
+            query={"term": {"picture_url": old_path}},
+            script={"source": REWRITE_PICTURE_SCRIPT, "lang": "painless", "params": {"path": new_path}},
+            refresh=True,
+            conflicts="proceed",
+        )
+        self.stdout.write(f"  {updated} messages, {es_result.get('updated', 0)} products updated")
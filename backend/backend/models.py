@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.db import models
+
+
+class ImageBlob(models.Model):
+    """
+    an image stored once under the sha256 of its content, ref_count is the number of products and
+    chat uploads using it, see backend.imageService.store_upload
+    """
+    directory = models.CharField(max_length=100)
+    sha256 = models.CharField(max_length=64)
+    path = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["directory", "sha256"], name="imageblob_directory_sha256_uniq"),
+        ]
+
+
+class ImageUpload(models.Model):
+    """
+    a direct upload a user completed, recorded once per upload id so completing it again takes no
+    second reference, see backend.views.uploadView.CompleteUploadView
+    the upload holds one reference to its image, a chat message sent with it keeps that reference,
+    a product picture upload hands it to the product that claims it, see imageService.claim_upload
+    """
+    key = models.CharField(max_length=32, unique=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="+", on_delete=models.CASCADE)
+    purpose = models.CharField(max_length=20)
+    path = models.CharField(max_length=255)
+    claimed = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "path"], name="imageupload_user_path_idx"),
+        ]
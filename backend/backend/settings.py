@@ -212,4 +212,22 @@ SIMPLE_JWT = {
     "ALGORITHM": "HS256",
     "SIGNING_KEY": SECRET_KEY,
     "AUTH_HEADER_TYPES": ("Bearer",),
-}
\ No newline at end of file
+}
+# chat
+# when enabled, chat messages are forwarded first and persisted in batches by
+# `python manage.py drain_chat_messages` from a redis stream
+CHAT_WRITE_BEHIND = os.environ.get("CHAT_WRITE_BEHIND", "false").lower() == "true"
+CHAT_REDIS_URL = CHANNEL_LAYERS["default"]["CONFIG"]["hosts"][0]
+
+# clients upload images straight to this storage with a signed url, see backend.uploadStorage
+# LocalUploadStorage writes below the backend directory, S3UploadStorage needs boto3 and an s3 compatible bucket
+IMAGE_UPLOAD_STORAGE = os.environ.get("IMAGE_UPLOAD_STORAGE", "backend.uploadStorage.LocalUploadStorage")
+IMAGE_UPLOAD_URL_EXPIRES_SECONDS = int(os.environ.get("IMAGE_UPLOAD_URL_EXPIRES_SECONDS", "300"))
+IMAGE_UPLOAD_S3 = {
+    "endpoint_url": os.environ.get("IMAGE_UPLOAD_S3_ENDPOINT"),
+    "bucket": os.environ.get("IMAGE_UPLOAD_S3_BUCKET", "images"),
+    "access_key": os.environ.get("IMAGE_UPLOAD_S3_ACCESS_KEY"),
+    "secret_key": os.environ.get("IMAGE_UPLOAD_S3_SECRET_KEY"),
+    "region": os.environ.get("IMAGE_UPLOAD_S3_REGION"),
+    "public_url": os.environ.get("IMAGE_UPLOAD_S3_PUBLIC_URL", ""),
+}
@@ -0,0 +1,160 @@
+import hashlib
+import os
+import tempfile
+import uuid
+from unittest.mock import patch
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from backend import imageService
+from backend.models import ImageBlob, ImageUpload
+from user.models import User
+
+
+def use_temporary_image_storage(test: TestCase):
+    """
+    store the images of a test in a temporary directory instead of the directories nginx serves
+    """
+    base_dir = test.enterContext(tempfile.TemporaryDirectory())
+    test.enterContext(override_settings(BASE_DIR=base_dir))
+    for directory in (imageService.PRODUCT_IMAGE_DIR, imageService.CHAT_IMAGE_DIR):
+        os.makedirs(os.path.join(base_dir, directory))
+
+
+@patch("chat.chatService.submit_image_variants")
+class DirectUploadTest(TestCase):
+    def setUp(self):
+        use_temporary_image_storage(self)
+        self.client = APIClient()
+        self.user = User.objects.create_user(email="alice@example.com", username="alice", password="Passw0rd!")
+        self.client.force_authenticate(user=self.user)
+        self.content = b"\x89PNG" + uuid.uuid4().bytes
+        self.sha256 = hashlib.sha256(self.content).hexdigest()
+
+    def presign(self, **overrides):
+        body = {"purpose": "chat", "content_type": "image/png", "size": len(self.content), "sha256": self.sha256}
+        return self.client.post("/api/upload/presign/", {**body, **overrides}, format="json")
+
+    def test_upload_straight_to_storage(self, mock_variants):
+        r = self.presign()
+        self.assertEqual(r.status_code, status.HTTP_201_CREATED, r.content)
+        upload = r.data["upload"]
+        self.assertEqual(upload["method"], "PUT")
+        self.assertTrue(upload["url"].startswith("http://testserver/api/upload/local/"))
+
+        put = APIClient().generic("PUT", upload["url"], self.content, content_type=upload["headers"]["Content-Type"])
+        self.assertEqual(put.status_code, 200)
+
+        r = self.client.post("/api/upload/complete/", {"upload_id": r.data["upload_id"]}, format="json")
+        self.assertEqual(r.status_code, status.HTTP_201_CREATED, r.content)
+        self.assertEqual(r.data["path"], f"chat_images/{self.sha256}.png")
+        self.assertEqual(r.data["url"], f"http://testserver/chat_images/{self.sha256}.png")
+        with open(os.path.join(settings.BASE_DIR, r.data["path"]), "rb") as file:
+            self.assertEqual(file.read(), self.content)
+        mock_variants.assert_called_once_with(r.data["path"], r.data["url"])
+
+        # the same content again is not uploaded, the reference is only taken on completion
+        again = self.presign()
+        self.assertEqual(again.status_code, status.HTTP_200_OK)
+        self.assertTrue(again.data["exists"])
+        self.assertEqual(again.data["path"], r.data["path"])
+        self.assertNotIn("upload", again.data)
+        self.assertEqual(ImageBlob.objects.get().ref_count, 1)
+        r = self.client.post("/api/upload/complete/", {"upload_id": again.data["upload_id"]}, format="json")
+        self.assertEqual(r.status_code, status.HTTP_200_OK, r.content)
+        self.assertEqual(r.data["path"], again.data["path"])
+        self.assertEqual(ImageBlob.objects.get().ref_count, 2)
+
+    def test_complete_is_idempotent(self, mock_variants):
+        r = self.presign()
+        APIClient().generic("PUT", r.data["upload"]["url"], self.content, content_type="image/png")
+        for expected in (status.HTTP_201_CREATED, status.HTTP_200_OK):
+            complete = self.client.post("/api/upload/complete/", {"upload_id": r.data["upload_id"]}, format="json")
+            self.assertEqual(complete.status_code, expected, complete.content)
+            self.assertEqual(complete.data["path"], f"chat_images/{self.sha256}.png")
+        self.assertEqual(ImageBlob.objects.get().ref_count, 1)
+        self.assertEqual(ImageUpload.objects.get().user, self.user)
+
+    def test_body_not_matching_signature_refused(self, mock_variants):
+        r = self.presign()
+        upload = r.data["upload"]
+        tampered = self.content[:-1] + b"!"
+        put = APIClient().generic("PUT", upload["url"], tampered, content_type="image/png")
+        self.assertEqual(put.status_code, 400)
+        self.assertFalse(os.path.exists(os.path.join(settings.BASE_DIR, f"chat_images/{self.sha256}.png")))
+
+        put = APIClient().generic("PUT", upload["url"][:-2] + "x/", self.content, content_type="image/png")
+        self.assertEqual(put.status_code, 403)
+
+        complete = self.client.post("/api/upload/complete/", {"upload_id": r.data["upload_id"]}, format="json")
+        self.assertEqual(complete.status_code, 400)
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_complete_by_other_user_forbidden(self, mock_variants):
+        r = self.presign()
+        other = User.objects.create_user(email="bob@example.com", username="bob", password="Passw0rd!")
+        client = APIClient()
+        client.force_authenticate(user=other)
+        complete = client.post("/api/upload/complete/", {"upload_id": r.data["upload_id"]}, format="json")
+        self.assertEqual(complete.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_presign_validation(self, mock_variants):
+        self.assertEqual(self.presign(purpose="avatar").status_code, 400)
+        self.assertEqual(self.presign(content_type="text/plain").status_code, 400)
+        self.assertEqual(self.presign(size=11 * 1024 * 1024).status_code, 400)
+        self.assertEqual(self.presign(sha256="abc").status_code, 400)
+
+
+class ImageServingTest(TestCase):
+    def setUp(self):
+        use_temporary_image_storage(self)
+        self.content = bytes(range(256)) * 4
+        self.sha256 = hashlib.sha256(self.content).hexdigest()
+        self.paths = [f"chat_images/{self.sha256}.jpg", f"chat_images/test-{uuid.uuid4().hex}.jpg"]
+        for path in self.paths:
+            with open(os.path.join(settings.BASE_DIR, path), "wb") as file:
+                file.write(self.content)
+
+    def test_content_addressed_image_is_immutable(self):
+        r = self.client.get(f"/{self.paths[0]}")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(b"".join(r.streaming_content), self.content)
+        self.assertEqual(r["ETag"], f'"{self.sha256}"')
+        self.assertEqual(r["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertEqual(r["Content-Type"], "image/jpeg")
+
+        r = self.client.get(f"/{self.paths[0]}", HTTP_IF_NONE_MATCH=f'"{self.sha256}"')
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(r["ETag"], f'"{self.sha256}"')
+
+    def test_legacy_name_revalidates_with_content_hash(self):
+        r = self.client.get(f"/{self.paths[1]}")
+        self.assertEqual(r["ETag"], f'"{self.sha256}"')
+        self.assertEqual(r["Cache-Control"], "public, no-cache")
+        r = self.client.get(f"/{self.paths[1]}", HTTP_IF_NONE_MATCH=r["ETag"])
+        self.assertEqual(r.status_code, 304)
+
+    def test_byte_ranges(self):
+        url = f"/{self.paths[0]}"
+        r = self.client.get(url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(b"".join(r.streaming_content), self.content[10:20])
+        self.assertEqual(r["Content-Range"], f"bytes 10-19/{len(self.content)}")
+
+        r = self.client.get(url, HTTP_RANGE="bytes=-5")
+        self.assertEqual(b"".join(r.streaming_content), self.content[-5:])
+
+        r = self.client.get(url, HTTP_RANGE=f"bytes={len(self.content)}-")
+        self.assertEqual(r.status_code, 416)
+        self.assertEqual(r["Content-Range"], f"bytes */{len(self.content)}")
+
+        # a range of another version is ignored, the whole current file is sent
+        r = self.client.get(url, HTTP_RANGE="bytes=10-19", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(r.status_code, 200)
+
+    def test_missing_image(self):
+        self.assertEqual(self.client.get(f"/chat_images/{'0' * 64}.jpg").status_code, 404)
+        self.assertEqual(self.client.get("/chat_images/.upload-x").status_code, 404)
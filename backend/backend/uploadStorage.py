@@ -0,0 +1,175 @@
+import base64
+import logging
+import os
+from abc import ABC, abstractmethod
+from functools import cache
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# extension of the stored file by content type, other types are not accepted for direct uploads
+IMAGE_CONTENT_TYPES = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/heic": ".heic",
+}
+
+LOCAL_UPLOAD_SALT = "backend.uploadStorage.local"
+
+
+class UploadStorage(ABC):
+    """
+    storage clients upload images to directly, the app server only signs the upload and checks the
+    result, it never receives the image body
+    paths are relative keys such as chat_images/<sha256>.jpg, the same keys the content-addressed
+    store records, see imageService.register
+    """
+    # whether stored objects are files below the backend directory, variants are only generated for those
+    is_local = False
+
+    @abstractmethod
+    def presign_put(self, path: str, content_type: str, size: int, sha256: str, expires_in: int) -> dict:
+        """
+        sign a single PUT of exactly size bytes with this sha256 to path
+        return {"url", "method", "headers"}, the client sends the headers with the body
+        """
+
+    @abstractmethod
+    def verify(self, path: str, size: int, sha256: str) -> bool:
+        """
+        check the object at path exists with the signed size and content
+        """
+
+    @abstractmethod
+    def delete(self, path: str):
+        """
+        delete the object at path, a missing object is ignored
+        """
+
+    @abstractmethod
+    def url(self, path: str) -> str:
+        """
+        public url of a stored object, relative urls are resolved against the request host
+        """
+
+
+class LocalUploadStorage(UploadStorage):
+    """
+    filesystem stand-in for an s3 bucket, used in development and tests
+    the signed url points at LocalUploadView, which streams the body into the backend directory that
+    nginx serves, so it still passes through the app server
+    """
+    is_local = True
+
+    def presign_put(self, path: str, content_type: str, size: int, sha256: str, expires_in: int) -> dict:
+        token = signing.dumps({"path": path, "size": size, "sha256": sha256, "expires_in": expires_in},
+                              salt=LOCAL_UPLOAD_SALT)
+        return {
+            "url": reverse("upload-local", args=[token]),
+            "method": "PUT",
+            "headers": {"Content-Type": content_type},
+        }
+
+    @staticmethod
+    def load_token(token: str) -> dict:
+        """
+        read the upload signed by presign_put
+        raise signing.BadSignature if the token is forged or expired
+        """
+        unverified = signing.loads(token, salt=LOCAL_UPLOAD_SALT)
+        return signing.loads(token, salt=LOCAL_UPLOAD_SALT, max_age=unverified["expires_in"])
+
+    def verify(self, path: str, size: int, sha256: str) -> bool:
+        # LocalUploadView only moves a body into place once its sha256 matched the signed one
+        try:
+            return os.path.getsize(os.path.join(settings.BASE_DIR, path)) == size
+        except OSError:
+            return False
+
+    def delete(self, path: str):
+        try:
+            os.remove(os.path.join(settings.BASE_DIR, path))
+        except FileNotFoundError:
+            pass
+
+    def url(self, path: str) -> str:
+        return f"/{path}"
+
+
+class S3UploadStorage(UploadStorage):
+    """
+    any s3 compatible bucket, e.g. minio, configured with IMAGE_UPLOAD_S3
+    s3 checks the signed length and sha256 checksum itself, a body that does not match is refused
+    needs boto3, which is only imported when this storage is configured
+    """
+
+    def __init__(self):
+        try:
+            import boto3
+        except ImportError as e:
+            raise ImproperlyConfigured("S3UploadStorage requires boto3") from e
+        config = settings.IMAGE_UPLOAD_S3
+        self.bucket = config["bucket"]
+        self.public_url = config["public_url"].rstrip("/")
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=config["endpoint_url"],
+            aws_access_key_id=config["access_key"],
+            aws_secret_access_key=config["secret_key"],
+            region_name=config.get("region") or "us-east-1",
+        )
+
+    @staticmethod
+    def _checksum(sha256: str) -> str:
+        return base64.b64encode(bytes.fromhex(sha256)).decode("ascii")
+
+    def presign_put(self, path: str, content_type: str, size: int, sha256: str, expires_in: int) -> dict:
+        url = self.client.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": path,
+                "ContentType": content_type,
+                "ContentLength": size,
+                "ChecksumSHA256": self._checksum(sha256),
+            },
+            ExpiresIn=expires_in,
+        )
+        return {
+            "url": url,
+            "method": "PUT",
+            "headers": {"Content-Type": content_type, "x-amz-checksum-sha256": self._checksum(sha256)},
+        }
+
+    def verify(self, path: str, size: int, sha256: str) -> bool:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=path, ChecksumMode="ENABLED")
+        except self.client.exceptions.ClientError:
+            return False
+        return head["ContentLength"] == size and head.get("ChecksumSHA256") == self._checksum(sha256)
+
+    def delete(self, path: str):
+        self.client.delete_object(Bucket=self.bucket, Key=path)
+
+    def url(self, path: str) -> str:
+        return f"{self.public_url}/{path}"
+
+
+@cache
+def _load_storage(class_path: str) -> UploadStorage:
+    logger.info(f"image upload storage {class_path}")
+    return import_string(class_path)()
+
+
+def get_upload_storage() -> UploadStorage:
+    """
+    the storage configured with IMAGE_UPLOAD_STORAGE, created once per process
+    """
+    return _load_storage(settings.IMAGE_UPLOAD_STORAGE)
@@ -19,6 +19,10 @@ from django.urls import path, include
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
 from rest_framework_simplejwt.views import TokenRefreshView, TokenVerifyView
 
+from backend import imageService
+from backend.views.imageView import ImageView
+from backend.views.uploadView import CompleteUploadView, LocalUploadView, PresignUploadView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
 
@@ -27,6 +31,14 @@ urlpatterns = [
     path('api/product/', include('product.urls')),
     path('api/order/', include('order.urls')),
 
+    path('api/upload/presign/', PresignUploadView.as_view(), name='upload-presign'),
+    path('api/upload/complete/', CompleteUploadView.as_view(), name='upload-complete'),
+    path('api/upload/local/<str:token>/', LocalUploadView.as_view(), name='upload-local'),
+
+    path('chat_images/<str:name>', ImageView.as_view(directory=imageService.CHAT_IMAGE_DIR), name='chat-image'),
+    path('backend/imageStorage/<str:name>', ImageView.as_view(directory=imageService.PRODUCT_IMAGE_DIR),
+         name='product-image'),
+
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),        # OpenAPI JSON
     path('api/docs/', SpectacularSwaggerView.as_view(), name='swagger-ui'),  # SwaggerUI
     path('api/redoc/', SpectacularRedocView.as_view(), name='redoc'),
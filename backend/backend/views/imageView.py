@@ -0,0 +1,121 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views import View
+
+from backend import imageService
+
+# a content-addressed name never changes content, see imageService.store_upload
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+CONTENT_HASH_NAME = re.compile(r"^(?P<sha256>[0-9a-f]{64})(?P<variant>_\d+w)?\.[a-z]+$")
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def image_etag(path: str, stat: os.stat_result) -> tuple[str, bool]:
+    """
+    strong etag of a stored image and whether it is immutable
+    content-addressed names carry their hash, older names are hashed once per modification, the
+    hash is cached under their mtime and size
+    """
+    match = CONTENT_HASH_NAME.match(os.path.basename(path))
+    if match:
+        return f'"{match["sha256"]}{match["variant"] or ""}"', True
+    key = f"image_etag:{path}:{stat.st_mtime_ns}:{stat.st_size}"
+    sha256 = cache.get(key)
+    if sha256 is None:
+        sha256 = imageService.hash_file(path)
+        cache.set(key, sha256, timeout=None)
+    return f'"{sha256}"', False
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    first and last byte of a single byte range, none if the header is not a single byte range
+    raise ValueError if the range cannot be satisfied
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or match[1] == match[2] == "":
+        return None
+    if match[1] == "":
+        # suffix range, the last n bytes
+        length = int(match[2])
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - length), size - 1
+    first = int(match[1])
+    last = min(int(match[2]), size - 1) if match[2] else size - 1
+    if first >= size or first > last:
+        raise ValueError("range not satisfiable")
+    return first, last
+
+
+def _read_range(path: str, first: int, length: int):
+    with open(path, "rb") as file:
+        file.seek(first)
+        while length > 0:
+            chunk = file.read(min(imageService.CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+class ImageView(View):
+    """
+    serve stored images with strong etags, conditional GET, byte ranges and long-lived caching
+    nginx serves the same files with the same headers in docker-compose (nginx/default.conf), this
+    view covers the image urls pointing at the app server itself
+    """
+    directory = None
+
+    def get(self, request, name: str) -> HttpResponse:
+        if name.startswith("."):
+            raise Http404()
+        path = f"{self.directory}/{name}"
+        full_path = os.path.join(settings.BASE_DIR, path)
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            raise Http404()
+        etag, immutable = image_etag(path, stat)
+
+        response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+        if response is None:
+            response = self.file_response(request, full_path, etag, stat.st_size)
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(stat.st_mtime)
+        response["Cache-Control"] = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+        response["Accept-Ranges"] = "bytes"
+        return response
+
+    def file_response(self, request, full_path: str, etag: str, size: int) -> HttpResponse:
+        """
+        the whole file, or a single byte range unless If-Range names another version
+        """
+        content_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+        range_header = request.META.get("HTTP_RANGE")
+        if_range = request.META.get("HTTP_IF_RANGE")
+        byte_range = None
+        if range_header and (if_range is None or if_range == etag):
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{size}"
+                return response
+        if byte_range is None:
+            return FileResponse(open(full_path, "rb"), content_type=content_type)
+
+        first, last = byte_range
+        response = StreamingHttpResponse(_read_range(full_path, first, last - first + 1), status=206,
+                                         content_type=content_type)
+        response["Content-Length"] = str(last - first + 1)
+        response["Content-Range"] = f"bytes {first}-{last}/{size}"
+        return response
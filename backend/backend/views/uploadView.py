@@ -0,0 +1,200 @@
+import logging
+import re
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from drf_spectacular.utils import extend_schema, OpenApiResponse
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from backend import imageService
+from backend.models import ImageUpload
+from backend.uploadStorage import IMAGE_CONTENT_TYPES, LocalUploadStorage, get_upload_storage
+from chat import chatService
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIRECTORIES = {
+    "product": imageService.PRODUCT_IMAGE_DIR,
+    "chat": imageService.CHAT_IMAGE_DIR,
+}
+UPLOAD_SALT = "backend.views.uploadView"
+# an upload may be completed a while after its url expired, e.g. after a slow mobile upload
+UPLOAD_COMPLETE_MAX_AGE_SECONDS = 60 * 60
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def stored_response(request: Request, purpose: str, path: str, created: bool) -> Response:
+    """
+    describe a stored image, chat images get an absolute url and their thumbnails are generated,
+    product pictures are claimed by path as picture_path when the product is saved
+    """
+    url = get_upload_storage().url(path)
+    if purpose == "chat":
+        url = request.build_absolute_uri(url)
+        if get_upload_storage().is_local:
+            chatService.submit_image_variants(path, url)
+    return Response({"exists": not created, "path": path, "url": url},
+                    status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+class PresignUploadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        summary='sign a direct image upload',
+        request={
+            'application/json': {
+                'type': 'object',
+                'properties': {
+                    'purpose': {'type': 'string', 'enum': list(UPLOAD_DIRECTORIES)},
+                    'content_type': {'type': 'string', 'enum': list(IMAGE_CONTENT_TYPES)},
+                    'size': {'type': 'integer'},
+                    'sha256': {'type': 'string'},
+                },
+                'required': ['purpose', 'content_type', 'size', 'sha256'],
+            }
+        },
+        responses={
+            200: OpenApiResponse(description='image already stored, no upload needed, complete the upload id to use it'),
+            201: OpenApiResponse(description='upload url signed'),
+            400: OpenApiResponse(description='invalid purpose, content type, size or sha256'),
+        },
+    )
+    def post(self, request: Request) -> Response:
+        """
+        sign an upload the client sends straight to the image storage, the body never reaches this server
+        1. validate the declared image, the storage refuses a body of another size or sha256
+        2. if the same content is stored already, return it with an upload id, nothing is uploaded
+        3. otherwise sign a PUT url to the content-addressed path and an upload id for the completion
+        no reference is taken before the upload id is completed
+        """
+        purpose = request.data.get("purpose")
+        content_type = request.data.get("content_type")
+        sha256 = str(request.data.get("sha256") or "").lower()
+        if purpose not in UPLOAD_DIRECTORIES:
+            return Response({"detail": f"purpose must be one of {', '.join(UPLOAD_DIRECTORIES)}"}, status=400)
+        if content_type not in IMAGE_CONTENT_TYPES:
+            return Response({"detail": "only image files allowed"}, status=400)
+        try:
+            size = int(request.data.get("size"))
+        except (TypeError, ValueError):
+            return Response({"detail": "size required"}, status=400)
+        if not 0 < size <= imageService.MAX_IMAGE_BYTES:
+            return Response({"detail": f"image larger than {imageService.MAX_IMAGE_BYTES} bytes"}, status=400)
+        if not SHA256_PATTERN.match(sha256):
+            return Response({"detail": "sha256 must be 64 hex digits"}, status=400)
+
+        directory = UPLOAD_DIRECTORIES[purpose]
+        upload = {"key": uuid.uuid4().hex, "purpose": purpose, "size": size, "sha256": sha256,
+                  "user_id": request.user.id}
+        existing = imageService.stored_path(directory, sha256)
+        if existing is not None:
+            upload_id = signing.dumps({**upload, "path": existing, "exists": True}, salt=UPLOAD_SALT)
+            return Response({"upload_id": upload_id, "exists": True, "path": existing}, status=status.HTTP_200_OK)
+
+        path = f"{directory}/{sha256}{IMAGE_CONTENT_TYPES[content_type]}"
+        expires_in = settings.IMAGE_UPLOAD_URL_EXPIRES_SECONDS
+        presigned = get_upload_storage().presign_put(path, content_type, size, sha256, expires_in)
+        presigned["url"] = request.build_absolute_uri(presigned["url"])
+        upload_id = signing.dumps({**upload, "path": path, "exists": False}, salt=UPLOAD_SALT)
+        return Response({"upload_id": upload_id, "upload": presigned, "expires_in": expires_in},
+                        status=status.HTTP_201_CREATED)
+
+
+class CompleteUploadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        summary='register a direct image upload',
+        request={
+            'application/json': {
+                'type': 'object',
+                'properties': {'upload_id': {'type': 'string'}},
+                'required': ['upload_id'],
+            }
+        },
+        responses={
+            200: OpenApiResponse(description='image stored before, or the upload id was completed already'),
+            201: OpenApiResponse(description='image stored'),
+            400: OpenApiResponse(description='upload id invalid or expired, or the upload is missing'),
+            403: OpenApiResponse(description='upload signed for another user'),
+        },
+    )
+    def post(self, request: Request) -> Response:
+        """
+        register an image uploaded with a url from PresignUploadView
+        1. check the upload id was signed for this user and has not expired
+        2. an upload id completed before returns its image again, without another reference
+        3. check the storage holds the signed size and content, unless the content was stored before
+        4. take one reference to the image and record the completed upload, both in one transaction
+        """
+        try:
+            upload = signing.loads(str(request.data.get("upload_id") or ""), salt=UPLOAD_SALT,
+                                   max_age=UPLOAD_COMPLETE_MAX_AGE_SECONDS)
+        except signing.BadSignature:
+            return Response({"detail": "invalid or expired upload_id"}, status=400)
+        if upload["user_id"] != request.user.id:
+            return Response({"detail": "upload belongs to another user"}, status=403)
+        completed = ImageUpload.objects.filter(key=upload["key"]).first()
+        if completed is not None:
+            return stored_response(request, completed.purpose, completed.path, created=False)
+
+        storage = get_upload_storage()
+        directory = UPLOAD_DIRECTORIES[upload["purpose"]]
+        path = upload["path"]
+        if not upload["exists"] and not storage.verify(path, upload["size"], upload["sha256"]):
+            return Response({"detail": "image not uploaded"}, status=400)
+        try:
+            with transaction.atomic():
+                if upload["exists"]:
+                    stored_path = imageService.reference_existing(directory, upload["sha256"])
+                    if stored_path is None:
+                        return Response({"detail": "image no longer stored, upload it again"}, status=400)
+                else:
+                    stored_path = imageService.register(directory, upload["sha256"], path, upload["size"])
+                ImageUpload.objects.create(key=upload["key"], user_id=request.user.id, purpose=upload["purpose"],
+                                           path=stored_path)
+        except IntegrityError:
+            # completed concurrently with the same upload id, its reference is the only one
+            completed = ImageUpload.objects.get(key=upload["key"])
+            return stored_response(request, completed.purpose, completed.path, created=False)
+        if not upload["exists"] and stored_path != path:
+            # the same content was stored under another extension meanwhile, this copy is not needed
+            storage.delete(path)
+        return stored_response(request, upload["purpose"], stored_path,
+                               created=not upload["exists"] and stored_path == path)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class LocalUploadView(View):
+    """
+    receiving end of the urls signed by LocalUploadStorage, plays the part of the bucket, the signed
+    token is the only authorization, like an s3 presigned url
+    """
+
+    def put(self, request, token: str) -> HttpResponse:
+        try:
+            upload = LocalUploadStorage.load_token(token)
+        except signing.BadSignature:
+            return HttpResponse("invalid or expired upload url", status=403)
+        try:
+            content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            content_length = 0
+        if content_length != upload["size"]:
+            return HttpResponse(f"content length must be {upload['size']}", status=400)
+        try:
+            imageService.save_stream(request, upload["path"], upload["size"], upload["sha256"])
+        except ValueError as e:
+            return HttpResponse(str(e), status=400)
+        return HttpResponse(status=200)
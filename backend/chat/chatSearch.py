@@ -0,0 +1,134 @@
+import base64
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import streaming_bulk
+
+from backend.globalvars import get_es_client
+from chat.models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+CHAT_MESSAGE_INDEX = "chat_message"
+DEFAULT_SEARCH_SIZE = 20
+
+# indexing runs off the websocket and worker code paths, a message is searchable shortly after it is stored
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-index")
+
+
+def message_to_doc(m: ChatMessage, buyer_id: int, seller_id: int) -> dict:
+    """
+    convert a stored message into a chat_message document, the participants are kept on every
+    document so searches are restricted to the caller's threads without loading them
+    """
+    return {
+        "_index": CHAT_MESSAGE_INDEX,
+        "_id": str(m.id),
+        "_source": {
+            "id": m.id,
+            "thread_id": str(m.thread_id),
+            "sender_id": m.sender_id,
+            "participant_ids": [buyer_id, seller_id],
+            "text": m.text or "",
+            "address": m.address or "",
+            "created_at": m.created_at.isoformat(),
+        },
+    }
+
+
+def index_docs(docs: Iterable[dict], chunk_size: int = 500) -> tuple[int, int]:
+    """
+    bulk index chat_message documents
+    return the number of indexed and failed documents
+    """
+    es: Elasticsearch = get_es_client()
+    if es is None:
+        logger.debug("elasticsearch client not initialized, chat messages not indexed")
+        return 0, 0
+    indexed = failed = 0
+    for ok, info in streaming_bulk(es, docs, chunk_size=chunk_size, raise_on_error=False, raise_on_exception=False):
+        if ok:
+            indexed += 1
+        else:
+            failed += 1
+            logger.warning(f"index chat message error: {info}")
+    return indexed, failed
+
+
+def _index_safely(docs: list[dict]):
+    try:
+        index_docs(docs)
+    except Exception:
+        logger.exception(f"index {len(docs)} chat messages error")
+
+
+def index_later(docs: list[dict]):
+    """
+    index documents in the background, failures are logged, the backfill command repairs gaps
+    """
+    if docs:
+        _executor.submit(_index_safely, docs)
+
+
+def encode_search_cursor(search_after: list) -> str:
+    raw = json.dumps(search_after).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_search_cursor(cursor: str) -> list:
+    """
+    decode a cursor produced by encode_search_cursor, raise ValueError if the cursor is malformed
+    """
+    try:
+        search_after = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(search_after, list):
+        raise ValueError("invalid cursor")
+    return search_after
+
+
+def search_messages(user_id: int, keyword: str, thread_id: str | None = None, size: int = DEFAULT_SEARCH_SIZE,
+                    cursor: str | None = None) -> tuple[list[dict], str | None]:
+    """
+    search messages of the threads a user participates in, newest first
+    1. match the keyword against text and address, filter on the user being a participant
+    2. highlight the matched fragments
+    3. paginate with search_after on (created_at, id)
+    return hits as (message id, highlight fragments) and the cursor of the next page, none on the last page
+    raise ValueError if the cursor is malformed
+    """
+    filters = [{"term": {"participant_ids": user_id}}]
+    if thread_id:
+        filters.append({"term": {"thread_id": str(thread_id)}})
+    body = {
+        "query": {
+            "bool": {
+                "must": [{"multi_match": {"query": keyword, "fields": ["text", "address"]}}],
+                "filter": filters,
+            }
+        },
+        "highlight": {
+            "pre_tags": ["<em>"],
+            "post_tags": ["</em>"],
+            "fields": {"text": {}, "address": {}},
+        },
+        "sort": [{"created_at": "desc"}, {"id": "desc"}],
+        "size": size,
+        "_source": False,
+    }
+    if cursor:
+        body["search_after"] = decode_search_cursor(cursor)
+
+    es: Elasticsearch = get_es_client()
+    es_result = es.search(index=CHAT_MESSAGE_INDEX, body=body)
+    hits = es_result.get("hits", {}).get("hits", [])
+    results = []
+    for hit in hits:
+        highlight = hit.get("highlight", {})
+        results.append((int(hit["_id"]), highlight.get("text", []) + highlight.get("address", [])))
+    next_cursor = encode_search_cursor(hits[-1]["sort"]) if len(hits) == size else None
+    return results, next_cursor
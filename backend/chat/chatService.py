@@ -0,0 +1,233 @@
+import base64
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from backend import imagePipeline
+from chat.models import ChatDeliveryCursor, ChatMessage, ChatThread
+
+logger = logging.getLogger(__name__)
+
+MAX_SYNC_MESSAGES = 200
+# ids are taken when a message is inserted but only become visible when its transaction commits, a
+# message can commit after a higher id was acknowledged (concurrent senders, several drain workers),
+# so sync sends again the messages created shortly before the last ack within this many ids
+SYNC_LOOKBACK_SECONDS = 30
+SYNC_LOOKBACK_IDS = 1000
+IMAGE_VARIANTS_CACHE_TIMEOUT_SECONDS = 24 * 60 * 60
+
+
+def message_to_dict(m: ChatMessage) -> dict:
+    """
+    convert a chat message into the json shape used by the api, sender must be loaded
+    """
+    return {
+        "id": m.id,
+        "text": m.text,
+        "image_url": m.image_url,
+        "image_variants": m.image_variants,
+        "sender": m.sender.username,
+        "lat": m.lat,
+        "lng": m.lng,
+        "address": m.address,
+        "created_at": m.created_at.isoformat(),
+    }
+
+
+def encode_message_cursor(m: ChatMessage) -> str:
+    """
+    encode the keyset of a message into an opaque cursor string
+    """
+    raw = json.dumps({"created_at": m.created_at.isoformat(), "id": m.id})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_message_cursor(cursor: str) -> tuple[datetime, int]:
+    """
+    decode a cursor produced by encode_message_cursor, raise ValueError if the cursor is malformed
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(payload["created_at"]), int(payload["id"])
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+
+
+def list_messages(thread: ChatThread, limit: int, before: str | None = None,
+                  after: str | None = None) -> dict:
+    """
+    list one page of messages of a thread in chronological order, keyset paginated on (created_at, id)
+    1. with after, return the oldest messages newer than the cursor
+    2. otherwise return the latest messages, older than the before cursor if given
+    older_cursor is set when older messages may exist, newer_cursor always points at the newest
+    message seen so the client can poll for new ones
+    raise ValueError if a cursor is malformed
+    """
+    qs = thread.messages.select_related("sender")
+    if after:
+        created_at, message_id = decode_message_cursor(after)
+        qs = qs.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=message_id))
+        page = list(qs.order_by("created_at", "id")[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+        return {
+            "results": [message_to_dict(m) for m in page],
+            "older_cursor": None,
+            "newer_cursor": encode_message_cursor(page[-1]) if page else after,
+            "has_more": has_more,
+        }
+
+    if before:
+        created_at, message_id = decode_message_cursor(before)
+        qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id))
+    page = list(qs.order_by("-created_at", "-id")[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit][::-1]
+    return {
+        "results": [message_to_dict(m) for m in page],
+        "older_cursor": encode_message_cursor(page[0]) if has_more else None,
+        "newer_cursor": encode_message_cursor(page[-1]) if page and not before else None,
+        "has_more": has_more,
+    }
+
+
+def update_thread_summaries(messages: list[ChatMessage]):
+    """
+    update thread summaries for messages inserted with bulk_create, which skips ChatMessage.save
+    messages of the same thread and sender are counted into one update, the newest group is
+    applied last so the summary ends on the newest message of each thread
+    """
+    groups = {}
+    for m in sorted(messages, key=lambda m: (m.created_at, m.id or 0)):
+        key = (m.thread_id, m.sender_id)
+        count = groups.pop(key, (None, 0))[1]
+        groups[key] = (m, count + 1)
+    for last, count in groups.values():
+        ChatMessage.update_thread_summary(last, unread=count)
+
+
+def create_messages(sender_id: int, items: list[tuple]) -> list[ChatMessage]:
+    """
+    store many messages of a sender with one bulk insert, items are (thread_id, fields, client_id)
+    items without a client id get a new one, items whose client id is already stored are not inserted
+    again, so a client can replay its outbox safely
+    return the stored message of every item in item order, newly inserted ones have created set to true
+    """
+    client_ids = [client_id or uuid.uuid4() for _, _, client_id in items]
+
+    stored = {m.client_id: m for m in ChatMessage.objects.filter(client_id__in=client_ids)}
+    for m in stored.values():
+        m.created = False
+    messages = []
+    for (thread_id, fields, _), client_id in zip(items, client_ids):
+        if client_id in stored:
+            continue
+        message = ChatMessage(thread_id=thread_id, sender_id=sender_id, client_id=client_id, **fields)
+        message.created = True
+        stored[client_id] = message
+        messages.append(message)
+
+    with transaction.atomic():
+        ChatMessage.objects.bulk_create(messages)
+        update_thread_summaries(messages)
+    # backends without RETURNING (mysql) do not set the primary keys of bulk inserted rows
+    missing = {m.client_id: m for m in messages if m.pk is None}
+    if missing:
+        for client_id, pk in ChatMessage.objects.filter(client_id__in=missing).values_list("client_id", "id"):
+            missing[client_id].pk = pk
+    return [stored[client_id] for client_id in client_ids]
+
+
+def _sync_dict(m: ChatMessage) -> dict:
+    data = message_to_dict(m)
+    data["thread_id"] = str(m.thread_id)
+    data["client_id"] = str(m.client_id) if m.client_id else None
+    return data
+
+
+def messages_since(user_id: int, last_id: int | None = None,
+                   limit: int = MAX_SYNC_MESSAGES) -> tuple[list[dict], int | None, bool]:
+    """
+    messages of all threads of a user with an id greater than last_id, oldest first
+    without last_id the user's delivery cursor is used, a user without a cursor has nothing to
+    resync and loads history over http instead
+    messages up to SYNC_LOOKBACK_IDS below the acknowledged cursor created up to SYNC_LOOKBACK_SECONDS
+    before the ack are sent first, again, they may have committed after the ack, clients dedupe them
+    on id, a client paging past the cursor got them with its first page and they are not sent again
+    return the messages, the id to ack once they are stored and whether more are left after the limit
+    """
+    cursor = ChatDeliveryCursor.objects.filter(user_id=user_id).values_list("last_message_id", "updated_at").first()
+    if last_id is None:
+        if cursor is None:
+            return [], None, False
+        last_id = cursor[0]
+    qs = (
+        ChatMessage.objects
+        .filter(Q(thread__buyer_id=user_id) | Q(thread__seller_id=user_id))
+        .select_related("sender")
+        .order_by("id")
+    )
+    late = []
+    if cursor is not None and last_id <= cursor[0]:
+        acked_id, acked_at = cursor
+        # ids above last_id are part of the page below
+        late = list(qs.filter(id__lte=last_id, id__gt=acked_id - SYNC_LOOKBACK_IDS,
+                              created_at__gte=acked_at - timedelta(seconds=SYNC_LOOKBACK_SECONDS))[:limit])
+    page = list(qs.filter(id__gt=last_id)[:limit + 1])
+    messages = [_sync_dict(m) for m in late + page[:limit]]
+    return messages, page[:limit][-1].id if page else last_id, len(page) > limit
+
+
+def acknowledge(user_id: int, message_id: int):
+    """
+    move the delivery cursor of a user forward to message_id, never backwards
+    """
+    updated = ChatDeliveryCursor.objects.filter(
+        user_id=user_id, last_message_id__lt=message_id).update(last_message_id=message_id)
+    if not updated:
+        ChatDeliveryCursor.objects.get_or_create(user_id=user_id, defaults={"last_message_id": message_id})
+
+
+def _image_variants_key(image_url: str) -> str:
+    return f"image_variants:{image_url}"
+
+
+def record_image_variants(image_url: str, variants: dict):
+    """
+    attach the variants of an uploaded image to the messages already sent with it, and keep them
+    in the cache so messages sent later pick them up, see aget_image_variants
+    """
+    try:
+        cache.set(_image_variants_key(image_url), variants, timeout=IMAGE_VARIANTS_CACHE_TIMEOUT_SECONDS)
+    except Exception:
+        logger.exception("write image variants cache error")
+    ChatMessage.objects.filter(image_url=image_url).update(image_variants=variants)
+
+
+def submit_image_variants(path: str, image_url: str):
+    """
+    generate the thumbnails of an uploaded image in the background, they are attached to the messages
+    using image_url once written, the variant urls share the host of image_url
+    """
+    prefix = image_url[:-len(path)]
+    imagePipeline.submit(path, lambda variants: record_image_variants(image_url, {
+        width: {fmt: prefix + variant for fmt, variant in formats.items()}
+        for width, formats in variants.items()
+    }))
+
+
+async def aget_image_variants(image_urls: list[str]) -> dict[str, dict]:
+    """
+    variants of many uploaded images in one cache round trip, images without variants are absent
+    """
+    try:
+        found = await cache.aget_many([_image_variants_key(url) for url in image_urls])
+    except Exception:
+        logger.exception("read image variants cache error")
+        return {}
+    return {url: found[_image_variants_key(url)] for url in image_urls if _image_variants_key(url) in found}
@@ -0,0 +1,102 @@
+import statistics
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from chat.models import ChatThread
+from chat.views import ChatConsumer
+from user.middleware import JWTAuthMiddleware
+from user.models import User
+
+MODES = {"sync": False, "write-behind": True}
+
+
+class Command(BaseCommand):
+    help = (
+        "compare end-to-end chat delivery latency and sustained messages/sec with and without "
+        "write-behind persistence, against the configured database, redis and channel layer. "
+        "two temporary users are created and deleted afterwards, write-behind entries of the "
+        "deleted thread are dropped by drain_chat_messages"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=500, help="messages per measurement")
+        parser.add_argument("--mode", choices=[*MODES, "both"], default="both")
+
+    def handle(self, *args, **options):
+        count = options["messages"]
+        if count < 1:
+            raise CommandError("--messages must be positive")
+        modes = list(MODES) if options["mode"] == "both" else [options["mode"]]
+
+        suffix = uuid.uuid4().hex[:8]
+        sender = User.objects.create_user(email=f"bench-a-{suffix}@example.com", username=f"bench-a-{suffix}")
+        receiver = User.objects.create_user(email=f"bench-b-{suffix}@example.com", username=f"bench-b-{suffix}")
+        try:
+            thread = ChatThread.objects.create(buyer=sender, seller=receiver)
+            tokens = [str(RefreshToken.for_user(u).access_token) for u in (sender, receiver)]
+            for mode in modes:
+                with override_settings(CHAT_WRITE_BEHIND=MODES[mode]):
+                    latencies, rate = async_to_sync(self.measure)(tokens, str(thread.id), count)
+                latencies.sort()
+                self.stdout.write(
+                    f"{mode:>12}: p50={statistics.median(latencies) * 1000:.2f}ms "
+                    f"p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:.2f}ms "
+                    f"max={latencies[-1] * 1000:.2f}ms throughput={rate:.0f} msg/s"
+                )
+        finally:
+            sender.delete()
+            receiver.delete()
+
+    @staticmethod
+    async def receive_messages(communicator: WebsocketCommunicator, client_ids: set[str], timeout: float):
+        """
+        read frames until the messages with these client ids arrived, other frames are skipped
+        """
+        pending = set(client_ids)
+        while pending:
+            event = await communicator.receive_json_from(timeout=timeout)
+            if event.get("type") == "chat_message":
+                pending.discard(event.get("clientId"))
+
+    async def measure(self, tokens: list[str], thread_id: str, count: int) -> tuple[list[float], float]:
+        """
+        1. latency: send one message at a time and wait until the peer receives it
+        2. throughput: send all messages back to back and wait until the peer received all of them
+        received frames are matched to sent messages by clientId
+        """
+        sender, receiver = [
+            WebsocketCommunicator(JWTAuthMiddleware(ChatConsumer.as_asgi()), f"/chat/?token={token}") for token in tokens
+        ]
+        for communicator in (sender, receiver):
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise CommandError("websocket connect failed")
+            # the connected frame and the sync frame sent on connect
+            await communicator.receive_json_from()
+            await communicator.receive_json_from()
+
+        frame = {"type": "chat_message", "threadId": thread_id}
+        latencies = []
+        for i in range(count):
+            client_id = str(uuid.uuid4())
+            start = time.perf_counter()
+            await sender.send_json_to({**frame, "message": f"latency {i}", "clientId": client_id})
+            await self.receive_messages(receiver, {client_id}, timeout=10)
+            latencies.append(time.perf_counter() - start)
+
+        client_ids = [str(uuid.uuid4()) for _ in range(count)]
+        start = time.perf_counter()
+        for i, client_id in enumerate(client_ids):
+            await sender.send_json_to({**frame, "message": f"throughput {i}", "clientId": client_id})
+        await self.receive_messages(receiver, set(client_ids), timeout=30)
+        rate = count / (time.perf_counter() - start)
+
+        await sender.disconnect()
+        await receiver.disconnect()
+        return latencies, rate
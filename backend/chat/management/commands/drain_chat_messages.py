@@ -0,0 +1,36 @@
+import signal
+import socket
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.globalvars import init_es_client
+from chat import messageQueue
+
+
+class Command(BaseCommand):
+    help = "persist chat messages queued in write-behind mode (CHAT_WRITE_BEHIND=true)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="messages per bulk insert")
+        parser.add_argument("--block-ms", type=int, default=1000, help="how long to wait for new messages")
+        parser.add_argument("--consumer", default=socket.gethostname(),
+                            help="consumer name in the redis consumer group, unique per worker")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+        signal.signal(signal.SIGINT, lambda *_: stopping.append(True))
+
+        # persisted messages are indexed for search
+        init_es_client()
+        self.stdout.write(f"draining {messageQueue.STREAM_KEY} as {options['consumer']}")
+        messageQueue.drain(
+            options["consumer"],
+            batch_size=options["batch_size"],
+            block_ms=options["block_ms"],
+            should_stop=lambda: bool(stopping),
+        )
+        self.stdout.write(self.style.SUCCESS("stopped"))
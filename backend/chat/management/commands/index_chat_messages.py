@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.globalvars import init_es_client
+from chat import chatSearch
+from chat.models import ChatMessage
+from esIndexInit import create_chat_message_index
+
+
+class Command(BaseCommand):
+    help = "bulk index existing chat messages into the chat_message elasticsearch index"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="messages read and indexed per chunk")
+        parser.add_argument("--since-id", type=int, default=0, help="only index messages with a greater id")
+
+    def iter_docs(self, batch_size: int, since_id: int):
+        """
+        read messages in id order with keyset pagination, so memory stays flat on a large history
+        """
+        qs = (
+            ChatMessage.objects
+            .select_related("thread")
+            .only("id", "thread_id", "sender_id", "text", "address", "created_at",
+                  "thread__buyer_id", "thread__seller_id")
+            .order_by("id")
+        )
+        last_id = since_id
+        while True:
+            chunk = list(qs.filter(id__gt=last_id)[:batch_size])
+            if not chunk:
+                return
+            for m in chunk:
+                yield chatSearch.message_to_doc(m, m.thread.buyer_id, m.thread.seller_id)
+            last_id = chunk[-1].id
+            self.stdout.write(f"read up to message {last_id}")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+
+        init_es_client()
+        create_chat_message_index()
+        indexed, failed = chatSearch.index_docs(
+            self.iter_docs(options["batch_size"], options["since_id"]), chunk_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"{indexed} chat messages indexed, {failed} failed"))
@@ -0,0 +1,202 @@
+import json
+import logging
+import math
+import time
+import uuid
+from datetime import datetime
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from chat import chatSearch, chatService
+from chat.models import ChatMessage, ChatThread
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = "chat:messages"
+GROUP_NAME = "chat-writers"
+# entries not acked by a dead worker for this long are claimed by another one
+CLAIM_IDLE_MS = 60_000
+
+MESSAGE_FIELDS = ("text", "image_url", "lat", "lng", "address")
+
+_async_client = None
+
+
+def _get_async_client():
+    global _async_client
+    if _async_client is None:
+        _async_client = aioredis.from_url(settings.CHAT_REDIS_URL)
+    return _async_client
+
+
+def _build_entry(thread_id, sender_id: int, fields: dict, client_id: uuid.UUID,
+                 created_at: datetime | None = None) -> dict:
+    entry = {
+        "client_id": str(client_id),
+        "thread_id": str(thread_id),
+        "sender_id": str(sender_id),
+        "created_at": (created_at or timezone.now()).isoformat(),
+    }
+    for name in MESSAGE_FIELDS:
+        if fields.get(name) is not None:
+            entry[name] = str(fields[name])
+    if fields.get("image_variants"):
+        entry["image_variants"] = json.dumps(fields["image_variants"])
+    return entry
+
+
+async def enqueue(thread_id, sender_id: int, fields: dict, client_id: uuid.UUID | None = None,
+                  created_at: datetime | None = None) -> str:
+    """
+    append a message to the write-behind stream, the time of receipt is kept as created_at
+    return the client id used as idempotency key
+    """
+    client_id = client_id or uuid.uuid4()
+    await _get_async_client().xadd(STREAM_KEY, _build_entry(thread_id, sender_id, fields, client_id, created_at))
+    return str(client_id)
+
+
+async def enqueue_many(sender_id: int, items: list[tuple]) -> list[str]:
+    """
+    append many messages of a sender to the write-behind stream in one pipelined round trip,
+    items are (thread_id, fields, client_id)
+    return the client ids in item order
+    """
+    client_ids = []
+    async with _get_async_client().pipeline(transaction=False) as pipe:
+        for thread_id, fields, client_id in items:
+            client_id = client_id or uuid.uuid4()
+            client_ids.append(str(client_id))
+            pipe.xadd(STREAM_KEY, _build_entry(thread_id, sender_id, fields, client_id))
+        await pipe.execute()
+    return client_ids
+
+
+def _decode(fields: dict) -> dict:
+    return {k.decode("utf-8"): v.decode("utf-8") for k, v in fields.items()}
+
+
+def _row_to_message(row: dict) -> ChatMessage:
+    """
+    build a message from a decoded stream entry, raise ValueError, KeyError or TypeError if the entry
+    is malformed
+    """
+    lat = float(row["lat"]) if "lat" in row else None
+    lng = float(row["lng"]) if "lng" in row else None
+    if any(v is not None and not math.isfinite(v) for v in (lat, lng)):
+        raise ValueError(f"invalid coordinates {lat}, {lng}")
+    return ChatMessage(
+        client_id=row["client_id"],
+        thread_id=row["thread_id"],
+        sender_id=int(row["sender_id"]),
+        text=row.get("text", ""),
+        image_url=row.get("image_url", ""),
+        lat=lat,
+        lng=lng,
+        address=row.get("address"),
+        image_variants=json.loads(row["image_variants"]) if "image_variants" in row else {},
+        created_at=datetime.fromisoformat(row["created_at"]),
+    )
+
+
+def persist_batch(entries: list[tuple]) -> int:
+    """
+    persist stream entries with one bulk insert
+    entries whose client id is already stored are skipped, so a redelivered batch is harmless,
+    entries of deleted threads and malformed entries are dropped and acked with the batch
+    return the number of inserted messages
+    """
+    rows = []
+    for entry_id, fields in entries:
+        try:
+            row = _decode(fields)
+            row["client_id"] = str(uuid.UUID(row["client_id"]))
+            row["thread_id"] = str(uuid.UUID(row["thread_id"]))
+        except (KeyError, ValueError):
+            logger.error("malformed chat message entry %s dropped: %s", entry_id, fields)
+            continue
+        rows.append(row)
+    client_ids = {row["client_id"] for row in rows}
+    thread_ids = {row["thread_id"] for row in rows}
+    stored = {str(c) for c in ChatMessage.objects.filter(client_id__in=client_ids).values_list("client_id", flat=True)}
+    threads = {str(t[0]): t for t in ChatThread.objects.filter(id__in=thread_ids).values_list("id", "buyer_id", "seller_id")}
+
+    messages = []
+    for row in rows:
+        if row["client_id"] in stored:
+            continue
+        if row["thread_id"] not in threads:
+            logger.warning("ChatThread %s not found, drop message %s", row["thread_id"], row["client_id"])
+            continue
+        try:
+            message = _row_to_message(row)
+        except (KeyError, TypeError, ValueError):
+            # retrying cannot fix the entry, it is acked with its batch instead of blocking the stream
+            logger.exception("malformed chat message entry dropped: %s", row)
+            continue
+        stored.add(row["client_id"])
+        messages.append(message)
+
+    with transaction.atomic():
+        ChatMessage.objects.bulk_create(messages)
+        chatService.update_thread_summaries(messages)
+    inserted = len(messages)
+
+    # backends without RETURNING (mysql) do not set the primary keys of bulk inserted rows
+    if any(m.pk is None for m in messages):
+        messages = ChatMessage.objects.filter(client_id__in=[m.client_id for m in messages])
+    chatSearch.index_later([chatSearch.message_to_doc(m, *threads[str(m.thread_id)][1:]) for m in messages])
+    return inserted
+
+
+def _ensure_group(client: redis.Redis):
+    try:
+        client.xgroup_create(STREAM_KEY, GROUP_NAME, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def drain(consumer_name: str, batch_size: int = 500, block_ms: int = 1000, should_stop=lambda: False):
+    """
+    persist the write-behind stream until should_stop returns true, at-least-once:
+    1. entries are acked and deleted only after their batch is committed
+    2. entries left pending by a crash of this consumer are processed first
+    3. when idle, entries pending too long on other consumers are claimed
+    """
+    client = redis.from_url(settings.CHAT_REDIS_URL)
+    _ensure_group(client)
+    read_id = "0"
+    while not should_stop():
+        if read_id == ">":
+            response = client.xreadgroup(GROUP_NAME, consumer_name, {STREAM_KEY: ">"},
+                                         count=batch_size, block=block_ms)
+        else:
+            response = client.xreadgroup(GROUP_NAME, consumer_name, {STREAM_KEY: read_id}, count=batch_size)
+        entries = response[0][1] if response else []
+
+        if not entries:
+            if read_id != ">":
+                read_id = ">"
+                continue
+            _, entries, _ = client.xautoclaim(STREAM_KEY, GROUP_NAME, consumer_name,
+                                              min_idle_time=CLAIM_IDLE_MS, start_id="0-0", count=batch_size)
+            if not entries:
+                continue
+
+        # entries deleted from the stream while pending come back without fields
+        try:
+            inserted = persist_batch([(entry_id, fields) for entry_id, fields in entries if fields])
+        except Exception:
+            logger.exception("persist chat message batch error, retry later")
+            read_id = "0"
+            time.sleep(1)
+            continue
+        ids = [entry_id for entry_id, _ in entries]
+        client.xack(STREAM_KEY, GROUP_NAME, *ids)
+        client.xdel(STREAM_KEY, *ids)
+        logger.info(f"persisted {inserted} chat messages of {len(entries)} stream entries")
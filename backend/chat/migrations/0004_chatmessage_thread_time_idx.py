@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-17 21:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_chatmessage_address_chatmessage_lat_chatmessage_lng'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['thread', 'created_at', 'id'], name='chatmessage_thread_time_idx'),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.2.7 on 2026-10-17 21:54
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_thread_summary(apps, schema_editor):
+    """
+    point every existing thread at its last message, unread counters start at zero
+    """
+    ChatThread = apps.get_model('chat', 'ChatThread')
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    for thread in ChatThread.objects.all().iterator():
+        last = ChatMessage.objects.filter(thread_id=thread.id).order_by('-created_at', '-id').first()
+        if last is None:
+            thread.last_message_at = thread.created_at
+        else:
+            if last.image_url:
+                kind, preview = 'image', '[Image]'
+            elif last.text not in (None, ''):
+                kind, preview = 'text', last.text[:255]
+            elif last.lat is not None and last.lng is not None:
+                kind, preview = 'location', '[Location]'
+            else:
+                kind, preview = '', ''
+            thread.last_message_kind = kind
+            thread.last_message_preview = preview
+            thread.last_message_at = last.created_at
+            thread.last_message_sender_id = last.sender_id
+        thread.save(update_fields=[
+            'last_message_kind', 'last_message_preview', 'last_message_at', 'last_message_sender',
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_chatmessage_thread_time_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatthread',
+            name='buyer_unread',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatthread',
+            name='last_message_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='chatthread',
+            name='last_message_kind',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='chatthread',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='chatthread',
+            name='last_message_sender',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='chatthread',
+            name='seller_unread',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='chatthread',
+            index=models.Index(fields=['buyer', 'last_message_at'], name='chatthread_buyer_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatthread',
+            index=models.Index(fields=['seller', 'last_message_at'], name='chatthread_seller_activity_idx'),
+        ),
+        migrations.RunPython(backfill_thread_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_chatmessage_client_id'),
+        ('user', '0003_user_avatar_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatDeliveryCursor',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='chat_delivery_cursor', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('last_message_id', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
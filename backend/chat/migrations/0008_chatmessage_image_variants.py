@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_chatdeliverycursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='image_url',
+            field=models.URLField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -1,23 +1,120 @@
 import uuid
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, When
 from django.conf import settings
+from django.utils import timezone
 
 User = settings.AUTH_USER_MODEL
 
+PREVIEW_MAX_LENGTH = 255
+
+
 class ChatThread(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     buyer = models.ForeignKey(User, related_name="buyer_threads", on_delete=models.CASCADE)
     seller = models.ForeignKey(User, related_name="seller_threads", on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # summary of the last message, maintained on message write, see ChatMessage.save
+    last_message_preview = models.CharField(max_length=PREVIEW_MAX_LENGTH, blank=True, default="")
+    last_message_kind = models.CharField(max_length=10, blank=True, default="")
+    last_message_at = models.DateTimeField(default=timezone.now)
+    last_message_sender = models.ForeignKey(User, related_name="+", null=True, blank=True,
+                                            on_delete=models.SET_NULL)
+    buyer_unread = models.PositiveIntegerField(default=0)
+    seller_unread = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # inbox of a user, most recent activity first
+            models.Index(fields=["buyer", "last_message_at"], name="chatthread_buyer_activity_idx"),
+            models.Index(fields=["seller", "last_message_at"], name="chatthread_seller_activity_idx"),
+        ]
+
+    def unread_for(self, user_id) -> int:
+        return self.buyer_unread if self.buyer_id == user_id else self.seller_unread
+
+
 class ChatMessage(models.Model):
     thread = models.ForeignKey(ChatThread, related_name="messages", on_delete=models.CASCADE)
     sender = models.ForeignKey(User, on_delete=models.CASCADE)
     text = models.TextField()
-    image_url = models.URLField(blank=True, null=True)
+    # indexed so variants generated after the message was sent can be attached, see chatService.record_image_variants
+    image_url = models.URLField(blank=True, null=True, db_index=True)
+    # downscaled copies of the image by width and format
+    image_variants = models.JSONField(default=dict, blank=True)
 
     lat = models.FloatField(null=True, blank=True)
     lng = models.FloatField(null=True, blank=True)
     address = models.CharField(max_length=255, null=True, blank=True)
 
-    created_at = models.DateTimeField(auto_now_add=True)
+    # idempotency key, set by clients or by the write-behind queue, so a message is stored once
+    client_id = models.UUIDField(null=True, blank=True, unique=True)
+
+    # not auto_now_add, write-behind keeps the time the message was received
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # keyset pagination of a thread's history
+            models.Index(fields=["thread", "created_at", "id"], name="chatmessage_thread_time_idx"),
+        ]
+
+    @property
+    def kind(self) -> str:
+        if self.image_url:
+            return "image"
+        if self.text not in (None, ""):
+            return "text"
+        if self.lat is not None and self.lng is not None:
+            return "location"
+        return ""
+
+    @property
+    def preview(self) -> str:
+        kind = self.kind
+        if kind == "image":
+            return "[Image]"
+        if kind == "text":
+            return self.text[:PREVIEW_MAX_LENGTH]
+        if kind == "location":
+            return "[Location]"
+        return ""
+
+    def save(self, *args, **kwargs):
+        """
+        save the message and update the summary of its thread in the same transaction
+        """
+        is_new = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if is_new:
+                ChatMessage.update_thread_summary(self)
+
+    @staticmethod
+    def update_thread_summary(message: "ChatMessage", unread: int = 1):
+        """
+        point the thread summary at the message and add unread messages to the receiver,
+        one update query without loading the thread
+        """
+        ChatThread.objects.filter(pk=message.thread_id).update(
+            last_message_preview=message.preview,
+            last_message_kind=message.kind,
+            last_message_at=message.created_at,
+            last_message_sender_id=message.sender_id,
+            buyer_unread=Case(When(buyer_id=message.sender_id, then=F("buyer_unread")),
+                              default=F("buyer_unread") + unread),
+            seller_unread=Case(When(seller_id=message.sender_id, then=F("seller_unread")),
+                               default=F("seller_unread") + unread),
+        )
+
+
+class ChatDeliveryCursor(models.Model):
+    """
+    id of the last message a user acknowledged over the websocket, messages after it are
+    sent again on reconnect, see chatService.messages_since
+    """
+    user = models.OneToOneField(User, primary_key=True, related_name="chat_delivery_cursor",
+                                on_delete=models.CASCADE)
+    last_message_id = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
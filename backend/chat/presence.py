@@ -0,0 +1,40 @@
+import logging
+
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# a user is online while any of its sockets sent a heartbeat within the ttl,
+# clients are expected to send one about every PRESENCE_TTL_SECONDS / 2
+PRESENCE_TTL_SECONDS = 60
+# heartbeats of a socket arriving faster than this are not written again
+HEARTBEAT_MIN_INTERVAL_SECONDS = 10
+
+
+def _cache_key(user_id) -> str:
+    return f"presence:{int(user_id)}"
+
+
+async def touch(user_id):
+    """
+    mark a user online for PRESENCE_TTL_SECONDS, the value is the time of the heartbeat
+    cache errors are logged and ignored, presence is best effort
+    """
+    try:
+        await cache.aset(_cache_key(user_id), timezone.now().isoformat(), timeout=PRESENCE_TTL_SECONDS)
+    except Exception:
+        logger.exception("write presence error")
+
+
+def get_presence(user_ids) -> dict[int, str | None]:
+    """
+    last heartbeat of many users in one round trip, none for users that are offline
+    """
+    user_ids = [int(user_id) for user_id in user_ids]
+    try:
+        found = cache.get_many([_cache_key(user_id) for user_id in user_ids])
+    except Exception:
+        logger.exception("read presence error")
+        found = {}
+    return {user_id: found.get(_cache_key(user_id)) for user_id in user_ids}
@@ -1,15 +1,38 @@
-from django.test import TestCase
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.core.cache import cache
 from django.urls import reverse
 from django.utils import timezone
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 from rest_framework import status
 from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
 
 from user.models import User
-from chat.models import ChatThread, ChatMessage
-
+from user.services import userCache
+from chat import chatSearch, chatService, presence
+from chat.models import ChatThread, ChatMessage, ChatDeliveryCursor
+from chat.views import ChatConsumer
+from user.middleware import JWTAuthMiddleware
+from backend.tests import use_temporary_image_storage
+
+import hashlib
+import os
 import uuid
+from io import StringIO
+
+from django.conf import settings
+
+from django.core.management import call_command
+
+from backend import imageService
+from backend.models import ImageBlob
 
 
 class BaseChatAPITestCase(APITestCase):
@@ -98,6 +121,35 @@ class LoadMessagesViewTests(BaseChatAPITestCase):
         self.assertEqual(resp.data["detail"], "thread not found")
 
 
+    def test_load_messages_keyset_pages(self):
+        for i in range(5):
+            ChatMessage.objects.create(thread=self.thread, sender=self.user1, text=f"m{i}")
+        url = reverse("chat-thread-messages", kwargs={"thread_id": self.thread.id})
+
+        resp = self.client.get(url, {"limit": 3})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([m["text"] for m in resp.data["results"]], ["m2", "m3", "m4"])
+        self.assertTrue(resp.data["has_more"])
+        newer_cursor = resp.data["newer_cursor"]
+
+        resp = self.client.get(url, {"limit": 3, "before": resp.data["older_cursor"]})
+        self.assertEqual([m["text"] for m in resp.data["results"]], ["hi", "m0", "m1"])
+
+        resp = self.client.get(url, {"limit": 3, "before": resp.data["older_cursor"]})
+        self.assertEqual([m["text"] for m in resp.data["results"]], ["hello"])
+        self.assertIsNone(resp.data["older_cursor"])
+
+        ChatMessage.objects.create(thread=self.thread, sender=self.user2, text="new")
+        resp = self.client.get(url, {"limit": 3, "after": newer_cursor})
+        self.assertEqual([m["text"] for m in resp.data["results"]], ["new"])
+        self.assertFalse(resp.data["has_more"])
+
+    def test_load_messages_invalid_cursor(self):
+        url = reverse("chat-thread-messages", kwargs={"thread_id": self.thread.id})
+        resp = self.client.get(url, {"before": "bogus"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.data["detail"], "invalid cursor")
+
 class LoadThreadsViewTests(BaseChatAPITestCase):
     def setUp(self):
         super().setUp()
@@ -129,8 +181,121 @@ class LoadThreadsViewTests(BaseChatAPITestCase):
         self.assertEqual(item["last_message"], "[Image]")
         self.assertIn("last_time", item)
 
+    def test_load_threads_single_query_ordered_by_activity(self):
+        others = [
+            User.objects.create_user(email=f"user{i}@example.com", username=f"user{i}", password="pass1234")
+            for i in range(5)
+        ]
+        threads = [ChatThread.objects.create(buyer=self.user1, seller=other) for other in others]
+        for th in threads:
+            ChatMessage.objects.create(thread=th, sender=self.user1, text=f"hi {th.seller.username}")
+        # the oldest thread gets the newest message
+        ChatMessage.objects.create(thread=self.thread, sender=self.user2, text="", lat=1.0, lng=2.0)
+
+        url = reverse("chat-threads")
+        with self.assertNumQueries(1):
+            resp = self.client.get(url)
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.data), 6)
+        self.assertEqual(resp.data[0]["id"], str(self.thread.id))
+        self.assertEqual(resp.data[0]["last_message"], "[Location]")
+        self.assertEqual(resp.data[1]["peer_username"], "user4")
+        self.assertEqual(resp.data[1]["last_message"], "hi user4")
+
+
+    def test_unread_counters_follow_messages(self):
+        ChatMessage.objects.create(thread=self.thread, sender=self.user2, text="are you there?")
+        ChatMessage.objects.create(thread=self.thread, sender=self.user2, text="hello?")
+
+        resp = self.client.get(reverse("chat-unread"))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data["total"], 2)
+        self.assertEqual(resp.data["threads"], {str(self.thread.id): 2})
+
+        resp = self.client.get(reverse("chat-threads"))
+        self.assertEqual(resp.data[0]["last_message"], "hello?")
+        self.assertEqual(resp.data[0]["unread"], 2)
+
+        resp = self.client.post(reverse("chat-thread-read", kwargs={"thread_id": self.thread.id}))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.get(reverse("chat-unread"))
+        self.assertEqual(resp.data["total"], 0)
+
+        # the sender's own messages never count as unread for the sender
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.unread_for(self.user2.id), 1)
+
+    def test_mark_read_other_thread_not_found(self):
+        charlie = User.objects.create_user(email="charlie@example.com", username="charlie", password="pass")
+        self.client.force_authenticate(user=charlie)
+        resp = self.client.post(reverse("chat-thread-read", kwargs={"thread_id": self.thread.id}))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+class PresenceViewTests(BaseChatAPITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_bulk_presence(self):
+        async_to_sync(presence.touch)(self.user2.id)
+        with self.assertNumQueries(1):
+            resp = self.client.get(reverse("chat-presence"), {"usernames": "bob,alice,ghost"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.data["bob"]["online"])
+        self.assertIsNotNone(resp.data["bob"]["last_seen"])
+        self.assertEqual(resp.data["alice"], {"online": False, "last_seen": None})
+        self.assertFalse(resp.data["ghost"]["online"])
+
+    def test_bulk_presence_requires_usernames(self):
+        resp = self.client.get(reverse("chat-presence"))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SearchMessagesViewTests(BaseChatAPITestCase):
+    def setUp(self):
+        super().setUp()
+        carol = User.objects.create_user(email="carol@example.com", username="carol", password="pass1234")
+        self.thread = ChatThread.objects.create(buyer=self.user1, seller=self.user2)
+        self.mine = ChatMessage.objects.create(thread=self.thread, sender=self.user2, text="is the bike still available")
+        other = ChatThread.objects.create(buyer=self.user2, seller=carol)
+        self.foreign = ChatMessage.objects.create(thread=other, sender=carol, text="bike for sale")
+
+    @patch("chat.chatSearch.get_es_client")
+    def test_search_restricted_and_highlighted(self, mock_get_es_client):
+        es = mock_get_es_client.return_value
+        es.search.return_value = {"hits": {"hits": [
+            {"_id": str(self.mine.id), "sort": [1, self.mine.id],
+             "highlight": {"text": ["is the <em>bike</em> still available"]}},
+            # a stale document of a thread alice is not part of is dropped
+            {"_id": str(self.foreign.id), "sort": [0, self.foreign.id], "highlight": {}},
+        ]}}
+
+        resp = self.client.get(reverse("chat-search"), {"q": "bike", "size": 2})
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([r["id"] for r in resp.data["results"]], [self.mine.id])
+        self.assertEqual(resp.data["results"][0]["highlight"], ["is the <em>bike</em> still available"])
+        self.assertEqual(resp.data["results"][0]["thread_id"], str(self.thread.id))
+        self.assertIsNotNone(resp.data["next_cursor"])
+        body = es.search.call_args.kwargs["body"]
+        self.assertIn({"term": {"participant_ids": self.user1.id}}, body["query"]["bool"]["filter"])
+
+    def test_search_requires_keyword(self):
+        resp = self.client.get(reverse("chat-search"))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_message_document_keeps_participants(self):
+        doc = chatSearch.message_to_doc(self.mine, self.thread.buyer_id, self.thread.seller_id)
+        self.assertEqual(doc["_id"], str(self.mine.id))
+        self.assertEqual(doc["_source"]["participant_ids"], [self.user1.id, self.user2.id])
+
 
 class UploadImageViewTests(BaseChatAPITestCase):
+    def setUp(self):
+        super().setUp()
+        use_temporary_image_storage(self)
+
     def test_upload_image_success(self):
         # fake GIF
         image = SimpleUploadedFile(
@@ -146,6 +311,91 @@ class UploadImageViewTests(BaseChatAPITestCase):
         self.assertIn("url", resp.data)
         self.assertTrue(resp.data["url"].startswith("http"))
 
+    @patch("backend.imageService.MAX_IMAGE_BYTES", 1024)
+    def test_upload_too_large(self):
+        image = SimpleUploadedFile("big.png", b"\x89PNG" + b"0" * 128 * 1024, content_type="image/png")
+        resp = self.client.post("/api/chat/upload-image/", {"image": image}, format="multipart")
+        self.assertEqual(resp.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_save_upload_streams_and_cleans_up(self):
+        directory = f"chat_images/test-{uuid.uuid4().hex}"
+        target = os.path.join(settings.BASE_DIR, directory)
+        image = SimpleUploadedFile("a.png", b"x" * 300, content_type="image/png")
+        self.assertEqual(imageService.save_upload(image, directory, "a.png"), f"{directory}/a.png")
+        with open(os.path.join(target, "a.png"), "rb") as file:
+            self.assertEqual(file.read(), b"x" * 300)
+
+        # a file growing past the cap while streaming leaves nothing behind
+        image = SimpleUploadedFile("b.png", b"x" * 300, content_type="image/png")
+        image.size = 10
+        with self.assertRaises(ValueError):
+            imageService.save_upload(image, directory, "b.png", max_bytes=100)
+        self.assertEqual(os.listdir(target), ["a.png"])
+
+    @patch("backend.imagePipeline._executor", new=SimpleNamespace(submit=lambda fn, *args: fn(*args)))
+    @patch("backend.imagePipeline.close_old_connections")
+    @patch("backend.imagePipeline.Image", new=object())
+    @patch("backend.imagePipeline.generate_variants")
+    @patch("chat.views.chatService.record_image_variants")
+    def test_upload_records_variant_urls(self, mock_record, mock_generate, mock_close):
+        image = SimpleUploadedFile("test.gif", b"\x47\x49\x46\x38", content_type="image/gif")
+        mock_generate.side_effect = lambda path: {"160": {"webp": path[:-4] + "_160w.webp"}}
+
+        resp = self.client.post("/api/chat/upload-image/", {"image": image}, format="multipart")
+
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        image_url, variants = mock_record.call_args.args
+        self.assertEqual(image_url, resp.data["url"])
+        self.assertEqual(variants["160"]["webp"], resp.data["url"][:-4] + "_160w.webp")
+        # the worker thread drops stale connections before and after the job
+        self.assertEqual(mock_close.call_count, 2)
+
+    def test_duplicate_upload_not_stored_again(self):
+        content = b"\x47\x49\x46\x38" + uuid.uuid4().bytes
+        urls = []
+        for name in ("a.gif", "b.gif"):
+            image = SimpleUploadedFile(name, content, content_type="image/gif")
+            resp = self.client.post("/api/chat/upload-image/", {"image": image}, format="multipart")
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+            urls.append(resp.data["url"])
+
+        self.assertEqual(urls[0], urls[1])
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(blob.sha256, hashlib.sha256(content).hexdigest())
+        self.assertTrue(urls[0].endswith(f"{blob.sha256}.gif"))
+
+        imageService.release(blob.path)
+        self.assertTrue(os.path.exists(os.path.join(settings.BASE_DIR, blob.path)))
+        imageService.release(blob.path)
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(settings.BASE_DIR, blob.path)))
+
+    @patch("backend.management.commands.dedup_images.init_es_client")
+    @patch("backend.management.commands.dedup_images.get_es_client")
+    def test_dedup_command_merges_existing_files(self, mock_get_es, mock_init_es):
+        mock_get_es.return_value.update_by_query.return_value = {"updated": 0}
+        directory = f"chat_images/test-{uuid.uuid4().hex}"
+        target = os.path.join(settings.BASE_DIR, directory)
+        os.makedirs(target)
+        for name, content in (("one.jpg", b"same"), ("two.jpg", b"same"), ("other.jpg", b"other")):
+            with open(os.path.join(target, name), "wb") as file:
+                file.write(content)
+        thread = ChatThread.objects.create(buyer=self.user1, seller=self.user2)
+        message = ChatMessage.objects.create(thread=thread, sender=self.user1, text="",
+                                             image_url=f"http://testserver/{directory}/two.jpg")
+
+        with patch("backend.imageService.CHAT_IMAGE_DIR", directory), \
+                patch("backend.imageService.PRODUCT_IMAGE_DIR", f"{directory}/none"):
+            call_command("dedup_images", stdout=StringIO())
+
+        same = hashlib.sha256(b"same").hexdigest()
+        other = hashlib.sha256(b"other").hexdigest()
+        self.assertEqual(sorted(os.listdir(target)), sorted([f"{same}.jpg", f"{other}.jpg"]))
+        self.assertEqual(ImageBlob.objects.get(sha256=same).ref_count, 2)
+        message.refresh_from_db()
+        self.assertEqual(message.image_url, f"http://testserver/{directory}/{same}.jpg")
+
     def test_upload_missing_file(self):
         url = "/api/chat/upload-image/"
         resp = self.client.post(url, {}, format="multipart")
@@ -162,3 +412,339 @@ class UploadImageViewTests(BaseChatAPITestCase):
 
         self.assertEqual(resp.status_code, 400)
         self.assertEqual(resp.data["detail"], "only image files allowed")
+
+
+class ChatConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(email="alice@example.com", username="alice", password="pass1234")
+        self.bob = User.objects.create_user(email="bob@example.com", username="bob", password="pass1234")
+        self.thread = ChatThread.objects.create(buyer=self.alice, seller=self.bob)
+        # ids are reused after the flush of a transaction test case
+        userCache.clear_local()
+        for user in (self.alice, self.bob):
+            userCache.invalidate(user.id)
+
+    async def _connect(self, user):
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(user).access_token))()
+        communicator = WebsocketCommunicator(JWTAuthMiddleware(ChatConsumer.as_asgi()), f"/chat/?token={token}")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        hello = await communicator.receive_json_from()
+        self.assertEqual(hello["event"], "connected")
+        sync = await communicator.receive_json_from()
+        self.assertEqual(sync["type"], "sync")
+        return communicator
+
+    def test_message_saved_and_forwarded(self):
+        async def run():
+            alice = await self._connect(self.alice)
+            bob = await self._connect(self.bob)
+
+            await alice.send_json_to({"type": "chat_message", "me": "alice", "peer": "bob",
+                                      "message": "hello", "threadId": str(self.thread.id)})
+            event = await bob.receive_json_from(timeout=5)
+            self.assertEqual(event["message"], "hello")
+            self.assertEqual(event["sender"], "alice")
+
+            await alice.send_json_to({"type": "chat_location", "threadId": str(self.thread.id),
+                                      "lat": 0.0, "lng": 1.5, "address": "here"})
+            event = await bob.receive_json_from(timeout=5)
+            self.assertEqual(event["lat"], 0.0)
+
+            await alice.send_json_to({"type": "chat_location", "threadId": str(self.thread.id),
+                                      "lat": "north", "lng": 1.5, "clientId": "c1"})
+            error = await alice.receive_json_from(timeout=5)
+            self.assertEqual((error["type"], error["clientId"]), ("error", "c1"))
+            self.assertTrue(await bob.receive_nothing())
+
+            # a replayed frame is stored and forwarded once
+            frame = {"type": "chat_message", "message": "again", "threadId": str(self.thread.id),
+                     "clientId": str(uuid.UUID(int=7))}
+            await alice.send_json_to(frame)
+            self.assertEqual((await bob.receive_json_from(timeout=5))["message"], "again")
+            await alice.send_json_to(frame)
+            self.assertTrue(await bob.receive_nothing())
+
+            await alice.disconnect()
+            await bob.disconnect()
+
+        async_to_sync(run)()
+        messages = list(ChatMessage.objects.filter(thread=self.thread).order_by("id"))
+        self.assertEqual([m.kind for m in messages], ["text", "location", "text"])
+        self.assertTrue(all(m.sender_id == self.alice.id for m in messages))
+
+    def test_every_session_of_peer_receives(self):
+        async def run():
+            alice = await self._connect(self.alice)
+            bob_phone = await self._connect(self.bob)
+            bob_tablet = await self._connect(self.bob)
+
+            await alice.send_json_to({"type": "chat_image", "image_url": "http://example.com/x.png",
+                                      "threadId": str(self.thread.id)})
+            for session in (bob_phone, bob_tablet):
+                event = await session.receive_json_from(timeout=5)
+                self.assertEqual(event["image_url"], "http://example.com/x.png")
+
+            # a closed session leaves the group, the remaining one still receives
+            await bob_phone.disconnect()
+            await alice.send_json_to({"type": "chat_message", "message": "still there?",
+                                      "threadId": str(self.thread.id)})
+            event = await bob_tablet.receive_json_from(timeout=5)
+            self.assertEqual(event["message"], "still there?")
+
+            await alice.disconnect()
+            await bob_tablet.disconnect()
+
+        async_to_sync(run)()
+
+    def test_reconnect_receives_missed_messages(self):
+        async def run():
+            alice = await self._connect(self.alice)
+            bob = await self._connect(self.bob)
+            await alice.send_json_to({"type": "chat_message", "message": "first", "threadId": str(self.thread.id)})
+            event = await bob.receive_json_from(timeout=5)
+            await bob.send_json_to({"type": "ack", "lastId": event["id"]})
+            await bob.disconnect()
+
+            # bob is offline, the messages are only persisted
+            for text in ("second", "third"):
+                await alice.send_json_to({"type": "chat_message", "message": text, "threadId": str(self.thread.id)})
+            await alice.disconnect()
+
+            token = await sync_to_async(lambda: str(RefreshToken.for_user(self.bob).access_token))()
+            bob = WebsocketCommunicator(JWTAuthMiddleware(ChatConsumer.as_asgi()), f"/chat/?token={token}")
+            await bob.connect()
+            await bob.receive_json_from()
+            sync = await bob.receive_json_from(timeout=5)
+            # recently acknowledged messages are sent again in case one committed late, the client skips known ids
+            self.assertEqual([m["text"] for m in sync["messages"] if m["id"] > event["id"]], ["second", "third"])
+            self.assertEqual(sync["messages"][-1]["thread_id"], str(self.thread.id))
+            self.assertEqual(sync["last_id"], sync["messages"][-1]["id"])
+            self.assertFalse(sync["has_more"])
+
+            # an explicit lastId takes precedence over the stored cursor, past the cursor nothing is sent again
+            await bob.send_json_to({"type": "sync", "lastId": sync["messages"][-2]["id"]})
+            sync = await bob.receive_json_from(timeout=5)
+            self.assertEqual([m["text"] for m in sync["messages"]], ["third"])
+            await bob.disconnect()
+
+        async_to_sync(run)()
+
+    @override_settings(CHAT_WRITE_BEHIND=True)
+    def test_write_behind_forwards_and_queues(self):
+        with patch("chat.views.messageQueue.enqueue", new_callable=AsyncMock) as mock_enqueue:
+            async def run():
+                alice = await self._connect(self.alice)
+                bob = await self._connect(self.bob)
+                await alice.send_json_to({"type": "chat_message", "message": "fast",
+                                          "threadId": str(self.thread.id),
+                                          "clientId": "6f1c1c52-52b4-4d7e-9d3b-2d8e2d1e8a11"})
+                event = await bob.receive_json_from(timeout=5)
+                self.assertEqual(event["message"], "fast")
+                await alice.disconnect()
+                await bob.disconnect()
+
+            async_to_sync(run)()
+
+        self.assertFalse(ChatMessage.objects.exists())
+        args, kwargs = mock_enqueue.call_args
+        self.assertEqual(args, (self.thread.id, self.alice.id, {"text": "fast", "image_url": ""}))
+        self.assertEqual(str(kwargs["client_id"]), "6f1c1c52-52b4-4d7e-9d3b-2d8e2d1e8a11")
+
+    def test_batch_persisted_once_and_acked(self):
+        batch = {"type": "batch", "threadId": str(self.thread.id), "items": [
+            {"type": "chat_message", "message": "one", "clientId": str(uuid.UUID(int=1))},
+            {"type": "chat_message"},
+            {"type": "chat_location", "lat": 1.0, "lng": 2.0, "clientId": str(uuid.UUID(int=2))},
+            {"type": "chat_message", "message": "elsewhere", "threadId": str(uuid.uuid4())},
+        ]}
+
+        async def run():
+            alice = await self._connect(self.alice)
+            bob = await self._connect(self.bob)
+            await alice.send_json_to(batch)
+            ack = await alice.receive_json_from(timeout=5)
+            self.assertEqual(ack["type"], "batch_ack")
+            self.assertEqual(ack["clientIds"], [str(uuid.UUID(int=1)), None, str(uuid.UUID(int=2)), None])
+            self.assertIsNone(ack["ids"][1])
+
+            frame = await bob.receive_json_from(timeout=5)
+            self.assertEqual(frame["type"], "chat_batch")
+            self.assertEqual([m["id"] for m in frame["messages"]], [ack["ids"][0], ack["ids"][2]])
+            self.assertEqual(frame["messages"][0]["message"], "one")
+
+            # replaying the outbox returns the same ids and forwards nothing
+            await alice.send_json_to(batch)
+            replay = await alice.receive_json_from(timeout=5)
+            self.assertEqual(replay["ids"], ack["ids"])
+            self.assertTrue(await bob.receive_nothing(timeout=0.5))
+            await alice.disconnect()
+            await bob.disconnect()
+
+        async_to_sync(run)()
+        self.assertEqual(ChatMessage.objects.filter(thread=self.thread).count(), 2)
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.seller_unread, 2)
+        self.assertEqual(self.thread.last_message_kind, "location")
+
+    def test_typing_forwarded_and_rate_limited(self):
+        async def run():
+            alice = await self._connect(self.alice)
+            bob = await self._connect(self.bob)
+            self.assertIsNotNone((await sync_to_async(presence.get_presence)([self.alice.id]))[self.alice.id])
+
+            await alice.send_json_to({"type": "typing", "threadId": str(self.thread.id)})
+            event = await bob.receive_json_from(timeout=5)
+            self.assertEqual(event, {"type": "chat_typing", "threadId": str(self.thread.id), "sender": "alice"})
+            await alice.send_json_to({"type": "typing", "threadId": str(self.thread.id)})
+            self.assertTrue(await bob.receive_nothing(timeout=0.5))
+            await alice.disconnect()
+            await bob.disconnect()
+
+        async_to_sync(run)()
+
+    def test_image_message_gets_generated_variants(self):
+        image_url = "http://testserver/chat_images/a.png"
+        variants = {"160": {"webp": "http://testserver/chat_images/a_160w.webp"}}
+        early = ChatMessage.objects.create(thread=self.thread, sender=self.alice, text="", image_url=image_url)
+        chatService.record_image_variants(image_url, variants)
+        early.refresh_from_db()
+        self.assertEqual(early.image_variants, variants)
+
+        async def run():
+            alice = await self._connect(self.alice)
+            bob = await self._connect(self.bob)
+            await alice.send_json_to({"type": "chat_image", "image_url": image_url, "threadId": str(self.thread.id)})
+            event = await bob.receive_json_from(timeout=5)
+            self.assertEqual(event["image_variants"], variants)
+            await alice.disconnect()
+            await bob.disconnect()
+
+        async_to_sync(run)()
+        self.assertEqual(ChatMessage.objects.order_by("-id").first().image_variants, variants)
+
+    def test_invalid_token_rejected(self):
+        async def run():
+            communicator = WebsocketCommunicator(JWTAuthMiddleware(ChatConsumer.as_asgi()), "/chat/?token=nope")
+            connected, _ = await communicator.connect()
+            self.assertFalse(connected)
+
+        async_to_sync(run)()
+
+    def test_message_to_foreign_thread_dropped(self):
+        charlie = User.objects.create_user(email="charlie@example.com", username="charlie", password="pass")
+        userCache.invalidate(charlie.id)
+
+        async def run():
+            communicator = await self._connect(charlie)
+            await communicator.send_json_to({"type": "chat_message", "message": "spam",
+                                             "threadId": str(self.thread.id)})
+            self.assertTrue(await communicator.receive_nothing(timeout=0.5))
+            await communicator.disconnect()
+
+        async_to_sync(run)()
+        self.assertFalse(ChatMessage.objects.filter(thread=self.thread).exists())
+
+
+class MessagesSinceTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(email="alice@example.com", username="alice", password="pass1234")
+        self.bob = User.objects.create_user(email="bob@example.com", username="bob", password="pass1234")
+        self.carol = User.objects.create_user(email="carol@example.com", username="carol", password="pass1234")
+        self.thread_ab = ChatThread.objects.create(buyer=self.alice, seller=self.bob)
+        self.thread_bc = ChatThread.objects.create(buyer=self.bob, seller=self.carol)
+        self.thread_ac = ChatThread.objects.create(buyer=self.alice, seller=self.carol)
+        self.seen = ChatMessage.objects.create(thread=self.thread_ab, sender=self.alice, text="seen")
+        ChatMessage.objects.create(thread=self.thread_ab, sender=self.alice, text="a")
+        ChatMessage.objects.create(thread=self.thread_ac, sender=self.alice, text="not bob's")
+        ChatMessage.objects.create(thread=self.thread_bc, sender=self.carol, text="b")
+
+    def test_delta_across_threads(self):
+        chatService.acknowledge(self.bob.id, self.seen.id)
+        # cursor, messages just before it and messages after it
+        with self.assertNumQueries(3):
+            messages, last_id, has_more = chatService.messages_since(self.bob.id)
+        # "seen" was created right before the ack and may have committed after it, it is sent again
+        self.assertEqual([m["text"] for m in messages], ["seen", "a", "b"])
+        self.assertEqual(last_id, messages[-1]["id"])
+        self.assertFalse(has_more)
+
+        messages, last_id, has_more = chatService.messages_since(self.bob.id, limit=1)
+        self.assertEqual([m["text"] for m in messages], ["seen", "a"])
+        self.assertEqual(last_id, messages[-1]["id"])
+        self.assertTrue(has_more)
+
+        # the next page, requested before the first was acked, repeats nothing of the first
+        messages, last_id, has_more = chatService.messages_since(self.bob.id, last_id, limit=1)
+        self.assertEqual([m["text"] for m in messages], ["b"])
+        self.assertFalse(has_more)
+
+    def test_message_committed_after_ack_is_synced(self):
+        # the id was taken before the ack but the message only became visible after it, e.g. a concurrent transaction
+        late = ChatMessage.objects.create(thread=self.thread_bc, sender=self.carol, text="late")
+        chatService.acknowledge(self.bob.id, late.id + 1)
+        ChatMessage.objects.filter(pk=self.seen.pk).update(created_at=timezone.now() - timedelta(minutes=5))
+
+        messages, last_id, has_more = chatService.messages_since(self.bob.id)
+        self.assertIn(late.id, [m["id"] for m in messages])
+        self.assertNotIn(self.seen.id, [m["id"] for m in messages])
+        self.assertEqual(last_id, late.id + 1)
+        self.assertFalse(has_more)
+
+    def test_cursor_never_moves_back_and_is_empty_without_ack(self):
+        self.assertEqual(chatService.messages_since(self.bob.id), ([], None, False))
+        last = ChatMessage.objects.order_by("-id").first()
+        chatService.acknowledge(self.bob.id, last.id)
+        chatService.acknowledge(self.bob.id, self.seen.id)
+        self.assertEqual(ChatDeliveryCursor.objects.get(user=self.bob).last_message_id, last.id)
+
+
+class WriteBehindPersistTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(email="alice@example.com", username="alice", password="pass1234")
+        self.bob = User.objects.create_user(email="bob@example.com", username="bob", password="pass1234")
+        self.thread = ChatThread.objects.create(buyer=self.alice, seller=self.bob)
+
+    def _entry(self, n, sender, **fields):
+        data = {
+            "client_id": str(uuid.UUID(int=n)),
+            "thread_id": str(self.thread.id),
+            "sender_id": str(sender.id),
+            "created_at": timezone.now().isoformat(),
+            **fields,
+        }
+        return f"{n}-0".encode(), {k.encode(): v.encode() for k, v in data.items()}
+
+    def test_persist_batch_is_idempotent(self):
+        entries = [
+            self._entry(1, self.alice, text="one"),
+            self._entry(2, self.alice, text="two"),
+            self._entry(3, self.bob, text="", lat="1.5", lng="2.5", address="here"),
+            self._entry(4, self.alice, text="gone", thread_id=str(uuid.uuid4())),
+        ]
+        from chat import messageQueue
+
+        with self.assertNumQueries(7):
+            # 2 lookups, savepoint, bulk insert, 2 summary updates, release
+            self.assertEqual(messageQueue.persist_batch(entries), 3)
+        # a redelivered batch inserts nothing and does not count unread messages twice
+        self.assertEqual(messageQueue.persist_batch(entries), 0)
+
+        self.assertEqual(ChatMessage.objects.count(), 3)
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.seller_unread, 2)
+        self.assertEqual(self.thread.buyer_unread, 1)
+        self.assertEqual(self.thread.last_message_preview, "[Location]")
+
+    def test_malformed_entries_dropped(self):
+        from chat import messageQueue
+
+        entries = [
+            self._entry(1, self.alice, text="", lat="north", lng="2.5"),
+            self._entry(2, self.alice, text="", lat="nan", lng="2.5"),
+            self._entry(3, self.alice, text="bad id", client_id="not-a-uuid"),
+            self._entry(4, self.alice, text="ok"),
+        ]
+        # the batch does not fail, so the drain loop acks it instead of re-reading it forever
+        self.assertEqual(messageQueue.persist_batch(entries), 1)
+        self.assertEqual(list(ChatMessage.objects.values_list("text", flat=True)), ["ok"])
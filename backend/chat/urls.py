@@ -15,12 +15,26 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.urls import path
-from .views import ChatConsumer, LoadMessagesView, CreateThreadView, LoadThreadsView, UploadImageView
+from .views import (
+    ChatConsumer,
+    LoadMessagesView,
+    CreateThreadView,
+    LoadThreadsView,
+    UploadImageView,
+    UnreadCountView,
+    MarkThreadReadView,
+    PresenceView,
+    SearchMessagesView,
+)
 
 urlpatterns = [
     path("thread/", CreateThreadView.as_view(), name="chat-thread"),
     path("threads/", LoadThreadsView.as_view(), name="chat-threads"),
     path("thread/<uuid:thread_id>/messages/",LoadMessagesView.as_view(),name="chat-thread-messages",),
+    path("thread/<uuid:thread_id>/read/", MarkThreadReadView.as_view(), name="chat-thread-read"),
+    path("unread/", UnreadCountView.as_view(), name="chat-unread"),
+    path("presence/", PresenceView.as_view(), name="chat-presence"),
+    path("search/", SearchMessagesView.as_view(), name="chat-search"),
     path("upload-image/", UploadImageView.as_view()),
 ]
 
@@ -1,16 +1,18 @@
 import logging
+import math
 import time
+from collections import defaultdict
 
-import jwt
-import redis
-from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
-from channels.layers import get_channel_layer
 from django.http import QueryDict
+from django.db import IntegrityError
 from django.db.models import Q
 
-from backend import settings
+from django.conf import settings
+from backend import imageService
 from user.models import User
+from chat import chatSearch, chatService, messageQueue, presence
 from chat.models import ChatThread, ChatMessage
 
 from rest_framework.views import APIView
@@ -22,240 +24,399 @@ from rest_framework.parsers import MultiPartParser, FormParser
 from uuid import UUID
 
 import os
-import uuid
 from django.core.files.storage import default_storage
 
 
 
 
 logger = logging.getLogger(__name__)
-channel_layer = get_channel_layer()
-redis_connection = redis.from_url(
-    settings.CHANNEL_LAYERS["default"]["CONFIG"]["hosts"][0]
-)
+
+DEFAULT_MESSAGE_PAGE_SIZE = 30
+MAX_MESSAGE_PAGE_SIZE = 200
+MAX_BATCH_ITEMS = 100
+MAX_PRESENCE_USERNAMES = 200
+MAX_SEARCH_SIZE = 50
+# typing frames of a socket in a thread faster than this are dropped
+TYPING_MIN_INTERVAL_SECONDS = 3
+
+
+def parse_coordinate(value, limit: float) -> float:
+    """
+    coerce a latitude or longitude of a frame to a float within [-limit, limit]
+    raise ValueError if it is not a finite number in range
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"invalid coordinate {value!r}")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid coordinate {value!r}")
+    if not math.isfinite(number) or abs(number) > limit:
+        raise ValueError(f"invalid coordinate {value!r}")
+    return number
+
+
+def user_group_name(user_id) -> str:
+    """
+    channel layer group of all websocket sessions of a user
+    """
+    return f"chat.user.{user_id}"
 
 
 class ChatConsumer(AsyncJsonWebsocketConsumer):
     async def connect(self):
-        query_string = self.scope["query_string"].decode("utf-8")
-        query_dict = QueryDict(query_string)
-
-        if "token" not in query_dict:
-            logger.info("WS connect: No token provided")
+        # the user is authenticated by user.middleware.JWTAuthMiddleware in backend.asgi
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            logger.info("WS connect: unauthenticated")
             await self.close()
             return
 
-        token = query_dict["token"]
-        try:
-            jwt_payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-            logger.debug("WS connect jwt payload: %s", jwt_payload)
-            current_time = time.time()
-            if current_time >= jwt_payload["exp"]:
-                logger.info("WS connect: token expired")
-                await self.close()
-                return
-
-            user = await sync_to_async(User.objects.get)(id=jwt_payload["user_id"])
-            username = user.username
-
-            logger.info(
-                "WS connect OK, username=%s, channel=%s", username, self.channel_name
-            )
-            await self.accept()
-
-            # 把 username -> channel_name 存进 redis
-            await sync_to_async(redis_connection.set)(
-                f"ws:u:{username}", self.channel_name
-            )
+        # the threads the user may write to are cached for the lifetime of the socket
+        self.user = user
+        self.threads = {}
+        # monotonic time of the last presence write and of the last typing event per thread
+        self.presence_at = 0.0
+        self.typing_at = {}
+        username = self.user.username
 
-            # 可选：告诉前端“连接成功”
-            await self.send_json(
-                {"type": "system", "event": "connected", "username": username}
-            )
+        logger.info(
+            "WS connect OK, username=%s, channel=%s", username, self.channel_name
+        )
+        # every session of a user joins the user's group, so all devices get its messages
+        self.user_group = user_group_name(self.user.id)
+        await self.channel_layer.group_add(self.user_group, self.channel_name)
+        await self.accept()
+        await self.heartbeat()
+
+        # 可选：告诉前端“连接成功”
+        await self.send_json(
+            {"type": "system", "event": "connected", "username": username}
+        )
+        # messages missed while offline, since lastId or the last acknowledged message
+        query_dict = QueryDict(self.scope["query_string"].decode("utf-8"))
+        await self.send_sync(query_dict.get("lastId"))
 
-        except Exception:
-            logger.exception("WS connect: jwt parse error")
-            await self.close()
+    async def disconnect(self, code):
+        user_group = getattr(self, "user_group", None)
+        if user_group is not None:
+            await self.channel_layer.group_discard(user_group, self.channel_name)
+            logger.info("WS disconnect, username=%s, channel=%s", self.user.username, self.channel_name)
 
     async def chat_message(self, event):
         await self.send_json(event)
 
-    async def receive_json(self, content, **kwargs):
-        msg_type = content.get("type")
-
-        if msg_type == "chat_message":
-            me = content.get("me")
-            peer = content.get("peer")
-            message = content.get("message")
-            thread_id = content.get("threadId")
-
-            logger.info(
-                "WS receive chat_message: me=%s peer=%s threadId=%s msg=%s",
-                me, peer, thread_id, message
-            )
-
-            if not (me and peer and message and thread_id):
-                logger.warning("WS chat_message missing fields: %s", content)
-                return
+    async def chat_batch(self, event):
+        await self.send_json(event)
 
-            try:
-                sender_user = await sync_to_async(User.objects.get)(username=me)
-
-                try:
-                    thread_uuid = UUID(str(thread_id))
-                except Exception:
-                    logger.exception("invalid threadId=%s, cannot parse as UUID", thread_id)
-                    return
-
-                try:
-                    thread = await sync_to_async(ChatThread.objects.get)(id=thread_uuid)
-                except ChatThread.DoesNotExist:
-                    logger.warning("ChatThread %s not found, skip saving", thread_uuid)
-                else:
-                    await sync_to_async(ChatMessage.objects.create)(
-                        thread=thread,
-                        sender=sender_user,
-                        text=message,
-                        image_url="",
-                    )
-                    logger.info("ChatMessage saved (text), thread=%s sender=%s", thread_uuid, me)
+    async def chat_typing(self, event):
+        await self.send_json(event)
 
-            except Exception:
-                logger.exception("save chat message error")
+    async def heartbeat(self):
+        """
+        refresh the presence of the user, repeated heartbeats of a socket are written at most
+        every HEARTBEAT_MIN_INTERVAL_SECONDS
+        """
+        now = time.monotonic()
+        if now - self.presence_at < presence.HEARTBEAT_MIN_INTERVAL_SECONDS:
+            return
+        self.presence_at = now
+        await presence.touch(self.user.id)
+
+    async def typing(self, thread_id):
+        """
+        tell every session of the peer that the user is typing, at most once every
+        TYPING_MIN_INTERVAL_SECONDS per thread, clients hide the indicator after a few seconds
+        """
+        thread = await self.get_thread(thread_id)
+        if thread is None:
+            return
+        now = time.monotonic()
+        if now - self.typing_at.get(thread.id, 0.0) < TYPING_MIN_INTERVAL_SECONDS:
+            return
+        self.typing_at[thread.id] = now
+        event = {"type": "chat_typing", "threadId": str(thread.id), "sender": self.user.username}
+        await self.forward(thread, event)
+
+    async def send_sync(self, last_id=None):
+        """
+        send the messages of all threads after last_id, or after the delivery cursor of the user,
+        in one sync frame, the client acks the last id it stored and asks again while has_more is set
+        """
+        try:
+            last_id = int(last_id) if last_id not in (None, "") else None
+        except (TypeError, ValueError):
+            logger.warning("invalid sync lastId=%s, delivery cursor used", last_id)
+            last_id = None
+        messages, last_id, has_more = await database_sync_to_async(chatService.messages_since)(
+            self.user.id, last_id)
+        await self.send_json({
+            "type": "sync",
+            "messages": messages,
+            "last_id": last_id,
+            "has_more": has_more,
+        })
+
+    async def acknowledge(self, last_id):
+        try:
+            last_id = int(last_id)
+        except (TypeError, ValueError):
+            logger.warning("WS ack invalid lastId=%s", last_id)
+            return
+        await database_sync_to_async(chatService.acknowledge)(self.user.id, last_id)
 
+    async def get_thread(self, thread_id) -> ChatThread | None:
+        """
+        get a thread the current user participates in, membership is checked once per socket
+        return none if the thread does not exist or the user is not part of it
+        """
+        try:
+            thread_uuid = UUID(str(thread_id))
+        except ValueError:
+            logger.warning("invalid threadId=%s, cannot parse as UUID", thread_id)
+            return None
+
+        thread = self.threads.get(thread_uuid)
+        if thread is not None:
+            return thread
+        try:
+            thread = await ChatThread.objects.select_related("buyer", "seller").aget(id=thread_uuid)
+        except ChatThread.DoesNotExist:
+            logger.warning("ChatThread %s not found", thread_uuid)
+            return None
+        if self.user.id not in (thread.buyer_id, thread.seller_id):
+            logger.warning("user %s is not part of ChatThread %s", self.user.username, thread_uuid)
+            return None
+        self.threads[thread_uuid] = thread
+        return thread
+
+    async def save_and_forward(self, thread: ChatThread, fields: dict, event: dict,
+                               client_id: UUID | None = None):
+        """
+        persist a message sent by the current user and push it to every session of the peer
+        in write-behind mode the message is pushed first and queued for batched persistence
+        """
+        if settings.CHAT_WRITE_BEHIND:
+            await self.forward(thread, event)
             try:
-                peer_channel = await sync_to_async(redis_connection.get)(f"ws:u:{peer}")
-                if peer_channel:
-                    peer_channel = peer_channel.decode("utf-8")
-                    logger.info("send text to peer channel %s", peer_channel)
-                    await channel_layer.send(
-                        peer_channel,
-                        {
-                            "type": "chat_message",
-                            "message": message,
-                            "sender": me,
-                            "image_url": "",
-                        },
-                    )
-                else:
-                    logger.info("peer %s offline (no ws channel)", peer)
+                await messageQueue.enqueue(thread.id, self.user.id, fields, client_id=client_id)
             except Exception:
-                logger.exception("send to peer channel error")
+                logger.exception("queue chat message error")
             return
 
-        if msg_type == "chat_image":
-            me = content.get("me")
-            peer = content.get("peer")
-            image_url = content.get("image_url")
-            thread_id = content.get("threadId")
-
-            logger.info(
-                "WS receive chat_image: me=%s peer=%s threadId=%s url=%s",
-                me, peer, thread_id, image_url
-            )
-
-            if not (me and peer and image_url and thread_id):
-                logger.warning("WS chat_image missing fields: %s", content)
+        try:
+            message = await ChatMessage.objects.acreate(thread=thread, sender=self.user, client_id=client_id, **fields)
+            logger.info("ChatMessage saved, thread=%s sender=%s", thread.id, self.user.username)
+            # the id lets the receiver ack the message, see send_sync
+            event = {**event, "id": message.id, "created_at": message.created_at.isoformat()}
+            chatSearch.index_later([chatSearch.message_to_doc(message, thread.buyer_id, thread.seller_id)])
+        except IntegrityError:
+            if client_id is not None and await ChatMessage.objects.filter(client_id=client_id).aexists():
+                # a replayed frame, the peer got the message when it was first stored
+                logger.info("ChatMessage clientId=%s already stored, not forwarded again", client_id)
                 return
+            logger.exception("save chat message error")
+        except Exception:
+            logger.exception("save chat message error")
+        await self.forward(thread, event)
 
-            try:
-                sender_user = await sync_to_async(User.objects.get)(username=me)
-
-                try:
-                    thread_uuid = UUID(str(thread_id))
-                except Exception:
-                    logger.exception("invalid threadId=%s, cannot parse as UUID", thread_id)
-                    return
-
-                try:
-                    thread = await sync_to_async(ChatThread.objects.get)(id=thread_uuid)
-                except ChatThread.DoesNotExist:
-                    logger.warning("ChatThread %s not found, skip saving", thread_uuid)
-                else:
-                    await sync_to_async(ChatMessage.objects.create)(
-                        thread=thread,
-                        sender=sender_user,
-                        text="",
-                        image_url=image_url,
-                    )
-                    logger.info("ChatMessage saved (image), thread=%s sender=%s", thread_uuid, me)
+    async def forward(self, thread: ChatThread, event: dict):
+        peer_id = thread.seller_id if thread.buyer_id == self.user.id else thread.buyer_id
+        try:
+            await self.channel_layer.group_send(user_group_name(peer_id), event)
+        except Exception:
+            logger.exception("send to peer group error")
+
+    def parse_message(self, content: dict) -> tuple[dict, dict] | None:
+        """
+        turn a chat_message, chat_image or chat_location frame into model fields and the event
+        forwarded to the peer, return none if the frame is not a valid message
+        raise ValueError if the coordinates of a location are not numbers in range, such a frame would
+        otherwise fail when it is persisted
+        """
+        msg_type = content.get("type")
+        thread_id = content.get("threadId")
+        me = self.user.username
 
-            except Exception:
-                logger.exception("save chat image error")
+        if msg_type == "chat_message":
+            message = content.get("message")
+            logger.info("WS receive chat_message: me=%s threadId=%s msg=%s", me, thread_id, message)
+            if not (message and thread_id):
+                logger.warning("WS chat_message missing fields: %s", content)
+                return None
+            fields = {"text": message, "image_url": ""}
+            event = {"type": "chat_message", "message": message, "sender": me, "image_url": ""}
 
-            try:
-                peer_channel = await sync_to_async(redis_connection.get)(f"ws:u:{peer}")
-                if peer_channel:
-                    peer_channel = peer_channel.decode("utf-8")
-                    logger.info("send image to peer channel %s", peer_channel)
-                    await channel_layer.send(
-                        peer_channel,
-                        {
-                            "type": "chat_message",
-                            "message": "",
-                            "sender": me,
-                            "image_url": image_url,
-                        },
-                    )
-                else:
-                    logger.info("peer %s offline (no ws channel)", peer)
-            except Exception:
-                logger.exception("send to peer channel error")
-            return
-        
-        if msg_type == "chat_location":
-            me = content.get("me")
-            peer = content.get("peer")
-            thread_id = content.get("threadId")
+        elif msg_type == "chat_image":
+            image_url = content.get("image_url")
+            logger.info("WS receive chat_image: me=%s threadId=%s url=%s", me, thread_id, image_url)
+            if not (image_url and thread_id):
+                logger.warning("WS chat_image missing fields: %s", content)
+                return None
+            fields = {"text": "", "image_url": image_url}
+            event = {"type": "chat_message", "message": "", "sender": me, "image_url": image_url}
 
+        elif msg_type == "chat_location":
             lat = content.get("lat")
             lng = content.get("lng")
             address = content.get("address")
-
-            if not (me and peer and thread_id and lat and lng):
+            if not thread_id or lat is None or lng is None:
                 logger.warning("WS chat_location missing fields: %s", content)
-                return
+                return None
+            lat, lng = parse_coordinate(lat, 90), parse_coordinate(lng, 180)
+            fields = {"text": "", "image_url": "", "lat": lat, "lng": lng, "address": address}
+            event = {"type": "chat_message", "message": "", "sender": me, "lat": lat, "lng": lng, "address": address}
 
-            try:
-                sender_user = await sync_to_async(User.objects.get)(username=me)
+        else:
+            logger.debug("WS receive_json ignore msg_type=%s, content=%s", msg_type, content)
+            return None
+        return fields, event
 
-                thread_uuid = UUID(str(thread_id))
-                thread = await sync_to_async(ChatThread.objects.get)(id=thread_uuid)
+    @staticmethod
+    def parse_client_id(content: dict) -> UUID | None:
+        try:
+            return UUID(str(content["clientId"])) if content.get("clientId") else None
+        except ValueError:
+            logger.warning("invalid clientId=%s, ignored", content.get("clientId"))
+            return None
+
+    @staticmethod
+    async def attach_image_variants(messages: list[tuple[dict, dict]]):
+        """
+        add the variants of uploaded images that are already generated to the fields and events
+        of image messages, one cache round trip for all messages
+        """
+        image_urls = [fields["image_url"] for fields, _ in messages if fields.get("image_url")]
+        if not image_urls:
+            return
+        found = await chatService.aget_image_variants(image_urls)
+        for fields, event in messages:
+            variants = found.get(fields.get("image_url"))
+            if variants:
+                fields["image_variants"] = variants
+                event["image_variants"] = variants
 
-                await sync_to_async(ChatMessage.objects.create)(
-                    thread=thread,
-                    sender=sender_user,
-                    text="",
-                    image_url="",
-                    lat=lat,
-                    lng=lng,
-                    address=address,
-                )
+    async def receive_json(self, content, **kwargs):
+        msg_type = content.get("type")
 
-                logger.info("ChatMessage saved (location)")
+        if msg_type == "sync":
+            await self.send_sync(content.get("lastId"))
+            return
+        if msg_type == "ack":
+            await self.acknowledge(content.get("lastId"))
+            return
+        if msg_type == "batch":
+            await self.receive_batch(content)
+            return
+        if msg_type == "heartbeat":
+            await self.heartbeat()
+            return
+        if msg_type == "typing":
+            await self.typing(content.get("threadId"))
+            return
 
-            except Exception:
-                logger.exception("save chat location error")
+        try:
+            parsed = self.parse_message(content)
+        except ValueError as e:
+            logger.warning("WS invalid %s: %s", msg_type, e)
+            await self.send_json({"type": "error", "error": str(e), "clientId": content.get("clientId")})
+            return
+        if parsed is None:
+            return
+        fields, event = parsed
+        thread = await self.get_thread(content.get("threadId"))
+        if thread is None:
+            return
+        await self.attach_image_variants([(fields, event)])
+        client_id = self.parse_client_id(content)
+        event["threadId"] = str(thread.id)
+        event["clientId"] = str(client_id) if client_id else None
+        await self.save_and_forward(thread, fields, event, client_id=client_id)
+
+    async def receive_batch(self, content: dict):
+        """
+        handle a batch frame carrying many message frames in `items`, e.g. an outbox replayed after reconnecting
+        1. parse every item, items without threadId use the threadId of the batch
+        2. persist all valid items with one bulk insert, items already stored (same clientId) are not duplicated
+        3. forward the new messages as one chat_batch frame per peer
+        4. answer with one batch_ack, ids and clientIds are aligned with items, none for rejected items
+        """
+        items = content.get("items")
+        if not isinstance(items, list) or not 1 <= len(items) <= MAX_BATCH_ITEMS:
+            logger.warning("WS batch needs 1 to %s items, got %s", MAX_BATCH_ITEMS, type(items).__name__)
+            await self.send_json({"type": "batch_ack", "error": f"items must be a list of 1 to {MAX_BATCH_ITEMS}"})
+            return
 
+        accepted = []  # (index, thread, fields, event, client_id)
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                continue
+            item = {"threadId": content.get("threadId"), **item}
             try:
-                peer_channel = await sync_to_async(redis_connection.get)(f"ws:u:{peer}")
-                if peer_channel:
-                    await channel_layer.send(
-                        peer_channel.decode("utf-8"),
-                        {
-                            "type": "chat_message",
-                            "message": "",
-                            "sender": me,
-                            "lat": lat,
-                            "lng": lng,
-                            "address": address,
-                        },
-                    )
+                parsed = self.parse_message(item)
+            except ValueError as e:
+                logger.warning("WS batch item %s rejected: %s", index, e)
+                continue
+            if parsed is None:
+                continue
+            thread = await self.get_thread(item["threadId"])
+            if thread is None:
+                continue
+            fields, event = parsed
+            accepted.append((index, thread, fields, event, self.parse_client_id(item)))
+
+        await self.attach_image_variants([(fields, event) for _, _, fields, event, _ in accepted])
+        ids = [None] * len(items)
+        client_ids = [None] * len(items)
+        rows = [(thread.id, fields, client_id) for _, thread, fields, _, client_id in accepted]
+        outgoing = []  # (thread, event)
+        if settings.CHAT_WRITE_BEHIND:
+            # ids are assigned by the drain worker, clients dedupe on clientId until they resync
+            try:
+                queued = await messageQueue.enqueue_many(self.user.id, rows)
             except Exception:
-                logger.exception("send to peer channel error")
-
-            return
-        logger.debug("WS receive_json ignore msg_type=%s, content=%s", msg_type, content)
+                logger.exception("queue chat message batch error")
+                queued = [None] * len(rows)
+            for (index, thread, _, event, _), client_id in zip(accepted, queued):
+                client_ids[index] = client_id
+                outgoing.append((thread, {**event, "threadId": str(thread.id), "clientId": client_id}))
+        elif rows:
+            try:
+                stored = await database_sync_to_async(chatService.create_messages)(self.user.id, rows)
+            except Exception:
+                logger.exception("save chat message batch error")
+                stored = []
+            forwarded = set()
+            for (index, thread, _, event, _), message in zip(accepted, stored):
+                ids[index] = message.id
+                client_ids[index] = str(message.client_id)
+                if message.created and message.id not in forwarded:
+                    forwarded.add(message.id)
+                    outgoing.append((thread, {**event, "threadId": str(thread.id), "clientId": str(message.client_id),
+                                              "id": message.id, "created_at": message.created_at.isoformat()}))
+            logger.info("ChatMessage batch saved, sender=%s count=%s", self.user.username, len(outgoing))
+            chatSearch.index_later([
+                chatSearch.message_to_doc(message, thread.buyer_id, thread.seller_id)
+                for (_, thread, _, _, _), message in zip(accepted, stored) if message.created
+            ])
+
+        await self.forward_batch(outgoing)
+        await self.send_json({"type": "batch_ack", "ids": ids, "clientIds": client_ids})
+
+    async def forward_batch(self, outgoing: list[tuple]):
+        """
+        push many events to their peers, one frame per peer
+        """
+        by_peer = defaultdict(list)
+        for thread, event in outgoing:
+            peer_id = thread.seller_id if thread.buyer_id == self.user.id else thread.buyer_id
+            by_peer[peer_id].append(event)
+        for peer_id, events in by_peer.items():
+            try:
+                await self.channel_layer.group_send(user_group_name(peer_id),
+                                                    {"type": "chat_batch", "messages": events})
+            except Exception:
+                logger.exception("send batch to peer group error")
 
 class CreateThreadView(APIView):
     permission_classes = [IsAuthenticated]
@@ -297,6 +458,10 @@ class LoadMessagesView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, thread_id):
+        """
+        load messages of a thread
+        without before/after/limit return the whole history, otherwise one page, see chatService.list_messages
+        """
         try:
             thread = ChatThread.objects.get(id=thread_id)
         except ChatThread.DoesNotExist:
@@ -311,71 +476,195 @@ class LoadMessagesView(APIView):
                 status=status.HTTP_403_FORBIDDEN,
             )
 
-        qs = thread.messages.select_related("sender").order_by("created_at")
-        data = [
-            {
-                "id": m.id,
-                "text": m.text,
-                "image_url": m.image_url,
-                "sender": m.sender.username,
-                "lat": m.lat,
-                "lng": m.lng,
-                "address": m.address,
-                "created_at": m.created_at.isoformat(),
-            }
-            for m in qs
-        ]
+        params = request.query_params
+        if not any(key in params for key in ("before", "after", "limit")):
+            qs = thread.messages.select_related("sender").order_by("created_at")
+            data = [chatService.message_to_dict(m) for m in qs]
+            return Response(data, status=status.HTTP_200_OK)
+
+        try:
+            limit = int(params.get("limit", DEFAULT_MESSAGE_PAGE_SIZE))
+        except ValueError:
+            return Response({"detail": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= limit <= MAX_MESSAGE_PAGE_SIZE:
+            return Response(
+                {"detail": f"limit must be between 1 and {MAX_MESSAGE_PAGE_SIZE}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if params.get("before") and params.get("after"):
+            return Response(
+                {"detail": "before and after are exclusive"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            data = chatService.list_messages(
+                thread, limit, before=params.get("before") or None, after=params.get("after") or None)
+        except ValueError:
+            return Response({"detail": "invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
         return Response(data, status=status.HTTP_200_OK)
     
 class LoadThreadsView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
+        """
+        list threads of the current user with the last message preview, most recent activity first
+        previews come from the thread summary, so this is one indexed query
+        """
         me = request.user
 
         threads = (
             ChatThread.objects
             .filter(Q(buyer=me) | Q(seller=me))
-            .order_by("-created_at")
+            .select_related("buyer", "seller")
+            .order_by("-last_message_at")
         )
 
         data = []
         for th in threads:
             peer = th.seller if th.buyer_id == me.id else th.buyer
-            last_msg = th.messages.order_by("-created_at").first()
-
-            if last_msg is None:
-                preview = ""
-                last_time = th.created_at.isoformat()
-
-            else:
-                if last_msg.image_url:
-                    preview = "[Image]"
-                elif last_msg.text not in (None, ""):
-                    preview = last_msg.text
-                elif getattr(last_msg, "lat", None) is not None and getattr(last_msg, "lng", None) is not None:
-                    preview = "[Location]"
-                else:
-                    preview = ""
-
-                last_time = last_msg.created_at.isoformat()
-
             data.append({
                 "id": str(th.id),
                 "peer_username": peer.username,
                 "peer_first_name": peer.first_name,
                 "peer_last_name": peer.last_name,
-                "last_message": preview,
-                "last_time": last_time,
+                "last_message": th.last_message_preview,
+                "last_time": th.last_message_at.isoformat(),
+                "unread": th.unread_for(me.id),
             })
 
         return Response(data, status=status.HTTP_200_OK)
 
+
+class UnreadCountView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        unread message counts of the current user, read from the thread summary
+        """
+        me = request.user
+        threads = (
+            ChatThread.objects
+            .filter(Q(buyer=me, buyer_unread__gt=0) | Q(seller=me, seller_unread__gt=0))
+            .values("id", "buyer_id", "buyer_unread", "seller_unread")
+        )
+        counts = {
+            str(th["id"]): th["buyer_unread"] if th["buyer_id"] == me.id else th["seller_unread"]
+            for th in threads
+        }
+        return Response({"total": sum(counts.values()), "threads": counts}, status=status.HTTP_200_OK)
+
+
+class MarkThreadReadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, thread_id):
+        """
+        reset the unread counter of the current user in a thread
+        """
+        me = request.user
+        updated = (
+            ChatThread.objects.filter(id=thread_id, buyer=me).update(buyer_unread=0)
+            + ChatThread.objects.filter(id=thread_id, seller=me).update(seller_unread=0)
+        )
+        if not updated:
+            return Response(
+                {"detail": "thread not found"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        return Response({"id": str(thread_id), "unread": 0}, status=status.HTTP_200_OK)
+
+class PresenceView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        online status of many users, `usernames` is a comma separated list
+        one query resolves the usernames, one cache round trip reads all presence keys
+        """
+        usernames = [name for name in request.query_params.get("usernames", "").split(",") if name]
+        if not usernames:
+            return Response({"detail": "usernames required"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(usernames) > MAX_PRESENCE_USERNAMES:
+            return Response(
+                {"detail": f"at most {MAX_PRESENCE_USERNAMES} usernames"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        users = dict(User.objects.filter(username__in=usernames).values_list("id", "username"))
+        last_seen = presence.get_presence(users)
+        data = {name: {"online": False, "last_seen": None} for name in usernames}
+        for user_id, username in users.items():
+            if last_seen[user_id] is not None:
+                data[username] = {"online": True, "last_seen": last_seen[user_id]}
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class SearchMessagesView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        full text search in the messages of the current user's threads, newest first
+        1. search the chat_message index with `q`, optionally within one `thread`
+        2. load the matched messages in one query, restricted to the user's threads again
+        3. return them with highlighted fragments and the cursor of the next page
+        """
+        params = request.query_params
+        keyword = params.get("q", "").strip()
+        if not keyword:
+            return Response({"detail": "q required"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            size = int(params.get("size", chatSearch.DEFAULT_SEARCH_SIZE))
+        except ValueError:
+            return Response({"detail": "size must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= size <= MAX_SEARCH_SIZE:
+            return Response(
+                {"detail": f"size must be between 1 and {MAX_SEARCH_SIZE}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        thread_id = params.get("thread") or None
+        if thread_id is not None:
+            try:
+                thread_id = UUID(thread_id)
+            except ValueError:
+                return Response({"detail": "invalid thread"}, status=status.HTTP_400_BAD_REQUEST)
+
+        me = request.user
+        try:
+            hits, next_cursor = chatSearch.search_messages(
+                me.id, keyword, thread_id=thread_id, size=size, cursor=params.get("cursor") or None)
+        except ValueError:
+            return Response({"detail": "invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception:
+            logger.exception("search chat messages error")
+            return Response({"detail": "search unavailable"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        messages = ChatMessage.objects.filter(
+            Q(thread__buyer=me) | Q(thread__seller=me), id__in=[message_id for message_id, _ in hits]
+        ).select_related("sender").in_bulk()
+        results = []
+        for message_id, highlight in hits:
+            m = messages.get(message_id)
+            if m is None:
+                continue
+            data = chatService.message_to_dict(m)
+            data["thread_id"] = str(m.thread_id)
+            data["highlight"] = highlight
+            results.append(data)
+        return Response({"results": results, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
+
+
 class UploadImageView(APIView):
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
 
     def post(self, request):
+        if imageService.request_too_large(request):
+            return Response({"detail": f"image larger than {imageService.MAX_IMAGE_BYTES} bytes"},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
         file_obj = request.FILES.get("image")
         if not file_obj:
             return Response({"detail": "image required"}, status=400)
@@ -383,13 +672,19 @@ class UploadImageView(APIView):
         if not file_obj.content_type.startswith("image/"):
             return Response({"detail": "only image files allowed"}, status=400)
 
+        # the file is named after the hash of its content, an image sent before is not stored again
         ext = os.path.splitext(file_obj.name)[1] or ".jpg"
-        filename = f"{uuid.uuid4().hex}{ext}"
 
-        path = default_storage.save(f"chat_images/{filename}", file_obj)
+        try:
+            path, _ = imageService.store_upload(file_obj, imageService.CHAT_IMAGE_DIR, ext)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
 
         url = default_storage.url(path)
 
         full_url = request.build_absolute_uri(url)
 
+        # thumbnails are generated in the background and attached to the messages using this image
+        chatService.submit_image_variants(path, full_url)
+
         return Response({"url": full_url}, status=201)
@@ -18,6 +18,7 @@ PRODUCT_INDEX = {
             "description": {"type": "text", "analyzer": "standard"},
             "price": {"type": "float"},
             "picture_url": {"type": "keyword"},
+            "picture_variants": {"type": "object", "enabled": False},
             "quantity": {"type": "integer"},
             "category": {"type": "keyword"},
             "seller_username": {"type": "keyword"},
@@ -26,6 +27,26 @@ PRODUCT_INDEX = {
 }
 
 
+CHAT_MESSAGE_INDEX = {
+    "settings": {
+        "number_of_shards": 1,
+        "number_of_replicas": 0,
+        "analysis": {"analyzer": {"standard": {"tokenizer": "standard"}}},
+    },
+    "mappings": {
+        "properties": {
+            "id": {"type": "long"},
+            "thread_id": {"type": "keyword"},
+            "sender_id": {"type": "integer"},
+            "participant_ids": {"type": "integer"},
+            "text": {"type": "text", "analyzer": "standard"},
+            "address": {"type": "text", "analyzer": "standard"},
+            "created_at": {"type": "date"},
+        }
+    },
+}
+
+
 def create_product_index():
     if not es.indices.exists(index="product"):
         es.indices.create(index="product", body=PRODUCT_INDEX)
@@ -34,6 +55,14 @@ def create_product_index():
         print(f"[INFO] product index already exists")
 
 
+def create_chat_message_index():
+    if not es.indices.exists(index="chat_message"):
+        es.indices.create(index="chat_message", body=CHAT_MESSAGE_INDEX)
+        print(f"[INFO] chat_message index created")
+    else:
+        print(f"[INFO] chat_message index already exists")
+
 
 if __name__ == "__main__":
-    create_product_index()
\ No newline at end of file
+    create_product_index()
+    create_chat_message_index()
\ No newline at end of file
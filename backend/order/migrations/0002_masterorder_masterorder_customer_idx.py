@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-17 21:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='masterorder',
+            index=models.Index(fields=['customer_username', 'created_at', 'order_number'], name='masterorder_customer_idx'),
+        ),
+    ]
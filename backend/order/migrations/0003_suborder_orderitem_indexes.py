@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-17 21:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0002_masterorder_masterorder_customer_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='orderitem',
+            name='master_order_number',
+            field=models.BigIntegerField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='sub_order_number',
+            field=models.CharField(db_index=True, max_length=23),
+        ),
+        migrations.AlterField(
+            model_name='suborder',
+            name='master_order_number',
+            field=models.BigIntegerField(db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='suborder',
+            index=models.Index(fields=['seller_username', 'master_order_number', 'sub_order_number'], name='suborder_seller_idx'),
+        ),
+    ]
@@ -1,5 +1,7 @@
 from django.db import models
 
+from order import orderDetailCache
+
 # Create your models here.
 
 
@@ -10,16 +12,30 @@ class MasterOrder(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # order history of a customer, newest first, keyset paginated
+            models.Index(fields=["customer_username", "created_at", "order_number"],
+                         name="masterorder_customer_idx"),
+        ]
+
 class SubOrder(models.Model):
-    master_order_number = models.BigIntegerField()
+    master_order_number = models.BigIntegerField(db_index=True)
     sub_order_number = models.CharField(primary_key=True, max_length=23)
     seller_username = models.CharField(max_length=20)
     total_amount = models.PositiveIntegerField(default=0, help_text="cents")
 
+    class Meta:
+        indexes = [
+            # seller order feed, master order numbers are snowflake ids so they sort by creation time
+            models.Index(fields=["seller_username", "master_order_number", "sub_order_number"],
+                         name="suborder_seller_idx"),
+        ]
+
 class OrderItem(models.Model):
-    master_order_number = models.BigIntegerField()
+    master_order_number = models.BigIntegerField(db_index=True)
     order_number = models.CharField(primary_key=True, max_length=23)
-    sub_order_number = models.CharField(max_length=23)
+    sub_order_number = models.CharField(max_length=23, db_index=True)
     product_id = models.CharField(max_length=50)
     quantity = models.PositiveIntegerField(default=0)
     unit_price = models.PositiveIntegerField(default=0, help_text="cents")
@@ -28,4 +44,5 @@ class OrderItem(models.Model):
 
     def save(self, *args, **kwargs):
         self.total_amount = self.quantity * self.unit_price
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+        orderDetailCache.invalidate_on_commit(self.master_order_number)
\ No newline at end of file
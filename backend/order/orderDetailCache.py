@@ -0,0 +1,53 @@
+import logging
+
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+ORDER_DETAIL_CACHE_TIMEOUT_SECONDS = 60 * 60
+
+
+def _cache_key(order_number) -> str:
+    return f"order_detail:{int(order_number)}"
+
+
+def get_order_detail(order_number) -> dict | None:
+    """
+    get serialized order detail, return none on miss
+    cache errors are treated as a miss so order details keep working without redis
+    """
+    try:
+        return cache.get(_cache_key(order_number))
+    except Exception:
+        logger.exception("read order detail cache error")
+        return None
+
+
+def set_order_detail(order_number, data: dict):
+    """
+    store serialized order detail
+    """
+    try:
+        cache.set(_cache_key(order_number), data, timeout=ORDER_DETAIL_CACHE_TIMEOUT_SECONDS)
+    except Exception:
+        logger.exception("write order detail cache error")
+
+
+def invalidate(order_number):
+    """
+    drop serialized order detail, called whenever an item of the order changes
+    """
+    try:
+        cache.delete(_cache_key(order_number))
+    except Exception:
+        logger.exception(f"invalidate order detail cache of {order_number} error")
+
+
+def invalidate_on_commit(order_number):
+    """
+    drop serialized order detail once the current transaction commits, a reader in between
+    would otherwise cache the details from before the change again
+    runs immediately outside a transaction
+    """
+    transaction.on_commit(lambda: invalidate(order_number))
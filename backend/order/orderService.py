@@ -1,6 +1,14 @@
+import base64
+import json
 import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterable
 
-from order.models import MasterOrder, OrderItem
+from django.db.models import Q
+
+from order import orderDetailCache
+from order.models import MasterOrder, OrderItem, SubOrder
 
 logger = logging.getLogger(__name__)
 
@@ -23,4 +31,127 @@ def get_order_items_by_master_order_id(order_number: str):
         order_items = OrderItem.objects.filter(master_order_number=int(order_number))
         return order_items
     except OrderItem.DoesNotExist:
-        return None
\ No newline at end of file
+        return None
+
+
+def update_order_items_status(order_item_numbers: Iterable[str], status: str) -> int:
+    """
+    update status of many order items in one query and invalidate the cached details
+    of the orders they belong to
+    return the number of updated items
+    """
+    order_item_numbers = list(order_item_numbers)
+    items = OrderItem.objects.filter(order_number__in=order_item_numbers)
+    master_order_numbers = set(items.values_list("master_order_number", flat=True))
+    updated = items.update(status=status)
+    for master_order_number in master_order_numbers:
+        orderDetailCache.invalidate_on_commit(master_order_number)
+    logger.info(f"{updated} order items updated to {status}")
+    return updated
+
+
+def encode_order_cursor(order: MasterOrder) -> str:
+    """
+    encode the keyset of an order into an opaque cursor string
+    """
+    raw = json.dumps({"created_at": order.created_at.isoformat(), "order_number": order.order_number})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_order_cursor(cursor: str) -> tuple[datetime, int]:
+    """
+    decode a cursor produced by encode_order_cursor, raise ValueError if the cursor is malformed
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(payload["created_at"]), int(payload["order_number"])
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+
+
+def list_orders_by_customer(customer_username: str, limit: int,
+                            cursor: str | None = None) -> tuple[list[MasterOrder], str | None]:
+    """
+    list orders of a customer, newest first, with keyset pagination on (created_at, order_number)
+    return the orders and the cursor of the next page, None if this is the last page
+    raise ValueError if the cursor is malformed
+    """
+    orders = MasterOrder.objects.filter(customer_username=customer_username)
+    if cursor:
+        created_at, order_number = decode_order_cursor(cursor)
+        orders = orders.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, order_number__lt=order_number)
+        )
+    page = list(orders.order_by("-created_at", "-order_number")[:limit + 1])
+    if len(page) > limit:
+        return page[:limit], encode_order_cursor(page[limit - 1])
+    return page, None
+
+
+def get_sub_orders_with_items(master_order_numbers: Iterable[int]) -> dict[int, list[SubOrder]]:
+    """
+    get sub orders of many master orders with their items in two queries
+    every sub order gets an order_items attribute, return a dict keyed by master order number
+    """
+    master_order_numbers = list(master_order_numbers)
+    items_by_sub_order = defaultdict(list)
+    for item in OrderItem.objects.filter(master_order_number__in=master_order_numbers).order_by("order_number"):
+        items_by_sub_order[item.sub_order_number].append(item)
+
+    sub_orders = defaultdict(list)
+    for sub_order in SubOrder.objects.filter(master_order_number__in=master_order_numbers).order_by("sub_order_number"):
+        sub_order.order_items = items_by_sub_order.get(sub_order.sub_order_number, [])
+        sub_orders[sub_order.master_order_number].append(sub_order)
+    return sub_orders
+
+
+def encode_sub_order_cursor(sub_order: SubOrder) -> str:
+    """
+    encode the keyset of a sub order into an opaque cursor string
+    """
+    raw = json.dumps({"master_order_number": sub_order.master_order_number,
+                      "sub_order_number": sub_order.sub_order_number})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_sub_order_cursor(cursor: str) -> tuple[int, str]:
+    """
+    decode a cursor produced by encode_sub_order_cursor, raise ValueError if the cursor is malformed
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return int(payload["master_order_number"]), str(payload["sub_order_number"])
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+
+
+def list_sub_orders_by_seller(seller_username: str, limit: int,
+                              cursor: str | None = None) -> tuple[list[SubOrder], str | None]:
+    """
+    list sub orders of a seller with their items, newest first, in two queries
+    pages are keyset paginated on the integer master order number, a snowflake id, with the sub order
+    number as tie-breaker, the "S-" prefixed sub order number alone does not sort numerically
+    every sub order gets an order_items attribute
+    return the sub orders and the cursor of the next page, None if this is the last page
+    raise ValueError if the cursor is malformed
+    """
+    sub_orders = SubOrder.objects.filter(seller_username=seller_username)
+    if cursor:
+        master_order_number, sub_order_number = decode_sub_order_cursor(cursor)
+        sub_orders = sub_orders.filter(
+            Q(master_order_number__lt=master_order_number)
+            | Q(master_order_number=master_order_number, sub_order_number__lt=sub_order_number)
+        )
+    page = list(sub_orders.order_by("-master_order_number", "-sub_order_number")[:limit + 1])
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_sub_order_cursor(page[-1])
+
+    items_by_sub_order = defaultdict(list)
+    sub_order_numbers = [sub_order.sub_order_number for sub_order in page]
+    for item in OrderItem.objects.filter(sub_order_number__in=sub_order_numbers).order_by("order_number"):
+        items_by_sub_order[item.sub_order_number].append(item)
+    for sub_order in page:
+        sub_order.order_items = items_by_sub_order.get(sub_order.sub_order_number, [])
+    return page, next_cursor
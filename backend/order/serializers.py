@@ -1,7 +1,7 @@
 from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 
-from order.models import MasterOrder, OrderItem
+from order.models import MasterOrder, OrderItem, SubOrder
 
 
 class OrderSerializer(serializers.ModelSerializer):
@@ -56,4 +56,65 @@ class OrderDetailSerializer(OrderSerializer):
         return OrderItemSerializer(items, many=True).data
 
     class Meta(OrderSerializer.Meta):
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+
+class SubOrderSerializer(serializers.ModelSerializer):
+    """
+    Serializer for sub order with its items
+    items are read from the order_items attribute set by orderService.get_sub_orders_with_items
+    """
+    items = serializers.SerializerMethodField()
+
+    @extend_schema_field(OrderItemSerializer(many=True))
+    def get_items(self, obj: SubOrder):
+        return OrderItemSerializer(getattr(obj, "order_items", []), many=True).data
+
+    class Meta:
+        model = SubOrder
+        fields = ['sub_order_number', 'seller_username', 'total_amount', 'items']
+
+
+class OrderWithSubOrdersSerializer(OrderSerializer):
+    """
+    Serializer for order in the order history when items are included
+    sub orders are read from the context, keyed by master order number
+    """
+    sub_orders = serializers.SerializerMethodField()
+
+    @extend_schema_field(SubOrderSerializer(many=True))
+    def get_sub_orders(self, obj: MasterOrder):
+        sub_orders = self.context.get('sub_orders', {}).get(obj.order_number, [])
+        return SubOrderSerializer(sub_orders, many=True).data
+
+    class Meta(OrderSerializer.Meta):
+        fields = '__all__'
+
+
+class OrderPageSerializer(serializers.Serializer):
+    """
+    Serializer for a cursor page of orders, used for the schema only
+    sub_orders are only returned with include_items, next_cursor is null when there are no more pages
+    """
+    results = OrderWithSubOrdersSerializer(many=True)
+    next_cursor = serializers.CharField(allow_null=True)
+
+
+class SellerSubOrderSerializer(SubOrderSerializer):
+    """
+    Serializer for sub order in the seller order feed
+    master order number is converted to string to maintain length
+    """
+    master_order_number = serializers.CharField(read_only=True)
+
+    class Meta(SubOrderSerializer.Meta):
+        fields = ['master_order_number', *SubOrderSerializer.Meta.fields]
+
+
+class SellerSubOrderPageSerializer(serializers.Serializer):
+    """
+    Serializer for a cursor page of the seller order feed
+    next_cursor is null when there are no more pages
+    """
+    results = SellerSubOrderSerializer(many=True)
+    next_cursor = serializers.CharField(allow_null=True)
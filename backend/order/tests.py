@@ -3,13 +3,24 @@ from unittest.mock import patch
 from django.test import TestCase
 from rest_framework.test import APIClient
 
+from order import orderDetailCache
+from order.models import MasterOrder, SubOrder, OrderItem
+from user.models import User
+
+
 class OrderAPITest(TestCase):
     def setUp(self):
         self.client = APIClient()
+        self.user = User.objects.create_user(
+            email="bob@example.com",
+            username="bob",
+            password="Passw0rd!",
+        )
+        self.client.force_authenticate(user=self.user)
 
-    @patch("order.views.orderCreateView.productService.add_or_update_product")
-    @patch("order.views.orderCreateView.productService.get_product_by_id")
-    def test_order_create_and_get(self, mock_get_product, mock_add_or_update):
+    @patch("order.views.orderView.stockService.reserve_stock")
+    @patch("order.views.orderView.productService.get_products_by_ids")
+    def test_order_create_and_get(self, mock_get_products, mock_reserve):
         
         product_obj = Product(
             id="book_123",
@@ -21,8 +32,8 @@ class OrderAPITest(TestCase):
             seller_username="alice",
             quantity=1
         )
-        mock_get_product.return_value = product_obj
-        mock_add_or_update.return_value = None  
+        mock_get_products.return_value = {"book_123": product_obj}
+        mock_reserve.return_value = {}
         payload = {
             "customer_username": "alice",
             "items": [
@@ -33,9 +44,202 @@ class OrderAPITest(TestCase):
         self.assertIn(res.status_code, (200, 201), res.content)
         order_no = res.json()["order_number"]
 
+        mock_reserve.assert_called_once_with({"book_123": 1})
+
         res2 = self.client.get(f"/api/order/{order_no}/")
         self.assertEqual(res2.status_code, 200, res2.content)
 
+    @patch("order.views.orderView.productService.get_products_by_ids")
+    def test_order_create_reports_all_missing_products(self, mock_get_products):
+        mock_get_products.return_value = {}
+        payload = {
+            "items": [
+                {"product_id": "book_1", "quantity": 1},
+                {"product_id": "book_2", "quantity": 1},
+            ]
+        }
+        res = self.client.post("/api/order/", payload, format="json")
+        self.assertEqual(res.status_code, 400, res.content)
+        self.assertEqual(res.json()["missing"], ["book_1", "book_2"])
+        self.assertEqual(mock_get_products.call_count, 1)
+
+    @patch("order.views.orderView.stockService.reserve_stock")
+    @patch("order.views.orderView.productService.get_products_by_ids")
+    def test_order_create_fails_when_reservation_fails(self, mock_get_products, mock_reserve):
+        mock_get_products.return_value = {"book_1": Product(
+            id="book_1", title="t", description="d", price=10.0, picture_url="",
+            category="books", seller_username="alice", quantity=1,
+        )}
+        mock_reserve.return_value = {"book_1": "insufficient"}
+        res = self.client.post("/api/order/", {"items": [{"product_id": "book_1", "quantity": 1}]}, format="json")
+        self.assertEqual(res.status_code, 400, res.content)
+        self.assertEqual(res.json()["insufficient"], ["book_1"])
+        self.assertFalse(MasterOrder.objects.exists())
+
+    @patch("order.views.orderView.stockService.reserve_stock")
+    @patch("order.views.orderView.productService.get_products_by_ids")
+    def test_order_create_inserts_each_table_once(self, mock_get_products, mock_reserve):
+        products = {
+            f"book_{i}": Product(
+                id=f"book_{i}", title="t", description="d", price=10.0, picture_url="",
+                category="books", seller_username=f"seller_{i % 5}", quantity=3,
+            ) for i in range(20)
+        }
+        mock_get_products.return_value = products
+        mock_reserve.return_value = {}
+        payload = {"items": [{"product_id": pid, "quantity": 1} for pid in products]}
+
+        # savepoint + 3 inserts + release savepoint, independent of cart size and seller count
+        with self.assertNumQueries(5):
+            res = self.client.post("/api/order/", payload, format="json")
+        self.assertEqual(res.status_code, 201, res.content)
+        order_no = int(res.json()["order_number"])
+        self.assertEqual(SubOrder.objects.filter(master_order_number=order_no).count(), 5)
+        self.assertEqual(OrderItem.objects.filter(master_order_number=order_no).count(), 20)
+
     def test_order_not_found(self):
         res = self.client.get("/api/order/999999999999/")
-        self.assertEqual(res.status_code, 404, res.content)
\ No newline at end of file
+        self.assertEqual(res.status_code, 404, res.content)
+
+
+class OrderHistoryTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            email="bob@example.com",
+            username="bob",
+            password="Passw0rd!",
+        )
+        self.client.force_authenticate(user=self.user)
+        for n in range(1, 6):
+            MasterOrder.objects.create(order_number=n, customer_username="bob", total_amount=n)
+            SubOrder.objects.create(master_order_number=n, sub_order_number=f"S-{n}",
+                                    seller_username="alice", total_amount=n)
+            OrderItem.objects.create(master_order_number=n, order_number=f"I-{n}", sub_order_number=f"S-{n}",
+                                     product_id="book", quantity=1, unit_price=n)
+        MasterOrder.objects.create(order_number=99, customer_username="carol", total_amount=1)
+        # same created_at for two orders, order_number breaks the tie
+        MasterOrder.objects.filter(order_number__in=[2, 3]).update(
+            created_at=MasterOrder.objects.get(order_number=2).created_at)
+
+    def test_keyset_pagination_walks_all_orders_once(self):
+        seen = []
+        cursor = None
+        while True:
+            url = "/api/order/?limit=2" + (f"&cursor={cursor}" if cursor else "")
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, 200, res.content)
+            body = res.json()
+            seen.extend(int(o["order_number"]) for o in body["results"])
+            cursor = body["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(sorted(seen), [1, 2, 3, 4, 5])
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_default_page(self):
+        with patch("order.views.orderView.DEFAULT_PAGE_SIZE", 3):
+            res = self.client.get("/api/order/")
+        self.assertEqual(res.status_code, 200, res.content)
+        body = res.json()
+        self.assertEqual([int(o["order_number"]) for o in body["results"]], [5, 4, 3])
+        self.assertIsNotNone(body["next_cursor"])
+
+    def test_include_items_uses_constant_queries(self):
+        with self.assertNumQueries(3):
+            res = self.client.get("/api/order/?limit=5&include_items=true")
+        self.assertEqual(res.status_code, 200, res.content)
+        results = res.json()["results"]
+        self.assertEqual(len(results), 5)
+        for order in results:
+            self.assertEqual(len(order["sub_orders"]), 1)
+            self.assertEqual(len(order["sub_orders"][0]["items"]), 1)
+
+    def test_invalid_cursor_returns_400(self):
+        res = self.client.get("/api/order/?cursor=bogus")
+        self.assertEqual(res.status_code, 400, res.content)
+
+
+class SellerOrderFeedTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            email="alice@example.com",
+            username="alice",
+            password="Passw0rd!",
+        )
+        self.client.force_authenticate(user=self.user)
+        # numbers of different lengths, "S-8" sorts after "S-10" as a string
+        for n in range(4, 24):
+            seller = "alice" if n % 2 == 0 else "carol"
+            SubOrder.objects.create(master_order_number=n, sub_order_number=f"S-{n}",
+                                    seller_username=seller, total_amount=n)
+            for i in range(3):
+                OrderItem.objects.create(master_order_number=n, order_number=f"I-{n}-{i}",
+                                         sub_order_number=f"S-{n}", product_id="book", quantity=1, unit_price=n)
+
+    def test_feed_is_paginated_with_constant_queries(self):
+        seen = []
+        cursor = None
+        while True:
+            url = "/api/order/seller/?limit=4" + (f"&cursor={cursor}" if cursor else "")
+            # one query for the sub orders and one for their items, regardless of page size
+            with self.assertNumQueries(2):
+                res = self.client.get(url)
+            self.assertEqual(res.status_code, 200, res.content)
+            body = res.json()
+            for sub_order in body["results"]:
+                self.assertEqual(sub_order["seller_username"], "alice")
+                self.assertEqual(len(sub_order["items"]), 3)
+                seen.append(sub_order["sub_order_number"])
+            cursor = body["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(seen, [f"S-{n}" for n in range(22, 3, -2)])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get("/api/order/seller/?cursor=S-10").status_code, 400)
+
+
+class OrderDetailCacheTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            email="bob@example.com",
+            username="bob",
+            password="Passw0rd!",
+        )
+        self.client.force_authenticate(user=self.user)
+        MasterOrder.objects.create(order_number=42, customer_username="bob", total_amount=10)
+        OrderItem.objects.create(master_order_number=42, order_number="I-42", sub_order_number="S-42",
+                                 product_id="book", quantity=1, unit_price=10)
+
+    def test_details_cached_until_item_status_changes(self):
+        from order import orderService
+
+        with self.assertNumQueries(2):
+            first = self.client.get("/api/order/42/")
+        self.assertEqual(first.status_code, 200, first.content)
+        with self.assertNumQueries(0):
+            second = self.client.get("/api/order/42/")
+        self.assertEqual(second.json(), first.json())
+
+        # the cache is only invalidated when the transaction commits
+        with self.captureOnCommitCallbacks() as callbacks:
+            orderService.update_order_items_status(["I-42"], "completed")
+            self.assertIsNotNone(orderDetailCache.get_order_detail(42))
+        for callback in callbacks:
+            callback()
+        res = self.client.get("/api/order/42/")
+        self.assertEqual(res.json()["items"][0]["status"], "completed")
+
+        item = OrderItem.objects.get(order_number="I-42")
+        item.status = "cancelled"
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        res = self.client.get("/api/order/42/")
+        self.assertEqual(res.json()["items"][0]["status"], "cancelled")
+
+    def test_non_numeric_order_number_returns_404(self):
+        res = self.client.get("/api/order/abc/")
+        self.assertEqual(res.status_code, 404, res.content)
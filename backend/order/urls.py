@@ -18,9 +18,11 @@ from django.urls import path
 
 from order.views.orderView import OrderView
 from order.views.orderDetailsView import OrderDetailsView
+from order.views.sellerOrderView import SellerOrderView
 
 urlpatterns = [
     path("", OrderView.as_view()),
+    path("seller/", SellerOrderView.as_view()),
     path("<str:order_number>/", OrderDetailsView.as_view()),
 ]
 
@@ -1,12 +1,15 @@
+import json
+
 from drf_spectacular.utils import extend_schema, OpenApiResponse
 from rest_framework import status
 from rest_framework.exceptions import NotFound
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from order import orderService
+from order import orderDetailCache, orderService
 from order.orderService import *
 from order.serializers import OrderDetailSerializer
 
@@ -26,16 +29,26 @@ class OrderDetailsView(APIView):
         },
     )
     def get(self, request: Request, order_number: str) -> Response:
-        data = request.data
-        logger.info(data)
+        """
+        get order details, served from the order detail cache when possible
+        the cache is invalidated whenever an item of the order changes
+        """
+        if not order_number.isdigit():
+            raise NotFound()
+        cached = orderDetailCache.get_order_detail(order_number)
+        if cached is not None:
+            return Response(cached, status=status.HTTP_200_OK)
+
         order: MasterOrder = orderService.get_order_by_id(order_number)
-        order_items = orderService.get_order_items_by_master_order_id(order_number)
-        logger.info(f'query result:{order_items}')
         if order:
+            order_items = orderService.get_order_items_by_master_order_id(order_number)
             logger.info(f"Order: {order.order_number}")
             serializer = OrderDetailSerializer(order, context={
                 'items': order_items
             })
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            # render to plain json types, serializer data keeps a reference to the serializer
+            data = json.loads(JSONRenderer().render(serializer.data))
+            orderDetailCache.set_order_detail(order_number, data)
+            return Response(data, status=status.HTTP_200_OK)
         else:
             raise NotFound()
@@ -2,7 +2,8 @@ import logging
 from collections import defaultdict
 
 from django.db import transaction
-from drf_spectacular.utils import extend_schema, OpenApiResponse
+from drf_spectacular.utils import extend_schema, OpenApiResponse, OpenApiParameter
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.request import Request
 from rest_framework.response import Response
@@ -10,14 +11,19 @@ from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_201_CREATED, HTTP_2
 from rest_framework.views import APIView
 from snowflake import SnowflakeGenerator
 
+from order import orderService
 from order.models import MasterOrder, SubOrder, OrderItem
-from order.serializers import OrderSerializer, OrderCreateRequestSerializer
-from product import productService
+from order.serializers import OrderSerializer, OrderCreateRequestSerializer, OrderPageSerializer, \
+    OrderWithSubOrdersSerializer
+from product import productService, stockService
 from product.product import Product
 
 logger = logging.getLogger(__name__)
 generator = SnowflakeGenerator(1)
 
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
 class OrderView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -30,45 +36,69 @@ class OrderView(APIView):
             401: OpenApiResponse(description='user not authenticated')
         },
     )
-
-    @transaction.atomic
     def post(self, request: Request) -> Response:
         ser = OrderCreateRequestSerializer(data=request.data)
         ser.is_valid(raise_exception=True)
         items = ser.validated_data['items']
         customer_username = request.user.username
+
+        # resolve the whole cart in one round trip
+        products: dict[str, Product] = productService.get_products_by_ids(row["product_id"] for row in items)
+        missing = [row["product_id"] for row in items if row["product_id"] not in products]
+        if missing:
+            return Response({"error": f"product {', '.join(missing)} not found", "missing": missing},
+                            status=HTTP_400_BAD_REQUEST)
+        requested = defaultdict(int)
+        for row in items:
+            requested[row["product_id"]] += row["quantity"]
+        insufficient = [pid for pid, qty in requested.items() if products[pid].quantity < qty]
+        if insufficient:
+            return Response({"error": f"product {', '.join(insufficient)} stock insufficient",
+                             "insufficient": insufficient},
+                            status=HTTP_400_BAD_REQUEST)
+
+        # reserve stock atomically in elasticsearch, nothing is written if any product fails
+        failures = stockService.reserve_stock(dict(requested))
+        if failures:
+            return Response({"error": f"product {', '.join(failures)} stock insufficient",
+                             "insufficient": list(failures)},
+                            status=HTTP_400_BAD_REQUEST)
+        try:
+            master_order = self._create_order(items, products, customer_username)
+        except Exception:
+            stockService.release_stock(dict(requested))
+            raise
+        return Response(OrderSerializer(master_order).data, status=HTTP_201_CREATED)
+
+    @staticmethod
+    @transaction.atomic
+    def _create_order(items: list[dict], products: dict[str, Product], customer_username: str) -> MasterOrder:
+        """
+        persist master order, sub orders grouped by seller and order items
+        all rows are built in memory first so the transaction only holds the three inserts
+        """
         seller_groups = defaultdict(list)
         total_amount = 0
 
         # group products by sellers
         for row in items:
-            product: Product|None = productService.get_product_by_id(product_id=row["product_id"])
-            if product is None:
-                return Response({"error": f"product {row['product_id']} not found"}, status=HTTP_400_BAD_REQUEST)
-            if product.quantity < row["quantity"]:
-                return Response({"error": f"product {row['product_id']} stock insufficient"}, status=HTTP_400_BAD_REQUEST)
+            product = products[row["product_id"]]
             subtotal = row["quantity"] * product.price
             seller_groups[product.seller_username].append((product, row["quantity"], subtotal))
             total_amount += subtotal
 
         master_order_number = next(generator)
-        master_order = MasterOrder.objects.create(
-            order_number=master_order_number,
-            customer_username=customer_username,
-            total_amount=total_amount,
-        )
-
+        sub_orders = []
+        order_items = []
         for seller_username, rows in seller_groups.items():
             sub_order_number = f"S-{next(generator)}"
-            sub_total = sum(r[2] for r in rows)
-            SubOrder.objects.create(
+            sub_orders.append(SubOrder(
                 master_order_number=master_order_number,
                 sub_order_number=sub_order_number,
                 seller_username=seller_username,
-                total_amount=sub_total,
-            )
-
-            OrderItem.objects.bulk_create([
+                total_amount=sum(r[2] for r in rows),
+            ))
+            order_items.extend(
                 OrderItem(
                     order_number=f"I-{next(generator)}",
                     master_order_number=master_order_number,
@@ -79,24 +109,57 @@ class OrderView(APIView):
                     total_amount=r[2],
                     status="placed"
                 ) for r in rows
-            ])
+            )
 
-            for product, qty, _ in rows:
-                product.quantity -= qty
-                productService.add_or_update_product(product)
-        return Response(OrderSerializer(master_order).data, status=HTTP_201_CREATED)
+        # one insert per table no matter how many sellers are in the cart
+        master_order = MasterOrder.objects.create(
+            order_number=master_order_number,
+            customer_username=customer_username,
+            total_amount=total_amount,
+        )
+        SubOrder.objects.bulk_create(sub_orders)
+        OrderItem.objects.bulk_create(order_items)
+        return master_order
 
     @extend_schema(
         summary='list orders of an user',
+        parameters=[
+            OpenApiParameter(name='cursor', type=str, location=OpenApiParameter.QUERY, required=False,
+                             description='next_cursor returned by the previous page'),
+            OpenApiParameter(name='limit', type=int, location=OpenApiParameter.QUERY, required=False,
+                             description=f'page size, {DEFAULT_PAGE_SIZE} by default, at most {MAX_PAGE_SIZE}'),
+            OpenApiParameter(name='include_items', type=bool, location=OpenApiParameter.QUERY, required=False,
+                             description='include sub orders and their items in a cursor page'),
+        ],
         responses={
+            200: OrderPageSerializer,
+            400: OpenApiResponse(description='invalid cursor or limit'),
             401: OpenApiResponse(description='user not authenticated')
         },
     )
     def get(self, request: Request) -> Response:
+        """
+        list orders of the current user, newest first
+        return one page keyset paginated by (created_at, order_number), DEFAULT_PAGE_SIZE orders unless
+        limit is given, with include_items the sub orders and items of the page are loaded in two extra queries
+        """
         username = request.user.username
-        orders = MasterOrder.objects.filter(customer_username=username)
-        return Response(OrderSerializer(orders, many=True).data, status=HTTP_200_OK)
-
-
-
-
+        params = request.query_params
+        try:
+            limit = int(params.get("limit", DEFAULT_PAGE_SIZE))
+        except ValueError:
+            raise ValidationError(detail="limit must be an integer")
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValidationError(detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        try:
+            orders, next_cursor = orderService.list_orders_by_customer(
+                username, limit, cursor=params.get("cursor") or None)
+        except ValueError:
+            raise ValidationError(detail="invalid cursor")
+
+        if params.get("include_items", "").lower() in ("1", "true"):
+            sub_orders = orderService.get_sub_orders_with_items(o.order_number for o in orders)
+            results = OrderWithSubOrdersSerializer(orders, many=True, context={'sub_orders': sub_orders}).data
+        else:
+            results = OrderSerializer(orders, many=True).data
+        return Response({"results": results, "next_cursor": next_cursor}, status=HTTP_200_OK)
@@ -0,0 +1,57 @@
+import logging
+
+from drf_spectacular.utils import extend_schema, OpenApiResponse, OpenApiParameter
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.status import HTTP_200_OK
+from rest_framework.views import APIView
+
+from order import orderService
+from order.serializers import SellerSubOrderSerializer, SellerSubOrderPageSerializer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class SellerOrderView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        summary='list sub orders sold by the current user',
+        parameters=[
+            OpenApiParameter(name='cursor', type=str, location=OpenApiParameter.QUERY, required=False,
+                             description='next_cursor returned by the previous page'),
+            OpenApiParameter(name='limit', type=int, location=OpenApiParameter.QUERY, required=False,
+                             description=f'page size, at most {MAX_PAGE_SIZE}'),
+        ],
+        responses={
+            200: SellerSubOrderPageSerializer,
+            400: OpenApiResponse(description='invalid cursor or limit'),
+            401: OpenApiResponse(description='user not authenticated')
+        },
+    )
+    def get(self, request: Request) -> Response:
+        """
+        list sub orders of the current seller with their items, newest first
+        """
+        params = request.query_params
+        try:
+            limit = int(params.get("limit", DEFAULT_PAGE_SIZE))
+        except ValueError:
+            raise ValidationError(detail="limit must be an integer")
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValidationError(detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+        try:
+            sub_orders, next_cursor = orderService.list_sub_orders_by_seller(
+                request.user.username, limit, cursor=params.get("cursor") or None)
+        except ValueError:
+            raise ValidationError(detail="invalid cursor")
+        return Response({
+            "results": SellerSubOrderSerializer(sub_orders, many=True).data,
+            "next_cursor": next_cursor,
+        }, status=HTTP_200_OK)
@@ -0,0 +1,40 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.globalvars import init_es_client
+from product import productImport
+
+
+class Command(BaseCommand):
+    help = "bulk import products from an ndjson or csv file into elasticsearch"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="path of the ndjson or csv file")
+        parser.add_argument("--format", choices=productImport.SUPPORTED_FORMATS,
+                            help="file format, guessed from the extension if omitted")
+        parser.add_argument("--chunk-size", type=int, default=500, help="documents per bulk request")
+        parser.add_argument("--workers", type=int, default=1, help="parallel bulk threads")
+        parser.add_argument("--seller", help="override seller_username of every row")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or productImport.guess_format(path)
+        if fmt is None:
+            raise CommandError("cannot guess file format, use --format")
+        if options["chunk_size"] < 1 or options["workers"] < 1:
+            raise CommandError("--chunk-size and --workers must be positive")
+
+        init_es_client()
+        with open(path, encoding="utf-8", newline="") as file:
+            result = productImport.import_products(
+                file, fmt,
+                seller_username=options["seller"],
+                chunk_size=options["chunk_size"],
+                workers=options["workers"],
+            )
+
+        for failure in result["failures"]:
+            self.stderr.write(json.dumps(failure))
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['indexed']} products imported, {len(result['failures'])} failed"))
@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 @dataclass
 class Product:
@@ -10,3 +10,5 @@ class Product:
     category: str
     seller_username: str
     quantity: int
+    # downscaled copies of the picture by width and format, filled in after upload
+    picture_variants: dict = field(default_factory=dict)
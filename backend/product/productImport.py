@@ -0,0 +1,106 @@
+import csv
+import json
+import logging
+import uuid
+from dataclasses import MISSING, fields
+from typing import Iterable, Iterator
+
+from product import productService
+from product.product import Product
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_FORMATS = ("ndjson", "csv")
+
+
+def guess_format(filename: str) -> str | None:
+    """
+    guess import format from file extension, return none if unsupported
+    """
+    ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    if ext in ("ndjson", "jsonl"):
+        return "ndjson"
+    if ext == "csv":
+        return "csv"
+    return None
+
+
+def iter_rows(lines: Iterable[str], fmt: str) -> Iterator[tuple[int, dict | None, str | None]]:
+    """
+    parse lines lazily into (line number, row, error), row is none if the line cannot be parsed
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, None, f"invalid json: {e.msg}"
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, "each line must be a json object"
+            continue
+        yield line_number, row, None
+
+
+def row_to_product(row: dict, seller_username: str | None = None) -> Product:
+    """
+    validate a row against the Product dataclass and convert field types,
+    id is generated and picture_url defaults to empty if missing
+    if seller_username is given, it overrides the one in the row
+    raise ValueError if a field is missing or has a wrong type
+    """
+    row = dict(row)
+    if not row.get("id"):
+        row["id"] = uuid.uuid4().hex
+    row.setdefault("picture_url", "")
+    if seller_username is not None:
+        row["seller_username"] = seller_username
+
+    values = {}
+    for field in fields(Product):
+        value = row.get(field.name)
+        if value is None and field.default_factory is not MISSING:
+            # generated fields such as picture_variants are not imported
+            continue
+        if value is None or (value == "" and field.name != "picture_url"):
+            raise ValueError(f"{field.name} is required")
+        try:
+            values[field.name] = field.type(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{field.name} must be {field.type.__name__}")
+    if values["price"] < 0:
+        raise ValueError("price must not be negative")
+    if values["quantity"] < 0:
+        raise ValueError("quantity must not be negative")
+    return Product(**values)
+
+
+def import_products(lines: Iterable[str], fmt: str, seller_username: str | None = None,
+                    chunk_size: int = 500, workers: int = 1, create_only: bool = False) -> dict:
+    """
+    import products from ndjson or csv lines through the bulk helper
+    rows failing validation are reported with their line number, rows failing in
+    elasticsearch are reported with their id
+    """
+    invalid = []
+
+    def valid_products():
+        for line_number, row, error in iter_rows(lines, fmt):
+            if row is not None:
+                try:
+                    yield row_to_product(row, seller_username)
+                    continue
+                except ValueError as e:
+                    error = str(e)
+            invalid.append({"line": line_number, "error": error})
+
+    result = productService.bulk_add_or_update_products(
+        valid_products(), chunk_size=chunk_size, workers=workers, create_only=create_only)
+    logger.info(f"import finished, {result['indexed']} indexed, {len(invalid)} invalid rows")
+    return {"indexed": result["indexed"], "failures": invalid + result["failures"]}
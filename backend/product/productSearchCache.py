@@ -0,0 +1,103 @@
+import hashlib
+import logging
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_TIMEOUT_SECONDS = 60
+GENERATION_KEY = "product_search:generation"
+HITS_KEY = "product_search:hits"
+MISSES_KEY = "product_search:misses"
+
+
+def normalize_keyword(keyword: str) -> str:
+    """
+    normalize keyword so that "  Textbook " and "textbook" share one cache entry
+    """
+    return " ".join(keyword.lower().split())
+
+
+def _incr(key: str) -> int:
+    cache.add(key, 0, timeout=None)
+    return cache.incr(key)
+
+
+def _generation() -> int:
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 0, timeout=None)
+        generation = cache.get(GENERATION_KEY, 0)
+    return generation
+
+
+def _cache_key(generation: int, keyword: str, sort_field: str, sort_order: str) -> str:
+    digest = hashlib.sha1(keyword.encode("utf-8")).hexdigest()
+    return f"product_search:{generation}:{digest}:{sort_field}:{sort_order}"
+
+
+def current_generation() -> int | None:
+    """
+    generation to read and write a search under, read it before querying elasticsearch so a result
+    computed while the cache is invalidated is stored under the old generation and never served
+    return none if the cache is unavailable, the search is then not cached
+    """
+    try:
+        return _generation()
+    except Exception:
+        logger.exception("read product search cache generation error")
+        return None
+
+
+def get_search_result(generation: int | None, keyword: str, sort_field: str, sort_order: str) -> list[dict] | None:
+    """
+    get cached search result of a generation, return none on miss
+    cache errors are treated as a miss so search keeps working without redis
+    """
+    if generation is None:
+        return None
+    try:
+        key = _cache_key(generation, keyword, sort_field, sort_order)
+        result = cache.get(key)
+        _incr(HITS_KEY if result is not None else MISSES_KEY)
+        return result
+    except Exception:
+        logger.exception("read product search cache error")
+        return None
+
+
+def set_search_result(generation: int | None, keyword: str, sort_field: str, sort_order: str,
+                      products: list[dict]):
+    """
+    store search result under the generation read before the search was executed
+    """
+    if generation is None:
+        return
+    try:
+        key = _cache_key(generation, keyword, sort_field, sort_order)
+        cache.set(key, products, timeout=SEARCH_CACHE_TIMEOUT_SECONDS)
+    except Exception:
+        logger.exception("write product search cache error")
+
+
+def invalidate():
+    """
+    invalidate every cached search result by bumping the generation counter,
+    entries of older generations are never read again and expire by timeout
+    """
+    try:
+        generation = _incr(GENERATION_KEY)
+        logger.info(f"product search cache generation bumped to {generation}")
+    except Exception:
+        logger.exception("invalidate product search cache error")
+
+
+def get_stats() -> dict:
+    """
+    get hit and miss counters of the search cache
+    """
+    return {
+        "hits": cache.get(HITS_KEY, 0),
+        "misses": cache.get(MISSES_KEY, 0),
+        "generation": cache.get(GENERATION_KEY, 0),
+    }
@@ -1,17 +1,36 @@
+import base64
 import json
 import logging
 
 from dataclasses import asdict
+from typing import Iterable
+
 from elasticsearch import Elasticsearch, NotFoundError
+from elasticsearch.helpers import parallel_bulk, streaming_bulk
 from backend.globalvars import get_es_client
+from product import productSearchCache
 from product.product import Product
 
 logger = logging.getLogger(__name__)
 
 
-def list_products_by_keyword(keyword: str, sort_field: str = "price", sort_order: str = "desc") -> list[dict]:
+DEFAULT_PAGE_SIZE = 20
+PIT_KEEP_ALIVE = "1m"
+
+# variants are generated in the background, the picture may have been replaced meanwhile, the
+# variants of the old picture must not overwrite the new picture's
+SET_PICTURE_VARIANTS_SCRIPT = """
+if (ctx._source.picture_url == params.picture_url) {
+    ctx._source.picture_variants = params.variants;
+} else {
+    ctx.op = 'noop';
+}
+"""
+
+
+def _build_keyword_query(keyword: str) -> dict:
     """
-    list products by keyword, if search for all, return all products with quantity>0,
+    build the search query for a keyword, if search for all, match all products with quantity>0,
     otherwise try to match title, category, description in order
     """
     if keyword != "all":
@@ -25,7 +44,7 @@ def list_products_by_keyword(keyword: str, sort_field: str = "price", sort_order
         }
     else:
         query_part = {"match_all": {}}
-    query = {
+    return {
         "bool": {
             "must": [query_part],
             "filter": [
@@ -34,39 +53,149 @@ def list_products_by_keyword(keyword: str, sort_field: str = "price", sort_order
         }
     }
 
+
+def _hits_to_products(es_result) -> list[dict]:
+    hits = es_result.get("hits", {}).get("hits", [])
+    products = []
+    for hit in hits:
+        item = hit["_source"]
+        item["id"] = hit["_id"]
+        products.append(item)
+    return products
+
+
+def encode_cursor(pit_id: str, search_after: list) -> str:
+    """
+    encode point-in-time id and search_after values into an opaque cursor string
+    """
+    raw = json.dumps({"pit": pit_id, "after": search_after}).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple[str, list]:
+    """
+    decode a cursor produced by encode_cursor, raise ValueError if the cursor is malformed
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        pit_id = payload["pit"]
+        search_after = payload["after"]
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(pit_id, str) or not isinstance(search_after, list):
+        raise ValueError("invalid cursor")
+    return pit_id, search_after
+
+
+def list_products_by_keyword(keyword: str, sort_field: str = "price", sort_order: str = "desc") -> list[dict]:
+    """
+    list the first page of products by keyword, see _build_keyword_query for matching rules
+    results are served from the search cache when possible
+    """
+    keyword = productSearchCache.normalize_keyword(keyword)
+    generation = productSearchCache.current_generation()
+    cached = productSearchCache.get_search_result(generation, keyword, sort_field, sort_order)
+    if cached is not None:
+        logger.info("keyword=%s, served from cache, returned=%s", keyword, len(cached))
+        return cached
+
+    query = _build_keyword_query(keyword)
+
     es: Elasticsearch = get_es_client()
 
     try:
-        es_result = es.search(index="product", size=20, query=query, sort=[{sort_field: {"order": sort_order}}])
+        es_result = es.search(index="product", size=DEFAULT_PAGE_SIZE, query=query,
+                              sort=[{sort_field: {"order": sort_order}}])
     except NotFoundError:
         return []
     logger.info("executed query")
     logger.info(query)
     logger.info("got result")
     logger.info(es_result)
-    hits = es_result.get("hits", {}).get("hits", [])
-    products = []
-    for hit in hits:
-        item = hit["_source"]
-        item["id"] = hit["_id"]
-        products.append(item)
+    products = _hits_to_products(es_result)
     logger.info("keyword=%s, total=%s, returned=%s", keyword,
                 es_result["hits"]["total"]["value"], len(products))
+    productSearchCache.set_search_result(generation, keyword, sort_field, sort_order, products)
     return products
 
 
+def search_products_page(keyword: str, sort_field: str = "price", sort_order: str = "desc",
+                         size: int = DEFAULT_PAGE_SIZE, cursor: str | None = None) -> tuple[list[dict], str | None]:
+    """
+    list one page of products by keyword with search_after on a point-in-time
+    1. open a point in time on the first page, or reuse the one carried by the cursor
+    2. sort by the requested field with id as tie-breaker so the cursor stays stable
+    3. return the products and the cursor of the next page, None if this is the last page
+    raise ValueError if the cursor is malformed
+    """
+    es: Elasticsearch = get_es_client()
+    query = _build_keyword_query(keyword)
+    sort = [{sort_field: {"order": sort_order}}, {"id": {"order": "asc"}}]
+
+    try:
+        if cursor:
+            pit_id, search_after = decode_cursor(cursor)
+        else:
+            pit_id = es.open_point_in_time(index="product", keep_alive=PIT_KEEP_ALIVE)["id"]
+            search_after = None
+        es_result = es.search(size=size, query=query, sort=sort,
+                              pit={"id": pit_id, "keep_alive": PIT_KEEP_ALIVE},
+                              search_after=search_after, track_total_hits=False)
+    except NotFoundError:
+        # index missing or point in time expired
+        return [], None
+
+    pit_id = es_result.get("pit_id", pit_id)
+    hits = es_result.get("hits", {}).get("hits", [])
+    products = _hits_to_products(es_result)
+    logger.info("keyword=%s, page size=%s, returned=%s", keyword, size, len(products))
+
+    if len(hits) < size:
+        try:
+            es.close_point_in_time(id=pit_id)
+        except NotFoundError:
+            pass
+        return products, None
+    return products, encode_cursor(pit_id, hits[-1]["sort"])
+
+
 def add_or_update_product(product: Product):
     """
     add or update product
-    convert product into json and store in elasticsearch
+    convert product into json and store in elasticsearch, then invalidate the search cache
+    the write waits for the next index refresh, so the cache is invalidated only once searches see the
+    new document and a search racing the write cannot cache the old one, get_product_by_id is realtime
     """
     es: Elasticsearch = get_es_client()
     document = asdict(product)
     logger.debug(json.dumps(document))
-    es.index(index="product", id=product.id, document=document)
+    es.index(index="product", id=product.id, document=document, refresh="wait_for")
+    productSearchCache.invalidate()
     logger.info(f"Product {product.id} created/updated")
 
 
+def set_picture_variants(product_id: str, picture_url: str, variants: dict):
+    """
+    record the downscaled copies of a product picture, a partial update that keeps concurrent
+    stock changes, then invalidate the search cache so lists return the thumbnails
+    nothing is written if the product's picture is no longer picture_url
+    """
+    es: Elasticsearch = get_es_client()
+    try:
+        es_result = es.update(index="product", id=product_id, retry_on_conflict=3, refresh="wait_for", script={
+            "source": SET_PICTURE_VARIANTS_SCRIPT,
+            "lang": "painless",
+            "params": {"picture_url": picture_url, "variants": variants},
+        })
+    except NotFoundError:
+        logger.info(f"Product {product_id} deleted before its picture variants were ready")
+        return
+    if es_result.get("result") == "noop":
+        logger.info(f"Product {product_id} picture replaced before the variants of {picture_url} were ready")
+        return
+    productSearchCache.invalidate()
+    logger.info(f"Product {product_id} picture variants recorded")
+
 
 def get_product_by_id(product_id) -> Product|None:
     """
@@ -79,4 +208,66 @@ def get_product_by_id(product_id) -> Product|None:
         product = Product(**es_result["_source"])
         return product
     except NotFoundError:
-        return None
\ No newline at end of file
+        return None
+
+
+def get_products_by_ids(product_ids: Iterable[str]) -> dict[str, Product]:
+    """
+    get many products by id from elasticsearch in one mget round trip
+    return a dict keyed by id, ids not found are absent from the dict
+    """
+    ids = list(dict.fromkeys(product_ids))
+    if not ids:
+        return {}
+    es: Elasticsearch = get_es_client()
+    try:
+        es_result = es.mget(index="product", ids=ids)
+    except NotFoundError:
+        return {}
+    products = {}
+    for doc in es_result.get("docs", []):
+        if doc.get("found"):
+            products[doc["_id"]] = Product(**doc["_source"])
+    logger.info(f"mget {len(ids)} products, found {len(products)}")
+    return products
+
+
+def bulk_add_or_update_products(products: Iterable[Product], chunk_size: int = 500, workers: int = 1,
+                                create_only: bool = False) -> dict:
+    """
+    add or update many products through the elasticsearch bulk helper
+    1. stream the products in chunks of chunk_size, with parallel_bulk if workers > 1
+    2. collect the failure of every document instead of stopping on the first one
+    3. refresh the index once and invalidate the search cache
+    if create_only is set, existing ids are reported as failures instead of overwritten
+    return the number of indexed documents and the failures
+    """
+    es: Elasticsearch = get_es_client()
+    op_type = "create" if create_only else "index"
+    actions = (
+        {"_op_type": op_type, "_index": "product", "_id": product.id, "_source": asdict(product)}
+        for product in products
+    )
+    options = {"chunk_size": chunk_size, "raise_on_error": False, "raise_on_exception": False}
+    if workers > 1:
+        results = parallel_bulk(es, actions, thread_count=workers, **options)
+    else:
+        results = streaming_bulk(es, actions, **options)
+
+    indexed = 0
+    failures = []
+    for ok, info in results:
+        if ok:
+            indexed += 1
+            continue
+        detail = info.get(op_type, info)
+        error = detail.get("error")
+        if error is None:
+            error = str(detail.get("exception", "unknown error"))
+        failures.append({"id": detail.get("_id"), "error": error})
+
+    if indexed:
+        es.indices.refresh(index="product")
+        productSearchCache.invalidate()
+    logger.info(f"bulk indexed {indexed} products, {len(failures)} failed")
+    return {"indexed": indexed, "failures": failures}
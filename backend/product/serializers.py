@@ -10,6 +10,16 @@ class ProductSerializer(serializers.Serializer):
     description = serializers.CharField()
     price = serializers.FloatField()
     picture_url = serializers.URLField(read_only=True)
+    picture_variants = serializers.DictField(read_only=True)
     category = serializers.CharField()
     seller_username = serializers.CharField(read_only=True)
     quantity = serializers.IntegerField()
+
+
+class ProductPageSerializer(serializers.Serializer):
+    """
+    Serializer for a cursor page of products
+    next_cursor is null when there are no more pages
+    """
+    results = ProductSerializer(many=True)
+    next_cursor = serializers.CharField(allow_null=True)
@@ -0,0 +1,165 @@
+import logging
+
+from elasticsearch import Elasticsearch, NotFoundError
+from backend.globalvars import get_es_client
+from product import productSearchCache
+
+logger = logging.getLogger(__name__)
+
+MAX_RESERVE_RETRIES = 5
+
+# the script guards against oversell on its own, if_seq_no/if_primary_term make sure
+# the stock we checked is the stock we update
+# the index is not force-refreshed after a stock change, reservations read stock with a realtime mget,
+# the bulk requests wait for the next periodic refresh instead, so the search cache is only
+# invalidated once searches see the new quantities and cannot cache the old ones again
+RESERVE_SCRIPT = """
+if (ctx._source.quantity < params.qty) {
+    ctx.op = 'noop';
+} else {
+    ctx._source.quantity -= params.qty;
+}
+"""
+RELEASE_SCRIPT = "ctx._source.quantity += params.qty"
+
+INSUFFICIENT = "insufficient"
+NOT_FOUND = "not_found"
+CONFLICT = "conflict"
+ERROR = "error"
+
+
+def _get_stock_versions(es: Elasticsearch, product_ids: list[str]) -> dict[str, dict]:
+    """
+    get quantity, seq_no and primary_term of many products in one mget round trip
+    """
+    es_result = es.mget(index="product", ids=product_ids, source_includes=["quantity"])
+    versions = {}
+    for doc in es_result.get("docs", []):
+        if doc.get("found"):
+            versions[doc["_id"]] = {
+                "quantity": doc["_source"]["quantity"],
+                "seq_no": doc["_seq_no"],
+                "primary_term": doc["_primary_term"],
+            }
+    return versions
+
+
+def _bulk_reserve(es: Elasticsearch, pending: dict[str, int], versions: dict[str, dict]) -> dict[str, str | None]:
+    """
+    decrement the stock of many products in one bulk request, every scripted partial update
+    is guarded by the seq_no/primary_term read before
+    return a dict of product id to failure reason, none if reserved, CONFLICT if it should be retried
+    """
+    operations = []
+    for product_id, qty in pending.items():
+        version = versions[product_id]
+        operations.append({"update": {
+            "_index": "product", "_id": product_id,
+            "if_seq_no": version["seq_no"], "if_primary_term": version["primary_term"],
+        }})
+        operations.append({"script": {"source": RESERVE_SCRIPT, "lang": "painless", "params": {"qty": qty}}})
+    es_result = es.bulk(operations=operations, refresh="wait_for")
+
+    results = {}
+    for item in es_result.get("items", []):
+        info = item["update"]
+        status = info.get("status")
+        if status == 409:
+            results[info["_id"]] = CONFLICT
+        elif status == 404:
+            results[info["_id"]] = NOT_FOUND
+        elif "error" in info:
+            logger.warning(f"reserve stock of {info['_id']} error: {info['error']}")
+            results[info["_id"]] = ERROR
+        elif info.get("result") == "noop":
+            results[info["_id"]] = INSUFFICIENT
+        else:
+            results[info["_id"]] = None
+    return results
+
+
+def reserve_stock(requested: dict[str, int]) -> dict[str, str]:
+    """
+    reserve stock of many products, all or nothing
+    1. read stock versions of all products in one round trip
+    2. decrement all products with guarded scripted updates in one bulk request
+    3. re-read and retry only the products hitting a version conflict, up to MAX_RESERVE_RETRIES times
+    4. if any product fails, release the products already reserved
+    return a dict of failed product id to reason, empty if all products are reserved
+    """
+    if not requested:
+        return {}
+    es: Elasticsearch = get_es_client()
+    try:
+        versions = _get_stock_versions(es, list(requested))
+    except NotFoundError:
+        return {product_id: NOT_FOUND for product_id in requested}
+
+    failures = {product_id: NOT_FOUND for product_id in requested if product_id not in versions}
+    reserved = {}
+    pending = {} if failures else dict(requested)
+    for attempt in range(MAX_RESERVE_RETRIES):
+        if not pending:
+            break
+        for product_id, qty in pending.items():
+            if versions[product_id]["quantity"] < qty:
+                failures[product_id] = INSUFFICIENT
+        if failures:
+            break
+
+        results = _bulk_reserve(es, pending, versions)
+        conflicted = []
+        for product_id, reason in results.items():
+            if reason is None:
+                reserved[product_id] = pending[product_id]
+            elif reason == CONFLICT:
+                conflicted.append(product_id)
+            else:
+                failures[product_id] = reason
+        if failures:
+            break
+
+        pending = {product_id: requested[product_id] for product_id in conflicted}
+        if pending:
+            logger.info(f"stock of {conflicted} changed concurrently, retry {attempt + 1}")
+            versions.update(_get_stock_versions(es, conflicted))
+            for product_id in conflicted:
+                if product_id not in versions:
+                    failures[product_id] = NOT_FOUND
+            if failures:
+                break
+    else:
+        failures.update({product_id: CONFLICT for product_id in pending})
+
+    if failures:
+        logger.info(f"stock reservation failed: {failures}")
+        release_stock(reserved)
+        return failures
+
+    productSearchCache.invalidate()
+    logger.info(f"stock reserved: {requested}")
+    return {}
+
+
+def release_stock(reserved: dict[str, int]):
+    """
+    give reserved stock back in one bulk request, used when an order cannot be completed
+    """
+    if not reserved:
+        return
+    es: Elasticsearch = get_es_client()
+    operations = []
+    for product_id, qty in reserved.items():
+        operations.append({"update": {"_index": "product", "_id": product_id,
+                                      "retry_on_conflict": MAX_RESERVE_RETRIES}})
+        operations.append({"script": {"source": RELEASE_SCRIPT, "lang": "painless", "params": {"qty": qty}}})
+    try:
+        es_result = es.bulk(operations=operations, refresh="wait_for")
+        for item in es_result.get("items", []):
+            if "error" in item["update"]:
+                logger.error(f"release stock of {item['update']['_id']} error: {item['update']['error']}")
+    except Exception:
+        logger.exception(f"release stock error, {reserved} lost")
+    productSearchCache.invalidate()
+    logger.info(f"stock released: {reserved}")
+
@@ -1,15 +1,26 @@
+import os
+import uuid
+from types import SimpleNamespace
+from unittest import skipIf
+
 from product.product import Product 
 from unittest.mock import patch
+from django.conf import settings
 from django.test import TestCase
 from rest_framework.test import APIClient
 from django.core.files.uploadedfile import SimpleUploadedFile
 
+from backend import imagePipeline
+from backend.models import ImageBlob, ImageUpload
+from backend.tests import use_temporary_image_storage
+from product import productService
 from user.models import User
 
 
 class ProductAPITest(TestCase):
 
     def setUp(self):
+        use_temporary_image_storage(self)
         self.client = APIClient()
         self.user = User.objects.create_user(
             email="seller@example.com",
@@ -81,4 +92,399 @@ class ProductAPITest(TestCase):
 
     def test_search_missing_keyword_returns_400(self):
         r = self.client.get("/api/product/search/")
-        self.assertEqual(r.status_code, 400, r.content)
\ No newline at end of file
+        self.assertEqual(r.status_code, 400, r.content)
+
+class ProductPictureVariantsTest(TestCase):
+    def setUp(self):
+        use_temporary_image_storage(self)
+        self.client = APIClient()
+        self.user = User.objects.create_user(email="seller@example.com", username="alice", password="Passw0rd!")
+        self.client.force_authenticate(user=self.user)
+
+    @patch("backend.imagePipeline._executor", new=SimpleNamespace(submit=lambda fn, *args: fn(*args)))
+    @patch("backend.imagePipeline.close_old_connections", new=lambda: None)
+    @patch("backend.imagePipeline.Image", new=object())
+    @patch("backend.imagePipeline.generate_variants")
+    @patch("product.views.productView.productService.set_picture_variants")
+    @patch("product.views.productView.productService.add_or_update_product")
+    def test_create_records_variants(self, mock_upsert, mock_set_variants, mock_generate):
+        mock_generate.return_value = {"160": {"webp": "backend/imageStorage/x_160w.webp"}}
+        r = self.client.post("/api/product/", {
+            "title": "lamp", "description": "desk lamp", "price": "5", "category": "home", "quantity": 1,
+            "picture": SimpleUploadedFile("lamp.jpg", b"fake_image_bytes", content_type="image/jpeg"),
+        }, format="multipart")
+
+        self.assertEqual(r.status_code, 201, r.content)
+        pid = r.json()["id"]
+        self.assertEqual(mock_upsert.call_args.args[0].picture_variants, {})
+        mock_generate.assert_called_once_with(r.json()["picture_url"])
+        mock_set_variants.assert_called_once_with(pid, r.json()["picture_url"], mock_generate.return_value)
+
+    @patch("product.views.productView.productService.add_or_update_product")
+    def test_create_with_direct_upload_path(self, mock_upsert):
+        fields = {"title": "lamp", "description": "desk lamp", "price": "5", "category": "home", "quantity": 1}
+        path = f"backend/imageStorage/{'a' * 64}.jpg"
+        r = self.client.post("/api/product/", {**fields, "picture_path": path}, format="json")
+        self.assertEqual(r.status_code, 400)
+        self.assertIn("picture_path", r.json())
+        mock_upsert.assert_not_called()
+
+        # stored, but uploaded by another user
+        other = User.objects.create_user(email="bob@example.com", username="bob", password="Passw0rd!")
+        ImageBlob.objects.create(directory="backend/imageStorage", sha256="a" * 64, path=path, size=1, ref_count=1)
+        ImageUpload.objects.create(key="a" * 32, user=other, purpose="product", path=path)
+        r = self.client.post("/api/product/", {**fields, "picture_path": path}, format="json")
+        self.assertEqual(r.status_code, 400)
+        mock_upsert.assert_not_called()
+
+        # the product takes over the reference of this user's completed upload, once
+        ImageUpload.objects.create(key="b" * 32, user=self.user, purpose="product", path=path)
+        r = self.client.post("/api/product/", {**fields, "picture_path": path}, format="json")
+        self.assertEqual(r.status_code, 201, r.content)
+        self.assertEqual(mock_upsert.call_args.args[0].picture_url, path)
+        self.assertTrue(ImageUpload.objects.get(key="b" * 32).claimed)
+        r = self.client.post("/api/product/", {**fields, "picture_path": path}, format="json")
+        self.assertEqual(r.status_code, 400)
+
+    @patch("product.views.productDetailsView.imagePipeline.submit")
+    @patch("product.views.productDetailsView.productService.add_or_update_product")
+    @patch("product.views.productDetailsView.productService.get_product_by_id")
+    def test_update_keeps_or_releases_own_picture(self, mock_get, mock_upsert, mock_submit):
+        fields = {"title": "lamp", "description": "desk lamp", "price": 5.0, "category": "home", "quantity": 1}
+        old_path, new_path = f"backend/imageStorage/{'a' * 64}.jpg", f"backend/imageStorage/{'b' * 64}.jpg"
+        ImageBlob.objects.create(directory="backend/imageStorage", sha256="a" * 64, path=old_path, size=1, ref_count=2)
+        ImageBlob.objects.create(directory="backend/imageStorage", sha256="b" * 64, path=new_path, size=1, ref_count=1)
+        mock_get.return_value = Product(id="p1", picture_url=old_path, seller_username="alice", **fields)
+
+        def put(picture_path, client=self.client):
+            return client.put("/api/product/details/p1", {**fields, "picture_path": picture_path}, format="json")
+
+        # only the seller may replace the picture, the blob references stay as they are
+        other = User.objects.create_user(email="bob@example.com", username="bob", password="Passw0rd!")
+        ImageUpload.objects.create(key="c" * 32, user=other, purpose="product", path=new_path)
+        client = APIClient()
+        client.force_authenticate(user=other)
+        self.assertEqual(put(new_path, client).status_code, 403)
+        self.assertEqual(put(new_path, APIClient()).status_code, 401)
+        self.assertFalse(ImageUpload.objects.get(key="c" * 32).claimed)
+        self.assertEqual(ImageBlob.objects.get(path=old_path).ref_count, 2)
+
+        # saved again with its own picture, nothing to claim or release
+        r = put(old_path)
+        self.assertEqual(r.status_code, 200, r.content)
+        self.assertEqual(ImageBlob.objects.get(path=old_path).ref_count, 2)
+
+        # a picture the user has not uploaded is refused and the old one is kept
+        r = put(new_path)
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(ImageBlob.objects.get(path=old_path).ref_count, 2)
+
+        ImageUpload.objects.create(key="b" * 32, user=self.user, purpose="product", path=new_path)
+        r = put(new_path)
+        self.assertEqual(r.status_code, 200, r.content)
+        self.assertEqual(ImageBlob.objects.get(path=old_path).ref_count, 1)
+        self.assertEqual(ImageBlob.objects.get(path=new_path).ref_count, 1)
+        self.assertEqual(mock_upsert.call_args.args[0].seller_username, "alice")
+
+        mock_get.return_value = None
+        self.assertEqual(put(new_path).status_code, 404)
+
+    @patch("product.productService.productSearchCache.invalidate")
+    @patch("product.productService.get_es_client")
+    def test_set_picture_variants_partial_update(self, mock_get_es, mock_invalidate):
+        es = mock_get_es.return_value
+        es.update.return_value = {"result": "updated"}
+        productService.set_picture_variants("p1", "a.jpg", {"160": {"jpeg": "a_160w.jpg"}})
+        es.update.assert_called_once()
+        script = es.update.call_args.kwargs["script"]
+        self.assertEqual(script["params"], {"picture_url": "a.jpg", "variants": {"160": {"jpeg": "a_160w.jpg"}}})
+        mock_invalidate.assert_called_once()
+
+        # the picture was replaced while the variants were generated, the script left it alone
+        es.update.return_value = {"result": "noop"}
+        productService.set_picture_variants("p1", "old.jpg", {"160": {"jpeg": "old_160w.jpg"}})
+        mock_invalidate.assert_called_once()
+
+    @skipIf(imagePipeline.Image is None, "pillow not installed")
+    def test_generate_variants_downscales(self):
+        from PIL import Image
+        path = f"backend/imageStorage/test-{uuid.uuid4().hex}.jpg"
+        Image.new("RGB", (600, 300), "red").save(os.path.join(settings.BASE_DIR, path))
+        variants = imagePipeline.generate_variants(path)
+        self.assertEqual(sorted(variants), ["160", "480"])
+        with Image.open(os.path.join(settings.BASE_DIR, variants["160"]["webp"])) as thumb:
+            self.assertEqual(thumb.size, (160, 80))
+
+
+class ProductSearchPaginationTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+
+    @patch("product.views.productListView.productService.search_products_page")
+    def test_search_with_cursor_returns_page(self, mock_page):
+        mock_page.return_value = ([{
+            "id": "p1", "title": "CLRS", "description": "used", "price": 10.0,
+            "picture_url": "", "category": "textbook", "seller_username": "alice", "quantity": 1,
+        }], "next-token")
+
+        r = self.client.get("/api/product/search/?keyword=all&size=1")
+        self.assertEqual(r.status_code, 200, r.content)
+        body = r.json()
+        self.assertEqual(body["next_cursor"], "next-token")
+        self.assertEqual(body["results"][0]["id"], "p1")
+        mock_page.assert_called_once_with("all", size=1, cursor=None)
+
+        r2 = self.client.get("/api/product/search/?keyword=all&size=1&cursor=next-token")
+        self.assertEqual(r2.status_code, 200, r2.content)
+        self.assertEqual(mock_page.call_args.kwargs["cursor"], "next-token")
+
+    def test_search_invalid_cursor_returns_400(self):
+        r = self.client.get("/api/product/search/?keyword=all&cursor=not-a-cursor")
+        self.assertEqual(r.status_code, 400, r.content)
+
+    def test_search_invalid_size_returns_400(self):
+        r = self.client.get("/api/product/search/?keyword=all&size=0")
+        self.assertEqual(r.status_code, 400, r.content)
+
+    @patch("product.productService.get_es_client")
+    def test_search_products_page_uses_pit_and_search_after(self, mock_get_es):
+        from product import productService
+
+        es = mock_get_es.return_value
+        es.open_point_in_time.return_value = {"id": "pit-1"}
+        es.search.return_value = {
+            "pit_id": "pit-2",
+            "hits": {"hits": [
+                {"_id": "a", "_source": {"title": "a"}, "sort": [20.0, "a"]},
+                {"_id": "b", "_source": {"title": "b"}, "sort": [10.0, "b"]},
+            ]},
+        }
+
+        products, cursor = productService.search_products_page("all", size=2)
+        self.assertEqual([p["id"] for p in products], ["a", "b"])
+        self.assertEqual(productService.decode_cursor(cursor), ("pit-2", [10.0, "b"]))
+        kwargs = es.search.call_args.kwargs
+        self.assertEqual(kwargs["pit"]["id"], "pit-1")
+        self.assertEqual(kwargs["sort"][-1], {"id": {"order": "asc"}})
+        self.assertNotIn("from_", kwargs)
+
+        es.search.return_value = {"pit_id": "pit-2", "hits": {"hits": []}}
+        products, next_cursor = productService.search_products_page("all", size=2, cursor=cursor)
+        self.assertEqual(products, [])
+        self.assertIsNone(next_cursor)
+        self.assertEqual(es.search.call_args.kwargs["search_after"], [10.0, "b"])
+        es.close_point_in_time.assert_called_once_with(id="pit-2")
+
+
+class ProductSearchCacheTest(TestCase):
+
+    def setUp(self):
+        from product import productSearchCache
+        productSearchCache.invalidate()
+
+    @patch("product.productService.get_es_client")
+    def test_search_cached_until_product_written(self, mock_get_es):
+        from product import productService, productSearchCache
+
+        es = mock_get_es.return_value
+        es.search.return_value = {
+            "hits": {"total": {"value": 1}, "hits": [{"_id": "a", "_source": {"title": "a"}}]},
+        }
+        stats = productSearchCache.get_stats()
+
+        first = productService.list_products_by_keyword("Textbook")
+        second = productService.list_products_by_keyword("  textbook ")
+        self.assertEqual(first, second)
+        self.assertEqual(es.search.call_count, 1)
+
+        productService.add_or_update_product(Product(
+            id="a", title="a", description="", price=1.0, picture_url="",
+            category="textbook", seller_username="alice", quantity=0,
+        ))
+        # the cache is invalidated once the new document is searchable
+        self.assertEqual(es.index.call_args.kwargs["refresh"], "wait_for")
+        productService.list_products_by_keyword("textbook")
+        self.assertEqual(es.search.call_count, 2)
+
+        new_stats = productSearchCache.get_stats()
+        self.assertEqual(new_stats["hits"] - stats["hits"], 1)
+        self.assertEqual(new_stats["misses"] - stats["misses"], 2)
+
+    @patch("product.productService.get_es_client")
+    def test_search_racing_invalidation_not_cached(self, mock_get_es):
+        from product import productService, productSearchCache
+
+        def search_while_product_written(**kwargs):
+            productSearchCache.invalidate()
+            return {"hits": {"total": {"value": 0}, "hits": []}}
+
+        es = mock_get_es.return_value
+        es.search.side_effect = search_while_product_written
+        productService.list_products_by_keyword("lamp")
+        productService.list_products_by_keyword("lamp")
+        self.assertEqual(es.search.call_count, 2)
+
+
+class ProductImportTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            email="seller@example.com",
+            username="alice",
+            password="Passw0rd!",
+        )
+        self.client.force_authenticate(user=self.user)
+
+    @patch("product.productImport.productService.bulk_add_or_update_products")
+    def test_import_ndjson_reports_invalid_rows(self, mock_bulk):
+        mock_bulk.side_effect = lambda products, **kwargs: {"indexed": len(list(products)), "failures": []}
+        content = (
+            b'{"title": "CLRS", "description": "used", "price": 10, "category": "textbook", "quantity": 2,'
+            b' "seller_username": "mallory"}\n'
+            b'{"title": "SICP", "description": "new", "price": "abc", "category": "textbook", "quantity": 1}\n'
+            b'not json\n'
+        )
+        upload = SimpleUploadedFile("products.ndjson", content, content_type="application/x-ndjson")
+
+        r = self.client.post("/api/product/import/", {"file": upload}, format="multipart")
+        self.assertEqual(r.status_code, 200, r.content)
+        body = r.json()
+        self.assertEqual(body["indexed"], 1)
+        self.assertEqual([f["line"] for f in body["failures"]], [2, 3])
+        self.assertTrue(mock_bulk.call_args.kwargs["create_only"])
+
+    @patch("product.productImport.productService.bulk_add_or_update_products")
+    def test_import_csv_overrides_seller(self, mock_bulk):
+        imported = []
+        mock_bulk.side_effect = lambda products, **kwargs: imported.extend(products) or {
+            "indexed": len(imported), "failures": []}
+        content = b"title,description,price,category,quantity,seller_username\nCLRS,used,10.5,textbook,2,mallory\n"
+        upload = SimpleUploadedFile("products.csv", content, content_type="text/csv")
+
+        r = self.client.post("/api/product/import/", {"file": upload, "chunk_size": 100}, format="multipart")
+        self.assertEqual(r.status_code, 200, r.content)
+        self.assertEqual(len(imported), 1)
+        self.assertEqual(imported[0].seller_username, "alice")
+        self.assertEqual(imported[0].price, 10.5)
+        self.assertEqual(imported[0].quantity, 2)
+        self.assertEqual(mock_bulk.call_args.kwargs["chunk_size"], 100)
+
+    def test_import_unsupported_format_returns_400(self):
+        upload = SimpleUploadedFile("products.txt", b"", content_type="text/plain")
+        r = self.client.post("/api/product/import/", {"file": upload}, format="multipart")
+        self.assertEqual(r.status_code, 400, r.content)
+
+    @patch("product.productService.streaming_bulk")
+    @patch("product.productService.get_es_client")
+    def test_bulk_collects_document_failures(self, mock_get_es, mock_streaming_bulk):
+        from product import productService
+
+        mock_streaming_bulk.return_value = iter([
+            (True, {"index": {"_id": "a", "status": 201}}),
+            (False, {"index": {"_id": "b", "status": 400, "error": {"type": "mapper_parsing_exception"}}}),
+        ])
+        products = [
+            Product(id=pid, title="t", description="d", price=1.0, picture_url="",
+                    category="c", seller_username="alice", quantity=1)
+            for pid in ("a", "b")
+        ]
+        result = productService.bulk_add_or_update_products(products, chunk_size=10)
+        self.assertEqual(result["indexed"], 1)
+        self.assertEqual(result["failures"], [{"id": "b", "error": {"type": "mapper_parsing_exception"}}])
+        self.assertEqual(mock_streaming_bulk.call_args.kwargs["chunk_size"], 10)
+        mock_get_es.return_value.indices.refresh.assert_called_once_with(index="product")
+
+
+class ProductMultiGetTest(TestCase):
+
+    @patch("product.productService.get_es_client")
+    def test_get_products_by_ids_uses_one_mget(self, mock_get_es):
+        from product import productService
+
+        source = {"id": "a", "title": "t", "description": "d", "price": 1.0, "picture_url": "",
+                  "category": "c", "seller_username": "alice", "quantity": 1}
+        es = mock_get_es.return_value
+        es.mget.return_value = {"docs": [
+            {"_id": "a", "found": True, "_source": source},
+            {"_id": "b", "found": False},
+        ]}
+
+        products = productService.get_products_by_ids(["a", "b", "a"])
+        self.assertEqual(list(products), ["a"])
+        self.assertEqual(products["a"].seller_username, "alice")
+        es.mget.assert_called_once_with(index="product", ids=["a", "b"])
+
+
+class StockReservationTest(TestCase):
+
+    @staticmethod
+    def _bulk_result(*items):
+        return {"items": [{"update": item} for item in items]}
+
+    @patch("product.stockService.get_es_client")
+    def test_reserve_sends_one_bulk_and_retries_conflicts(self, mock_get_es):
+        from product import stockService
+
+        es = mock_get_es.return_value
+        es.mget.side_effect = [
+            {"docs": [
+                {"_id": "a", "found": True, "_source": {"quantity": 5}, "_seq_no": 1, "_primary_term": 1},
+                {"_id": "b", "found": True, "_source": {"quantity": 5}, "_seq_no": 7, "_primary_term": 1},
+            ]},
+            {"docs": [
+                {"_id": "b", "found": True, "_source": {"quantity": 4}, "_seq_no": 8, "_primary_term": 1},
+            ]},
+        ]
+        es.bulk.side_effect = [
+            self._bulk_result({"_id": "a", "status": 200, "result": "updated"},
+                              {"_id": "b", "status": 409, "error": {"type": "version_conflict_engine_exception"}}),
+            self._bulk_result({"_id": "b", "status": 200, "result": "updated"}),
+        ]
+
+        self.assertEqual(stockService.reserve_stock({"a": 3, "b": 2}), {})
+        first, second = es.bulk.call_args_list
+        self.assertEqual(len(first.kwargs["operations"]), 4)
+        # the cache is invalidated after the new quantities are searchable
+        self.assertEqual(first.kwargs["refresh"], "wait_for")
+        retry_action, retry_script = second.kwargs["operations"]
+        self.assertEqual(retry_action["update"]["_id"], "b")
+        self.assertEqual(retry_action["update"]["if_seq_no"], 8)
+        self.assertEqual(retry_script["script"]["params"], {"qty": 2})
+        self.assertNotIn("doc", retry_script)
+
+    @patch("product.stockService.get_es_client")
+    def test_reserve_is_all_or_nothing(self, mock_get_es):
+        from product import stockService
+
+        es = mock_get_es.return_value
+        es.mget.return_value = {"docs": [
+            {"_id": "a", "found": True, "_source": {"quantity": 5}, "_seq_no": 1, "_primary_term": 1},
+            {"_id": "b", "found": True, "_source": {"quantity": 5}, "_seq_no": 1, "_primary_term": 1},
+        ]}
+        # b was sold out between mget and update, the script turns the update into a noop
+        es.bulk.side_effect = [
+            self._bulk_result({"_id": "a", "status": 200, "result": "updated"},
+                              {"_id": "b", "status": 200, "result": "noop"}),
+            self._bulk_result({"_id": "a", "status": 200, "result": "updated"}),
+        ]
+
+        self.assertEqual(stockService.reserve_stock({"a": 1, "b": 1}), {"b": stockService.INSUFFICIENT})
+        release_action, release_script = es.bulk.call_args_list[-1].kwargs["operations"]
+        self.assertEqual(es.bulk.call_args_list[-1].kwargs["refresh"], "wait_for")
+        self.assertEqual(release_action["update"]["_id"], "a")
+        self.assertEqual(release_script["script"]["source"], stockService.RELEASE_SCRIPT)
+
+    @patch("product.stockService.get_es_client")
+    def test_reserve_gives_up_after_bounded_retries(self, mock_get_es):
+        from product import stockService
+
+        es = mock_get_es.return_value
+        es.mget.return_value = {"docs": [
+            {"_id": "a", "found": True, "_source": {"quantity": 5}, "_seq_no": 1, "_primary_term": 1},
+        ]}
+        es.bulk.return_value = self._bulk_result({"_id": "a", "status": 409, "error": {}})
+
+        self.assertEqual(stockService.reserve_stock({"a": 1}), {"a": stockService.CONFLICT})
+        self.assertEqual(es.bulk.call_count, stockService.MAX_RESERVE_RETRIES)
@@ -17,12 +17,16 @@ Including another URLconf
 from django.urls import path
 
 from .views.productDetailsView import ProductDetailsView
+from .views.productImportView import ProductImportView
 from .views.productListView import ProductListView
+from .views.productSearchCacheView import ProductSearchCacheStatsView
 from .views.productView import ProductView
 
 urlpatterns = [
     path('', ProductView.as_view()),
     path('details/<str:id>', ProductDetailsView.as_view()),
+    path('import/', ProductImportView.as_view()),
 
     path('search/', ProductListView.as_view()),
+    path('search/cache-stats/', ProductSearchCacheStatsView.as_view()),
 ]
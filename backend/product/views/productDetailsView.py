@@ -1,20 +1,24 @@
 import logging
 
 from drf_spectacular.utils import extend_schema, OpenApiResponse
-from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from rest_framework.request import Request
 from rest_framework.response import Response
-from rest_framework.status import HTTP_200_OK
+from rest_framework.status import HTTP_200_OK, HTTP_413_REQUEST_ENTITY_TOO_LARGE
 from rest_framework.views import APIView
 
+from backend import imagePipeline, imageService
 from product import productService
 from product.product import Product
 from product.serializers import ProductSerializer
+from product.views.productView import store_picture
 
 logger = logging.getLogger(__name__)
 
 
 class ProductDetailsView(APIView):
+    permission_classes = [IsAuthenticatedOrReadOnly]
 
     @extend_schema(
         summary='get a product details',
@@ -49,31 +53,57 @@ class ProductDetailsView(APIView):
                     'price': {'type': 'number'},
                     'quantity': {'type': 'number'},
                     'picture': {'type': 'string', 'format': 'binary'},
+                    'picture_path': {'type': 'string'},
                 },
-                'required': ['title', 'description', 'category', 'seller_username', 'price', 'picture'],
+                'required': ['title', 'description', 'category', 'seller_username', 'price'],
             }
         },
         responses={
             201: ProductSerializer,
             400: OpenApiResponse(description="product info not complete or no picture uploaded"),
+            401: OpenApiResponse(description='user not authenticated'),
+            403: OpenApiResponse(description='product of another seller'),
+            404: OpenApiResponse(description='product not found'),
+            413: OpenApiResponse(description='picture too large'),
         },
     )
-    def put(self, request: Request, product_id: str) -> Response:
+    def put(self, request: Request, id: str) -> Response:
         """
         update product details
-        1. verify the request is valid, new picture is provided
+        1. verify the product belongs to the user before any picture is claimed or released
+        2. verify the request is valid, new picture or picture_path of a direct upload is provided
+        3. store the new picture, content addressed, or claim the direct upload, and drop the reference
+           to the old one
+        4. regenerate thumbnails in the background, until then the product has none
         """
+        if imageService.request_too_large(request):
+            return Response({"error": f"picture larger than {imageService.MAX_IMAGE_BYTES} bytes"},
+                            status=HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        old_product = productService.get_product_by_id(id)
+        if old_product is None:
+            raise NotFound()
+        if old_product.seller_username != request.user.username:
+            raise PermissionDenied("product of another seller")
         data = request.data
         picture = request.FILES.get("picture")
+        picture_path = data.get("picture_path")
         logger.info(data)
         serializer = ProductSerializer(data=data)
-        if serializer.is_valid() and picture:
-            picture_url = f"backend/imageStorage/{product_id}.jpg"
-            with open(picture_url, "wb") as file:
-                file.write(picture.read())
-            productService.add_or_update_product(
-                Product(id=product_id, picture_url=picture_url, **serializer.validated_data))
-            return Response({'id': product_id, "picture_url": picture_url, **serializer.data},
+        if serializer.is_valid() and (picture or picture_path):
+            if not picture and picture_path == old_product.picture_url:
+                # saved again with its own picture, the product keeps the reference it holds
+                picture_url = picture_path
+            else:
+                picture_url = store_picture(picture, picture_path, request.user.id)
+            productService.add_or_update_product(Product(id=id, picture_url=picture_url,
+                                                         seller_username=old_product.seller_username,
+                                                         **serializer.validated_data))
+            # the old picture is released once, by the product that held it
+            if old_product.picture_url and (picture or old_product.picture_url != picture_url):
+                imageService.release(old_product.picture_url)
+            imagePipeline.submit(picture_url, lambda variants: productService.set_picture_variants(
+                id, picture_url, variants))
+            return Response({'id': id, "picture_url": picture_url, **serializer.data},
                             status=HTTP_200_OK)
         else:
             raise ValidationError(serializer.errors)
@@ -0,0 +1,79 @@
+import codecs
+import logging
+
+from drf_spectacular.utils import extend_schema, OpenApiResponse
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from product import productImport
+
+logger = logging.getLogger(__name__)
+
+MAX_CHUNK_SIZE = 2000
+MAX_WORKERS = 4
+
+
+class ProductImportView(APIView):
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser, FormParser]
+
+    @extend_schema(
+        summary='bulk import products of the current user',
+        request={
+            'multipart/form-data': {
+                'type': 'object',
+                'properties': {
+                    'file': {'type': 'string', 'format': 'binary'},
+                    'format': {'type': 'string', 'enum': list(productImport.SUPPORTED_FORMATS)},
+                    'chunk_size': {'type': 'integer'},
+                    'workers': {'type': 'integer'},
+                },
+                'required': ['file'],
+            }
+        },
+        responses={
+            200: {"example": {"indexed": 1, "failures": [{"line": 2, "error": "price must be float"}]}},
+            400: OpenApiResponse(description="no file uploaded or unsupported format"),
+            401: OpenApiResponse(description='user not authenticated'),
+        },
+    )
+    def post(self, request: Request) -> Response:
+        """
+        bulk import products
+        1. every product is owned by the current user, existing ids are never overwritten
+        2. the file is streamed line by line into the bulk helper
+        3. return the number of indexed products and the failure of every other row
+        """
+        upload = request.FILES.get("file")
+        if not upload:
+            raise ValidationError(detail="file required")
+        fmt = request.data.get("format") or productImport.guess_format(upload.name)
+        if fmt not in productImport.SUPPORTED_FORMATS:
+            raise ValidationError(detail="unsupported format, use ndjson or csv")
+        try:
+            chunk_size = int(request.data.get("chunk_size", 500))
+            workers = int(request.data.get("workers", 1))
+        except ValueError:
+            raise ValidationError(detail="chunk_size and workers must be integers")
+        if not 1 <= chunk_size <= MAX_CHUNK_SIZE or not 1 <= workers <= MAX_WORKERS:
+            raise ValidationError(
+                detail=f"chunk_size must be 1-{MAX_CHUNK_SIZE} and workers must be 1-{MAX_WORKERS}")
+
+        lines = codecs.iterdecode(upload, "utf-8")
+        try:
+            result = productImport.import_products(
+                lines, fmt,
+                seller_username=request.user.username,
+                chunk_size=chunk_size,
+                workers=workers,
+                create_only=True,
+            )
+        except UnicodeDecodeError:
+            raise ValidationError(detail="file must be utf-8 encoded")
+        logger.info(f"user {request.user.username} imported {result['indexed']} products")
+        return Response(result, status=status.HTTP_200_OK)
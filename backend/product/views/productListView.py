@@ -7,27 +7,56 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from product import productService
-from product.serializers import ProductSerializer
+from product.serializers import ProductSerializer, ProductPageSerializer
 
 logger = logging.getLogger(__name__)
 
+MAX_PAGE_SIZE = 100
+
 
 class ProductListView(APIView):
     @extend_schema(
         summary='search product by keyword',
-        parameters=[OpenApiParameter(name='keyword', type=str, location=OpenApiParameter.QUERY, required=True)],
-        responses={200: ProductSerializer(many=True)},
+        description='returns a plain list of the first page, or a cursor page if cursor or size is provided',
+        parameters=[
+            OpenApiParameter(name='keyword', type=str, location=OpenApiParameter.QUERY, required=True),
+            OpenApiParameter(name='cursor', type=str, location=OpenApiParameter.QUERY, required=False,
+                             description='next_cursor returned by the previous page'),
+            OpenApiParameter(name='size', type=int, location=OpenApiParameter.QUERY, required=False,
+                             description=f'page size, at most {MAX_PAGE_SIZE}'),
+        ],
+        responses={
+            200: ProductSerializer(many=True),
+            400: OpenApiResponse(description='keyword not provided or invalid cursor/size'),
+        },
     )
     def get(self,request: HttpRequest):
         """
         get products by keyword
+        if cursor or size is provided, return one page and the cursor of the next page
         """
         data = request.GET
         logger.info(data)
-        if data.get("keyword"):
+        if not data.get("keyword"):
+            raise ValidationError(detail="keyword not provided")
+
+        if "cursor" not in data and "size" not in data:
             products: list[dict] = productService.list_products_by_keyword(data.get("keyword"))
             serializer = ProductSerializer(products, many=True)
             return Response(serializer.data)
-        else:
-            raise ValidationError(detail="keyword not provided")
+
+        try:
+            size = int(data.get("size", productService.DEFAULT_PAGE_SIZE))
+        except ValueError:
+            raise ValidationError(detail="size must be an integer")
+        if not 1 <= size <= MAX_PAGE_SIZE:
+            raise ValidationError(detail=f"size must be between 1 and {MAX_PAGE_SIZE}")
+
+        try:
+            products, next_cursor = productService.search_products_page(
+                data.get("keyword"), size=size, cursor=data.get("cursor") or None)
+        except ValueError:
+            raise ValidationError(detail="invalid cursor")
+        serializer = ProductPageSerializer({"results": products, "next_cursor": next_cursor})
+        return Response(serializer.data)
 
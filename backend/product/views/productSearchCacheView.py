@@ -0,0 +1,21 @@
+from drf_spectacular.utils import extend_schema, OpenApiResponse
+from rest_framework.permissions import IsAdminUser
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from product import productSearchCache
+
+
+class ProductSearchCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(
+        summary='get product search cache hit and miss counters',
+        responses={
+            200: {"example": {"hits": 0, "misses": 0, "generation": 0}},
+            403: OpenApiResponse(description='user is not an admin'),
+        },
+    )
+    def get(self, request: Request) -> Response:
+        return Response(productSearchCache.get_stats())
@@ -9,6 +9,7 @@ from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from backend import imagePipeline, imageService
 from product import productService
 from product.product import Product
 from product.serializers import ProductSerializer
@@ -16,6 +17,25 @@ from product.serializers import ProductSerializer
 logger = logging.getLogger(__name__)
 
 
+def store_picture(picture, picture_path: str | None, user_id: int | None) -> str:
+    """
+    path of the product picture, either an uploaded file stored now or picture_path of an image
+    this user uploaded directly to storage, see backend.views.uploadView
+    either way the product holds one reference to the picture, released when it is replaced
+    raise ValidationError if the file is too large or picture_path is not an unclaimed upload of this user
+    """
+    if picture:
+        try:
+            picture_url, _ = imageService.store_upload(picture, imageService.PRODUCT_IMAGE_DIR, ".jpg")
+        except ValueError as e:
+            raise ValidationError({"picture": [str(e)]})
+        return picture_url
+    # the reference taken when the upload was completed becomes the reference of this product
+    if not imageService.claim_upload(user_id, picture_path, "product"):
+        raise ValidationError({"picture_path": ["picture not uploaded"]})
+    return picture_path
+
+
 class ProductView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -31,37 +51,45 @@ class ProductView(APIView):
                     'price': {'type': 'number'},
                     'quantity': {'type': 'number'},
                     'picture': {'type': 'string', 'format': 'binary'},
+                    'picture_path': {'type': 'string'},
                 },
-                'required': ['title', 'description', 'category', 'price', 'picture'],
+                'required': ['title', 'description', 'category', 'price'],
             }
         },
         responses={
             201: ProductSerializer,
             400: OpenApiResponse(description="product info not complete or no picture uploaded"),
             401: OpenApiResponse(description='user not authenticated'),
+            413: OpenApiResponse(description='picture too large'),
         },
     )
     def post(self, request: Request):
         """
         add product
-        1. verify the request
-        2. write picture into storage
+        1. verify the request, oversized uploads are rejected before the body is read
+        2. stream picture into storage, a picture uploaded before is not stored again, or use picture_path
+           of a picture uploaded directly to storage
         3. write product into elasticsearch
-        4. return product
+        4. generate thumbnails in the background, they are added to the product when ready
+        5. return product
         """
+        if imageService.request_too_large(request):
+            return Response({"error": f"picture larger than {imageService.MAX_IMAGE_BYTES} bytes"},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
         data = request.data
         logger.info(data)
         seller_username = request.user.username
         picture = request.FILES.get("picture")
+        picture_path = data.get("picture_path")
         logger.info(data)
         serializer = ProductSerializer(data=data)
-        if serializer.is_valid() and picture:
+        if serializer.is_valid() and (picture or picture_path):
             product_id = uuid.uuid4().hex
-            picture_url = f"backend/imageStorage/{product_id}.jpg"
-            with open(picture_url, "wb") as file:
-                file.write(picture.read())
+            picture_url = store_picture(picture, picture_path, request.user.id)
             product = Product(id=product_id, picture_url=picture_url, seller_username=seller_username, **serializer.validated_data)
             productService.add_or_update_product(product)
+            imagePipeline.submit(picture_url, lambda variants: productService.set_picture_variants(
+                product_id, picture_url, variants))
             return Response({
                 'id': product_id,
                 "picture_url": picture_url,
@@ -0,0 +1,50 @@
+import logging
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.http import QueryDict
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from user.services import userCache
+
+logger = logging.getLogger(__name__)
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    asgi middleware authenticating websocket connections with the access token in the `token` query param
+    the token is verified by simplejwt, the user comes from userCache, so reconnects do not hit the user table
+    scope["user"] is the user, or AnonymousUser if the token is missing, invalid or the user is inactive
+    """
+
+    def __init__(self, inner):
+        super().__init__(inner)
+        self.authentication = JWTAuthentication()
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        scope["user"] = await self.authenticate(scope)
+        return await super().__call__(scope, receive, send)
+
+    async def authenticate(self, scope):
+        query_dict = QueryDict(scope.get("query_string", b"").decode("utf-8"))
+        raw_token = query_dict.get("token")
+        if not raw_token:
+            return AnonymousUser()
+        try:
+            token = self.authentication.get_validated_token(raw_token)
+        except (InvalidToken, TokenError) as e:
+            logger.info("WS auth: invalid token, %s", e)
+            return AnonymousUser()
+
+        user_id = token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return AnonymousUser()
+        user = await database_sync_to_async(userCache.get_user)(user_id)
+        if user is None or not user.is_active:
+            logger.info("WS auth: user %s not found or inactive", user_id)
+            return AnonymousUser()
+        return user
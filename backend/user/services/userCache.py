@@ -0,0 +1,104 @@
+# user/services/userCache.py
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from user.models import User
+
+logger = logging.getLogger(__name__)
+
+LOCAL_CACHE_SIZE = 1024
+LOCAL_CACHE_TTL_SECONDS = 30        # 进程内缓存, 其他进程的修改最多 30 秒后可见
+SHARED_CACHE_TTL_SECONDS = 5 * 60   # redis 缓存, 资料更新时主动删除
+
+# fields needed to identify a user on a websocket, everything else is loaded lazily
+IDENTITY_FIELDS = ("id", "email", "username", "first_name", "last_name", "avatar_url", "is_active", "is_staff")
+
+_local: OrderedDict[int, tuple[float, tuple]] = OrderedDict()
+_lock = threading.Lock()
+
+
+def _cache_key(user_id) -> str:
+    return f"user_identity:{int(user_id)}"
+
+
+def _to_user(values: tuple) -> User:
+    # an instance loaded from the db with only the identity fields, the others are deferred
+    return User.from_db("default", IDENTITY_FIELDS, values)
+
+
+def _get_local(user_id: int) -> tuple | None:
+    with _lock:
+        entry = _local.get(user_id)
+        if entry is None:
+            return None
+        expires_at, values = entry
+        if expires_at < time.monotonic():
+            del _local[user_id]
+            return None
+        _local.move_to_end(user_id)
+        return values
+
+
+def _set_local(user_id: int, values: tuple):
+    with _lock:
+        _local[user_id] = (time.monotonic() + LOCAL_CACHE_TTL_SECONDS, values)
+        _local.move_to_end(user_id)
+        while len(_local) > LOCAL_CACHE_SIZE:
+            _local.popitem(last=False)
+
+
+def get_user(user_id) -> User | None:
+    """
+    get a user by id for authentication
+    1. look in the in-process lru
+    2. look in redis
+    3. load the identity fields from the db and fill both caches
+    return none if the user does not exist
+    redis errors are treated as a miss so authentication keeps working without redis
+    """
+    user_id = int(user_id)
+    values = _get_local(user_id)
+    if values is not None:
+        return _to_user(values)
+
+    try:
+        values = cache.get(_cache_key(user_id))
+    except Exception:
+        logger.exception("read user identity cache error")
+        values = None
+    if values is None:
+        values = User.objects.filter(id=user_id).values_list(*IDENTITY_FIELDS).first()
+        if values is None:
+            return None
+        try:
+            cache.set(_cache_key(user_id), values, timeout=SHARED_CACHE_TTL_SECONDS)
+        except Exception:
+            logger.exception("write user identity cache error")
+
+    values = tuple(values)
+    _set_local(user_id, values)
+    return _to_user(values)
+
+
+def invalidate(user_id):
+    """
+    drop a cached user, called whenever the profile changes
+    """
+    with _lock:
+        _local.pop(int(user_id), None)
+    try:
+        cache.delete(_cache_key(user_id))
+    except Exception:
+        logger.exception(f"invalidate user identity cache of {user_id} error")
+
+
+def clear_local():
+    """
+    drop the in-process entries, used by tests
+    """
+    with _lock:
+        _local.clear()
@@ -4,7 +4,12 @@ from rest_framework.test import APITestCase
 
 from unittest.mock import patch
 
+from asgiref.sync import async_to_sync
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from user.middleware import JWTAuthMiddleware
 from user.models import User
+from user.services import userCache
 
 
 class UserAPITest(APITestCase):
@@ -39,4 +44,47 @@ class UserAPITest(APITestCase):
         self.assertEqual(user_data["email"], payload["email"])
         self.assertEqual(user_data["username"], payload["username"])
         self.assertEqual(user_data["first_name"], payload["first_name"])
-        self.assertEqual(user_data["last_name"], payload["last_name"])
\ No newline at end of file
+        self.assertEqual(user_data["last_name"], payload["last_name"])
+
+
+class WebsocketAuthTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="alice@example.com", username="alice", password="Passw0rd!")
+        userCache.clear_local()
+        userCache.invalidate(self.user.id)
+
+    def _authenticate(self, token):
+        scopes = []
+
+        async def inner(scope, receive, send):
+            scopes.append(scope)
+
+        async_to_sync(JWTAuthMiddleware(inner))(
+            {"type": "websocket", "query_string": f"token={token}".encode()}, None, None)
+        return scopes[0]["user"]
+
+    def test_token_resolves_cached_user(self):
+        token = str(RefreshToken.for_user(self.user).access_token)
+        with self.assertNumQueries(1):
+            user = self._authenticate(token)
+        self.assertEqual(user.id, self.user.id)
+        self.assertEqual(user.username, "alice")
+
+        # served from the in-process cache, then from the shared cache
+        with self.assertNumQueries(0):
+            self._authenticate(token)
+        userCache.clear_local()
+        with self.assertNumQueries(0):
+            self._authenticate(token)
+
+        self.assertFalse(self._authenticate("garbage").is_authenticated)
+        self.assertFalse(self._authenticate(str(RefreshToken.for_user(self.user))).is_authenticated)
+
+    def test_profile_update_invalidates_cache(self):
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self._authenticate(token)
+
+        self.client.force_authenticate(user=self.user)
+        res = self.client.patch("/api/user/updateProfile/", {"username": "alice2"}, format="json")
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._authenticate(token).username, "alice2")
@@ -7,6 +7,7 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 
+from user.services import userCache
 from user.services.userService import (
     send_verification_code,
     verify_code,
@@ -180,6 +181,8 @@ class UpdateProfileView(APIView):
         serializer = UserSerializer(user, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
+            # websocket authentication reads the user from this cache
+            userCache.invalidate(user.id)
             return Response(
                 {
                     "message": "Profile updated successfully",
@@ -20,6 +20,10 @@ export type OrderSummaryDto = {
   created_at: string;
   updated_at: string;
 };
+export type OrderSummaryPageDto = {
+  results: OrderSummaryDto[];
+  next_cursor: string | null;
+};
 export type OrderItemDto = {
   order_number: string;
   product_id: string;
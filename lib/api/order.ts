@@ -7,7 +7,7 @@ import {
   CreateOrderRequest,
   CreateOrderResponse,
   OrderDetailDto,
-  OrderSummaryDto
+  OrderSummaryPageDto
 } from "../../interfaces/Order.interface";
 
 function normalizeStatus(raw: string): OrderStatus {
@@ -51,10 +51,12 @@ export function useOrderApi() {
     [postData]
   );
 
+  // one page of orders, newest first, pass next_cursor of the previous page to get the next one
   const listOrders = useCallback(
-    async (): Promise<OrderSummaryDto[]> => {
-      const data = await getData("/api/order/");
-      return (Array.isArray(data) ? data : []) as OrderSummaryDto[];
+    async (cursor?: string | null): Promise<OrderSummaryPageDto> => {
+      const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+      const data = (await getData(`/api/order/${query}`)) as OrderSummaryPageDto | null;
+      return {results: data?.results ?? [], next_cursor: data?.next_cursor ?? null};
     },
     [getData]
   );